@@ -0,0 +1,42 @@
+"""
+Alembic environment. The database URL and the models come from the app, so migrations run
+against the same DATABASE_URL as the server; app.migrate passes an open connection instead.
+"""
+from logging.config import fileConfig
+import asyncio
+
+from alembic import context
+from sqlalchemy import pool
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import database, models  # noqa: F401 (models registers the tables on Base.metadata)
+
+target_metadata = database.Base.metadata
+
+if context.config.config_file_name is not None:
+    fileConfig(context.config.config_file_name, disable_existing_loggers=False)
+
+
+def run_migrations(connection):
+    # render_as_batch: SQLite (local testing) can only alter tables by copying them
+    context.configure(connection=connection, target_metadata=target_metadata,
+                      render_as_batch=connection.dialect.name == "sqlite")
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations():
+    engine = create_async_engine(database.ASYNC_DATABASE_URL, poolclass=pool.NullPool)
+    async with engine.connect() as connection:
+        await connection.run_sync(run_migrations)
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    context.configure(url=database.SQLALCHEMY_DATABASE_URL, target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+elif context.config.attributes.get("connection") is not None:
+    run_migrations(context.config.attributes["connection"])
+else:
+    asyncio.run(run_async_migrations())
@@ -0,0 +1,55 @@
+"""Sequence messages written before Message.seq and Message.model_id existed
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:12:31.504718
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The columns as of this revision, so later changes to app.models don't change what it does
+conversations = sa.table('conversations', sa.column('id', sa.Integer), sa.column('next_seq', sa.Integer))
+messages = sa.table(
+    'messages',
+    sa.column('id', sa.Integer), sa.column('conversation_id', sa.Integer), sa.column('seq', sa.Integer),
+    sa.column('role', sa.String), sa.column('model_id', sa.Integer), sa.column('created_at', sa.DateTime),
+)
+generation_metadata = sa.table(
+    'generation_metadata', sa.column('id', sa.Integer), sa.column('message_id', sa.Integer), sa.column('model_id', sa.Integer),
+)
+
+
+def upgrade() -> None:
+    # Each conversation with unsequenced messages is numbered again in (created_at, id) order,
+    # replies get the model of their metadata, and next_seq moves past the last seq
+    m, c = messages.c, conversations.c
+    unsequenced = sa.select(m.conversation_id).where(m.seq.is_(None))
+    numbered = sa.select(
+        m.id,
+        sa.func.row_number().over(partition_by=m.conversation_id, order_by=(m.created_at, m.id)).label('seq'),
+    ).where(m.seq.is_(None)).subquery()
+    generated_by = sa.select(generation_metadata.c.model_id).where(
+        generation_metadata.c.message_id == m.id
+    ).order_by(generation_metadata.c.id).limit(1).scalar_subquery()
+    last_seq = sa.select(sa.func.coalesce(sa.func.max(m.seq), 0)).where(m.conversation_id == c.id).scalar_subquery()
+
+    # Rows numbered after the upgrade started again from 1; clearing the whole conversation
+    # first keeps the (conversation_id, seq) index unique while it is renumbered
+    op.execute(messages.update().where(m.conversation_id.in_(unsequenced)).values(seq=None))
+    op.execute(messages.update().where(m.id == numbered.c.id).values(seq=numbered.c.seq))
+    op.execute(messages.update().where(m.role == 'assistant', m.model_id.is_(None)).values(model_id=generated_by))
+    op.execute(conversations.update().where(c.next_seq < last_seq).values(next_seq=last_seq))
+
+
+def downgrade() -> None:
+    pass
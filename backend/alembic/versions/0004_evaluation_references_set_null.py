@@ -0,0 +1,47 @@
+"""Keep evaluation runs and items when their conversation or messages are deleted
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 11:02:14.208316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, column, referred table); the baseline left these foreign keys unnamed
+REFERENCES = [
+    ('evaluation_runs', 'conversation_id', 'conversations'),
+    ('evaluation_items', 'message_id', 'messages'),
+]
+# Names SQLite's unnamed constraints while batch mode copies the table
+NAMING = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+def replace_foreign_keys(ondelete: Union[str, None]) -> None:
+    for table, column, referred in REFERENCES:
+        if op.get_bind().dialect.name == "postgresql":
+            # Postgres's default name for an unnamed foreign key
+            name = f"{table}_{column}_fkey"
+            op.drop_constraint(name, table, type_="foreignkey")
+            op.create_foreign_key(name, table, referred, [column], ["id"], ondelete=ondelete)
+            continue
+        name = f"fk_{table}_{column}_{referred}"
+        with op.batch_alter_table(table, naming_convention=NAMING) as batch_op:
+            batch_op.drop_constraint(name, type_="foreignkey")
+            batch_op.create_foreign_key(name, referred, [column], ["id"], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    replace_foreign_keys("SET NULL")
+
+
+def downgrade() -> None:
+    replace_foreign_keys(None)
@@ -0,0 +1,289 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, func, delete
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from . import models, database
+from .database import upsert
+
+router = APIRouter()
+get_db = database.get_db
+
+GROUPINGS = ("model", "provider")
+BUCKETS = ("hour", "day", "week", "month")
+
+Meta = models.GenerationMetadata
+Rollup = models.ModelPerfRollup
+# Hedged generations are measurements of the group member that answered, not of the model requested
+served_model_id = func.coalesce(Meta.served_model_id, Meta.model_id)
+COUNTERS = ("generations", "errors", "ttft_count", "ttft_sum", "tps_count", "tps_sum",
+            "input_tokens", "output_tokens", "cached_input_tokens")
+
+
+def hour_bucket(ts: datetime) -> datetime:
+    return ts.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def next_hour_bucket(ts: datetime) -> datetime:
+    """The first hour boundary at or after `ts`."""
+    bucket = hour_bucket(ts)
+    return bucket if bucket == ts.astimezone(timezone.utc) else bucket + timedelta(hours=1)
+
+
+def rollup_row(res: dict, bucket_start: datetime) -> dict:
+    ttft, tps = res.get("ttft"), res.get("tps")
+    return {
+        "model_id": res.get("served_model_id") or res["model_id"],
+        "bucket_start": bucket_start,
+        "generations": 1,
+        # Errors and missed deadlines
+        "errors": 0 if res.get("success", True) else 1,
+        "ttft_count": 1 if ttft is not None else 0,
+        "ttft_sum": ttft or 0.0,
+        "tps_count": 1 if tps else 0,
+        "tps_sum": tps or 0.0,
+        "input_tokens": res.get("input_tokens") or 0,
+        "output_tokens": res.get("output_tokens") or 0,
+        "cached_input_tokens": res.get("cached_input_tokens") or 0,
+    }
+
+
+async def record_generations(db: AsyncSession, results: List[dict], at: Optional[datetime] = None):
+    """Adds generation results to their models' hourly rollups with one upsert, in the caller's transaction."""
+    bucket_start = hour_bucket(at or datetime.now(timezone.utc))
+    rows: Dict[int, dict] = {}
+    for res in results:
+        if res.get("cache_hit") or res.get("status") == "cancelled":
+            # Replayed from the response cache, or stopped by the user: not a measurement of the provider
+            continue
+        row = rollup_row(res, bucket_start)
+        # A multi-row ON CONFLICT can't touch the same row twice, so merge per model first
+        if row["model_id"] in rows:
+            merged = rows[row["model_id"]]
+            for k in COUNTERS:
+                merged[k] += row[k]
+        else:
+            rows[row["model_id"]] = row
+    if not rows:
+        return
+    stmt = upsert(db, Rollup.__table__).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["model_id", "bucket_start"],
+        set_={k: getattr(Rollup.__table__.c, k) + getattr(stmt.excluded, k) for k in COUNTERS},
+    )
+    await db.execute(stmt)
+
+
+async def rebuild_rollups(db: AsyncSession, start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+    """
+    Recomputes rollups from the raw generation_metadata rows with one set-based INSERT ... SELECT.
+    Whole hours are rebuilt: `start` is rounded down and `end` up to an hour boundary.
+    """
+    # Hours in UTC, as record_generations buckets them, whatever the session's time zone
+    bucket = func.timezone("UTC", func.date_trunc("hour", func.timezone("UTC", Meta.created_at)))
+    raw = select(
+        served_model_id,
+        bucket.label("bucket_start"),
+        func.count(Meta.id),
+        func.count(Meta.id).filter(Meta.status.in_(("error", "timed_out"))),
+        func.count(Meta.time_to_first_token),
+        func.coalesce(func.sum(Meta.time_to_first_token), 0),
+        func.count(Meta.tokens_per_second).filter(Meta.tokens_per_second > 0),
+        func.coalesce(func.sum(Meta.tokens_per_second), 0),
+        func.coalesce(func.sum(Meta.input_tokens), 0),
+        func.coalesce(func.sum(Meta.output_tokens), 0),
+        func.coalesce(func.sum(Meta.cached_input_tokens), 0),
+    ).filter(served_model_id.is_not(None), Meta.cache_hit.is_(False), Meta.status != "cancelled").group_by(served_model_id, bucket)
+
+    cleanup = delete(Rollup)
+    if start is not None:
+        raw = raw.filter(Meta.created_at >= hour_bucket(start))
+        cleanup = cleanup.filter(Rollup.bucket_start >= hour_bucket(start))
+    if end is not None:
+        # A bucket cut off partway would be replaced by the part of its hour before `end`
+        raw = raw.filter(Meta.created_at < next_hour_bucket(end))
+        cleanup = cleanup.filter(Rollup.bucket_start < next_hour_bucket(end))
+
+    await db.execute(cleanup)
+    stmt = postgresql.insert(Rollup).from_select(["model_id", "bucket_start", *COUNTERS], raw)
+    # record_generations may recreate a bucket between the delete and the insert; the rebuilt
+    # counts, taken from the raw rows, replace it
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["model_id", "bucket_start"],
+        set_={k: getattr(stmt.excluded, k) for k in COUNTERS},
+    )
+    result = await db.execute(stmt)
+    await db.commit()
+    return result.rowcount
+
+
+def group_columns(group_by: str):
+    if group_by == "provider":
+        return [models.Provider.id.label("provider_id"), models.Provider.name.label("provider_name")]
+    return [
+        models.Model.id.label("model_id"), models.Model.name.label("model_name"),
+        models.Provider.id.label("provider_id"), models.Provider.name.label("provider_name"),
+    ]
+
+
+def validate(group_by: str, bucket: Optional[str]):
+    if group_by not in GROUPINGS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(GROUPINGS)}")
+    if bucket is not None and bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(BUCKETS)}")
+
+
+@router.get("/analytics/summary")
+async def performance_summary(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    group_by: str = "model",
+    bucket: Optional[str] = None,
+    model_ids: Optional[List[int]] = Query(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """Counts, mean TTFT/TPS, token totals and cache-hit ratio per model or provider, read from the hourly rollups."""
+    validate(group_by, bucket)
+    keys = group_columns(group_by)
+    if bucket:
+        keys.append(func.date_trunc(bucket, Rollup.bucket_start).label("bucket_start"))
+
+    generations = func.sum(Rollup.generations)
+    input_tokens = func.sum(Rollup.input_tokens)
+    query = select(
+        *keys,
+        generations.label("generations"),
+        func.sum(Rollup.errors).label("errors"),
+        (func.sum(Rollup.ttft_sum) / func.nullif(func.sum(Rollup.ttft_count), 0)).label("mean_ttft"),
+        (func.sum(Rollup.tps_sum) / func.nullif(func.sum(Rollup.tps_count), 0)).label("mean_tps"),
+        input_tokens.label("input_tokens"),
+        func.sum(Rollup.output_tokens).label("output_tokens"),
+        func.sum(Rollup.cached_input_tokens).label("cached_input_tokens"),
+        (func.sum(Rollup.cached_input_tokens) * 1.0 / func.nullif(input_tokens, 0)).label("cache_hit_ratio"),
+    ).join(models.Model, models.Model.id == Rollup.model_id).join(models.Provider, models.Provider.id == models.Model.provider_id)
+
+    if start is not None:
+        query = query.filter(Rollup.bucket_start >= hour_bucket(start))
+    if end is not None:
+        query = query.filter(Rollup.bucket_start < end)
+    if model_ids:
+        query = query.filter(Rollup.model_id.in_(model_ids))
+    query = query.group_by(*keys).order_by(*keys)
+
+    rows = await db.execute(query)
+    return [dict(r._mapping) for r in rows]
+
+
+@router.get("/analytics/percentiles")
+async def performance_percentiles(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    group_by: str = "model",
+    bucket: Optional[str] = None,
+    model_ids: Optional[List[int]] = Query(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Exact p50/p90/p99 TTFT and TPS over raw generations in a time window (uses the created_at/model_id indexes).
+    TTFT is also split into network overhead (connecting and sending the request) and server TTFT (the rest:
+    provider queueing and prefill), for generations whose request phases were traced.
+    """
+    validate(group_by, bucket)
+    keys = group_columns(group_by)
+    if bucket:
+        keys.append(func.date_trunc(bucket, Meta.created_at).label("bucket_start"))
+
+    def pct(p, column):
+        return func.percentile_cont(p).within_group(column)
+
+    network = Meta.time_to_request_sent
+    server_ttft = Meta.time_to_first_token - Meta.time_to_request_sent
+
+    query = select(
+        *keys,
+        func.count(Meta.id).label("generations"),
+        pct(0.5, Meta.time_to_first_token).label("ttft_p50"),
+        pct(0.9, Meta.time_to_first_token).label("ttft_p90"),
+        pct(0.99, Meta.time_to_first_token).label("ttft_p99"),
+        pct(0.5, Meta.tokens_per_second).label("tps_p50"),
+        pct(0.1, Meta.tokens_per_second).label("tps_p10"),
+        pct(0.01, Meta.tokens_per_second).label("tps_p01"),
+        pct(0.5, Meta.itl_p99).label("itl_p99_median"),
+        pct(0.5, network).label("network_p50"),
+        pct(0.9, network).label("network_p90"),
+        pct(0.5, server_ttft).label("server_ttft_p50"),
+        pct(0.9, server_ttft).label("server_ttft_p90"),
+        pct(0.99, server_ttft).label("server_ttft_p99"),
+        pct(0.5, Meta.queue_time).label("queue_p50"),
+        (func.count(Meta.id).filter(Meta.connection_reused.is_(False)) * 1.0
+         / func.nullif(func.count(Meta.connection_reused), 0)).label("new_connection_ratio"),
+    ).join(models.Model, models.Model.id == served_model_id).join(models.Provider, models.Provider.id == models.Model.provider_id)
+    query = query.filter(Meta.cache_hit.is_(False), Meta.status != "cancelled")
+
+    if start is not None:
+        query = query.filter(Meta.created_at >= start)
+    if end is not None:
+        query = query.filter(Meta.created_at < end)
+    if model_ids:
+        query = query.filter(served_model_id.in_(model_ids))
+    query = query.group_by(*keys).order_by(*keys)
+
+    rows = await db.execute(query)
+    return [dict(r._mapping) for r in rows]
+
+
+@router.get("/analytics/hedging")
+async def hedging_summary(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    model_ids: Optional[List[int]] = Query(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """Per requested model in a hedging group: how often a hedge fired, and which providers answered."""
+    Served = aliased(models.Model)
+    query = select(
+        Meta.model_id,
+        models.Model.name.label("model_name"),
+        Served.id.label("served_model_id"),
+        models.Provider.id.label("served_provider_id"),
+        models.Provider.name.label("served_provider_name"),
+        func.count(Meta.id).label("generations"),
+        func.count(Meta.id).filter(Meta.hedged.is_(True)).label("hedges_fired"),
+    ).join(models.Model, models.Model.id == Meta.model_id).join(Served, Served.id == Meta.served_model_id) \
+        .join(models.Provider, models.Provider.id == Served.provider_id)
+    query = query.filter(Meta.hedged.is_not(None), Meta.status != "cancelled")
+
+    if start is not None:
+        query = query.filter(Meta.created_at >= start)
+    if end is not None:
+        query = query.filter(Meta.created_at < end)
+    if model_ids:
+        query = query.filter(Meta.model_id.in_(model_ids))
+    query = query.group_by(Meta.model_id, models.Model.name, Served.id, models.Provider.id, models.Provider.name) \
+        .order_by(Meta.model_id, Served.id)
+
+    by_model: Dict[int, dict] = {}
+    for row in await db.execute(query):
+        entry = by_model.setdefault(row.model_id, {
+            "model_id": row.model_id, "model_name": row.model_name, "generations": 0, "hedges_fired": 0, "served_by": [],
+        })
+        entry["generations"] += row.generations
+        entry["hedges_fired"] += row.hedges_fired
+        entry["served_by"].append({
+            "model_id": row.served_model_id, "provider_id": row.served_provider_id,
+            "provider_name": row.served_provider_name, "generations": row.generations,
+        })
+    for entry in by_model.values():
+        entry["hedge_rate"] = entry["hedges_fired"] / entry["generations"]
+    return list(by_model.values())
+
+
+@router.post("/analytics/rollups/rebuild")
+async def rebuild_performance_rollups(start: Optional[datetime] = None, end: Optional[datetime] = None, db: AsyncSession = Depends(get_db)):
+    if db.bind.dialect.name != "postgresql":
+        raise HTTPException(status_code=400, detail="Rollup rebuild requires PostgreSQL")
+    rows = await rebuild_rollups(db, start, end)
+    return {"status": "success", "buckets": rows}
@@ -1,146 +1,351 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-import httpx
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, func, tuple_, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from datetime import datetime
+from typing import List, Optional
+import base64
+import json
 
-from . import models, schemas, database
+from . import models, schemas, database, clients, timing, persistence, content, branches
 
 router = APIRouter()
 get_db = database.get_db
 
 # --- Providers ---
 @router.post("/providers/", response_model=schemas.Provider)
-def create_provider(provider: schemas.ProviderCreate, db: Session = Depends(get_db)):
+async def create_provider(provider: schemas.ProviderCreate, db: AsyncSession = Depends(get_db)):
     db_provider = models.Provider(**provider.model_dump())
     db.add(db_provider)
-    db.commit()
-    db.refresh(db_provider)
+    await db.commit()
+    await db.refresh(db_provider)
     return db_provider
 
 @router.get("/providers/", response_model=List[schemas.Provider])
-def read_providers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    providers = db.query(models.Provider).offset(skip).limit(limit).all()
-    return providers
+async def read_providers(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    providers = await db.scalars(select(models.Provider).offset(skip).limit(limit))
+    return providers.all()
+
+@router.put("/providers/{provider_id}", response_model=schemas.Provider)
+async def update_provider(provider_id: int, provider: schemas.ProviderCreate, db: AsyncSession = Depends(get_db)):
+    db_provider = await db.get(models.Provider, provider_id)
+    if db_provider is None:
+        raise HTTPException(status_code=404, detail="Provider not found")
+    for key, value in provider.model_dump().items():
+        setattr(db_provider, key, value)
+    # The base_url or key may have changed, so the next sync must not trust the last catalog
+    db_provider.catalog_etag = None
+    db_provider.catalog_hash = None
+    db_provider.catalog_synced_at = None
+    await db.commit()
+    await db.refresh(db_provider)
+    # No invalidate: the registry rebuilds the client on its next use if a connection setting changed
+    return db_provider
 
 @router.delete("/providers/{provider_id}", response_model=schemas.Provider)
-def delete_provider(provider_id: int, db: Session = Depends(get_db)):
-    provider = db.query(models.Provider).filter(models.Provider.id == provider_id).first()
+async def delete_provider(provider_id: int, db: AsyncSession = Depends(get_db)):
+    provider = await db.get(models.Provider, provider_id)
     if provider is None:
         raise HTTPException(status_code=404, detail="Provider not found")
-    db.delete(provider)
-    db.commit()
+    await db.delete(provider)
+    await db.commit()
+    clients.get_registry().invalidate(provider_id)
     return provider
 
 # --- Models ---
+async def commit_model(db: AsyncSession):
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Model already registered for this provider")
+
+async def check_group(db: AsyncSession, group_id: Optional[int]):
+    if group_id is not None and await db.get(models.ModelGroup, group_id) is None:
+        raise HTTPException(status_code=404, detail="Model group not found")
+
 @router.post("/models/", response_model=schemas.Model)
-def create_model(model: schemas.ModelCreate, db: Session = Depends(get_db)):
+async def create_model(model: schemas.ModelCreate, db: AsyncSession = Depends(get_db)):
+    await check_group(db, model.group_id)
     db_model = models.Model(**model.model_dump())
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    await commit_model(db)
+    await db.refresh(db_model)
     return db_model
 
 @router.get("/models/", response_model=List[schemas.Model])
-def read_models(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    models_ = db.query(models.Model).offset(skip).limit(limit).all()
-    return models_
+async def read_models(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    models_ = await db.scalars(select(models.Model).offset(skip).limit(limit))
+    return models_.all()
+
+@router.put("/models/{model_id}", response_model=schemas.Model)
+async def update_model(model_id: int, model: schemas.ModelCreate, db: AsyncSession = Depends(get_db)):
+    db_model = await db.get(models.Model, model_id)
+    if db_model is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    await check_group(db, model.group_id)
+    for key, value in model.model_dump().items():
+        setattr(db_model, key, value)
+    await commit_model(db)
+    await db.refresh(db_model)
+    return db_model
 
 @router.delete("/models/{model_id}", response_model=schemas.Model)
-def delete_model(model_id: int, db: Session = Depends(get_db)):
-    model = db.query(models.Model).filter(models.Model.id == model_id).first()
+async def delete_model(model_id: int, db: AsyncSession = Depends(get_db)):
+    model = await db.get(models.Model, model_id)
     if model is None:
         raise HTTPException(status_code=404, detail="Model not found")
-    db.delete(model)
-    db.commit()
+    await db.delete(model)
+    await db.commit()
     return model
 
 @router.put("/models/{model_id}/toggle", response_model=schemas.Model)
-def toggle_model(model_id: int, db: Session = Depends(get_db)):
-    model = db.query(models.Model).filter(models.Model.id == model_id).first()
+async def toggle_model(model_id: int, db: AsyncSession = Depends(get_db)):
+    model = await db.get(models.Model, model_id)
     if not model:
         raise HTTPException(status_code=404, detail="Model not found")
     model.enabled = not model.enabled
-    db.commit()
-    db.refresh(model)
+    await db.commit()
+    await db.refresh(model)
     return model
 
-@router.post("/providers/{provider_id}/sync_models")
-async def sync_models(provider_id: int, db: Session = Depends(get_db)):
-    provider = db.query(models.Provider).filter(models.Provider.id == provider_id).first()
-    if not provider:
-        raise HTTPException(status_code=404, detail="Provider not found")
-    
-    headers = {}
-    if provider.api_key:
-        headers["Authorization"] = f"Bearer {provider.api_key}"
-    
-    url = f"{provider.base_url.rstrip('/')}/models"
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers, timeout=10.0)
-            response.raise_for_status()
-            data = response.json()
-            api_models = data.get("data", [])
-            
-            # Simple sync: add models that don't exist yet
-            added = 0
-            for am in api_models:
-                m_id = am.get("id")
-                if m_id:
-                    existing = db.query(models.Model).filter(
-                        models.Model.provider_id == provider_id,
-                        models.Model.model_id == m_id
-                    ).first()
-                    if not existing:
-                        new_model = models.Model(
-                            provider_id=provider_id,
-                            model_id=m_id,
-                            name=m_id, # Default to ID, user can edit later
-                            is_reasoning=False,
-                            enabled=True
-                        )
-                        db.add(new_model)
-                        added += 1
-            db.commit()
-            return {"status": "success", "added": added}
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to fetch models: {str(e)}")
+# --- Model groups ---
+async def load_group(db: AsyncSession, group_id: int) -> models.ModelGroup:
+    group = await db.get(models.ModelGroup, group_id, options=[selectinload(models.ModelGroup.models)], populate_existing=True)
+    if group is None:
+        raise HTTPException(status_code=404, detail="Model group not found")
+    return group
+
+async def commit_group(db: AsyncSession):
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="A model group with this name already exists")
+
+@router.post("/model_groups/", response_model=schemas.ModelGroup)
+async def create_model_group(group: schemas.ModelGroupCreate, db: AsyncSession = Depends(get_db)):
+    db_group = models.ModelGroup(**group.model_dump())
+    db.add(db_group)
+    await commit_group(db)
+    return await load_group(db, db_group.id)
+
+@router.get("/model_groups/", response_model=List[schemas.ModelGroup])
+async def read_model_groups(db: AsyncSession = Depends(get_db)):
+    groups = await db.scalars(select(models.ModelGroup).options(selectinload(models.ModelGroup.models)).order_by(models.ModelGroup.id))
+    return groups.all()
+
+@router.put("/model_groups/{group_id}", response_model=schemas.ModelGroup)
+async def update_model_group(group_id: int, group: schemas.ModelGroupCreate, db: AsyncSession = Depends(get_db)):
+    db_group = await load_group(db, group_id)
+    for key, value in group.model_dump().items():
+        setattr(db_group, key, value)
+    await commit_group(db)
+    return await load_group(db, group_id)
+
+@router.delete("/model_groups/{group_id}", response_model=schemas.ModelGroup)
+async def delete_model_group(group_id: int, db: AsyncSession = Depends(get_db)):
+    group = await load_group(db, group_id)
+    # Members stay registered; the ORM clears their group_id
+    await db.delete(group)
+    await db.commit()
+    return group
 
 # --- Conversations & Messages ---
+# Relationships are never lazy-loaded under asyncio, so responses that nest them load them eagerly
+conversation_tree = selectinload(models.Conversation.messages).selectinload(models.Message.generation_metadata)
+
 @router.post("/conversations/", response_model=schemas.Conversation)
-def create_conversation(conv: schemas.ConversationCreate, db: Session = Depends(get_db)):
-    db_conv = models.Conversation(**conv.model_dump())
+async def create_conversation(conv: schemas.ConversationCreate, db: AsyncSession = Depends(get_db)):
+    db_conv = models.Conversation(title=conv.title)
+    await content.set_system_prompt(db, db_conv, conv.system_prompt)
     db.add(db_conv)
-    db.commit()
-    db.refresh(db_conv)
+    await db.commit()
+    await db.refresh(db_conv, ["created_at", "messages"])
     return db_conv
 
 @router.get("/conversations/", response_model=List[schemas.Conversation])
-def read_conversations(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.Conversation).order_by(models.Conversation.created_at.desc()).offset(skip).limit(limit).all()
+async def read_conversations(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    convs = await db.scalars(
+        select(models.Conversation).options(conversation_tree)
+        .order_by(models.Conversation.created_at.desc()).offset(skip).limit(limit)
+    )
+    return convs.all()
+
+def encode_cursor(created_at: datetime, conv_id: int) -> str:
+    raw = json.dumps({"created_at": created_at.isoformat(), "id": conv_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(data["created_at"]), int(data["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/conversations/summary", response_model=schemas.ConversationSummaryPage)
+async def read_conversation_summaries(cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(get_db)):
+    """Newest-first conversation list without messages, paginated by (created_at, id) keyset."""
+    Message = models.Message
+    # Correlated aggregates are evaluated only for the rows on this page, each via the conversation indexes
+    message_count = select(func.count(Message.id)).filter(Message.conversation_id == models.Conversation.id).scalar_subquery()
+    last_message = select(func.max(Message.created_at)).filter(Message.conversation_id == models.Conversation.id).scalar_subquery()
+    query = select(
+        models.Conversation.id,
+        models.Conversation.title,
+        models.Conversation.created_at,
+        message_count.label("message_count"),
+        func.coalesce(last_message, models.Conversation.created_at).label("last_activity"),
+    )
+    if cursor:
+        created_at, conv_id = decode_cursor(cursor)
+        query = query.filter(
+            tuple_(models.Conversation.created_at, models.Conversation.id)
+            < tuple_(literal(created_at, models.Conversation.created_at.type), literal(conv_id))
+        )
+    rows = (await db.execute(
+        query.order_by(models.Conversation.created_at.desc(), models.Conversation.id.desc()).limit(limit + 1)
+    )).all()
+
+    items = [schemas.ConversationSummary(**r._mapping) for r in rows[:limit]]
+    next_cursor = encode_cursor(items[-1].created_at, items[-1].id) if len(rows) > limit else None
+    return schemas.ConversationSummaryPage(items=items, next_cursor=next_cursor)
+
+async def load_message_page(db: AsyncSession, conv: models.Conversation, after_seq: Optional[int], before_seq: Optional[int], limit: int) -> tuple:
+    """A page of the active branch (see branches.py), with each message's alternatives."""
+    linked = conv.head_id is not None
+    head_id = await branches.ensure_linked(db, conv)
+    if not linked:
+        await db.commit()
+    # Without after_seq the page is taken from the end, i.e. the latest messages
+    query = select(models.Message).options(selectinload(models.Message.generation_metadata)).filter(
+        models.Message.conversation_id == conv.id, branches.on_branch(head_id)
+    )
+    if after_seq is not None:
+        query = query.filter(models.Message.seq > after_seq)
+    if before_seq is not None:
+        query = query.filter(models.Message.seq < before_seq)
+    forward = after_seq is not None
+    query = query.order_by(models.Message.seq.asc() if forward else models.Message.seq.desc()).limit(limit + 1)
+    rows = list((await db.scalars(query)).all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+    return await branches.annotate(db, conv.id, rows), has_more
+
+async def conversation_page(db: AsyncSession, conv: models.Conversation, message_limit: int) -> schemas.Conversation:
+    # Only the latest page; older messages come from /conversations/{id}/messages?before_seq=
+    messages, has_more = await load_message_page(db, conv, None, None, message_limit)
+    return schemas.Conversation(
+        id=conv.id,
+        title=conv.title,
+        system_prompt=conv.system_prompt,
+        created_at=conv.created_at,
+        head_id=conv.head_id,
+        messages=messages,
+        has_more_messages=has_more,
+    )
 
 @router.get("/conversations/{conversation_id}", response_model=schemas.Conversation)
-def get_conversation(conversation_id: int, db: Session = Depends(get_db)):
-    conv = db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
+async def get_conversation(conversation_id: int, message_limit: int = Query(200, ge=0, le=1000), db: AsyncSession = Depends(get_db)):
+    conv = await db.get(models.Conversation, conversation_id)
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    return conv
+    return await conversation_page(db, conv, message_limit)
+
+@router.get("/conversations/{conversation_id}/messages", response_model=schemas.MessagePage)
+async def read_conversation_messages(
+    conversation_id: int,
+    after_seq: Optional[int] = None,
+    before_seq: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+):
+    """Active-branch messages in seq order: the page after `after_seq`, else the page before `before_seq`, else the latest page."""
+    conv = await db.get(models.Conversation, conversation_id)
+    if conv is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    messages, has_more = await load_message_page(db, conv, after_seq, before_seq, limit)
+    return schemas.MessagePage(items=messages, has_more=has_more)
 
 @router.delete("/conversations/{conversation_id}")
-def delete_conversation(conversation_id: int, db: Session = Depends(get_db)):
-    conv = db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
+async def delete_conversation(conversation_id: int, db: AsyncSession = Depends(get_db)):
+    conv = await db.get(models.Conversation, conversation_id)
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    # Cascade delete is configured on the models, so this will delete messages too
-    db.delete(conv)
-    db.commit()
+    # Set-based: every branch's messages and metadata go in a few statements instead of an ORM cascade per row
+    await persistence.delete_conversation(db, conversation_id)
+    await db.commit()
     return {"status": "success"}
 
 @router.post("/messages/", response_model=schemas.Message)
-def create_message(msg: schemas.MessageCreate, db: Session = Depends(get_db)):
-    db_msg = models.Message(**msg.model_dump())
+async def create_message(msg: schemas.MessageCreate, db: AsyncSession = Depends(get_db)):
+    conv = await db.get(models.Conversation, msg.conversation_id)
+    if not conv:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    # Appended to the active branch; a user message becomes its new head
+    db_msg = models.Message(
+        conversation_id=msg.conversation_id,
+        role=msg.role,
+        seq=await persistence.allocate_seq(db, msg.conversation_id),
+        parent_id=await branches.ensure_linked(db, conv),
+    )
+    await content.set_content(db, db_msg, msg.content)
     db.add(db_msg)
-    db.commit()
-    db.refresh(db_msg)
+    await db.flush()
+    if db_msg.role == "user":
+        conv.head_id = db_msg.id
+    await db.commit()
+    await db.refresh(db_msg, ["created_at", "generation_metadata"])
     return db_msg
+
+async def load_message(db: AsyncSession, message_id: int) -> models.Message:
+    msg = await db.get(models.Message, message_id)
+    if not msg:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return msg
+
+@router.get("/messages/{message_id}/branches", response_model=List[schemas.Message])
+async def read_message_branches(message_id: int, db: AsyncSession = Depends(get_db)):
+    """The message and its alternatives, oldest first, for side-by-side comparison."""
+    msg = await load_message(db, message_id)
+    conv = await db.get(models.Conversation, msg.conversation_id)
+    if conv.head_id is None:
+        await branches.ensure_linked(db, conv)
+        await db.commit()
+        await db.refresh(msg, ["parent_id"])
+    [msg] = await branches.annotate(db, msg.conversation_id, [msg])
+    result = await db.scalars(
+        select(models.Message).options(selectinload(models.Message.generation_metadata))
+        .filter(models.Message.id.in_(msg.branch_ids)).order_by(models.Message.seq)
+    )
+    return await branches.annotate(db, msg.conversation_id, list(result.all()))
+
+@router.post("/messages/{message_id}/activate", response_model=schemas.Conversation)
+async def activate_message(message_id: int, message_limit: int = Query(200, ge=0, le=1000), db: AsyncSession = Depends(get_db)):
+    """Switches the conversation to the branch containing the message; returns the new active branch."""
+    msg = await load_message(db, message_id)
+    conv = await db.get(models.Conversation, msg.conversation_id)
+    await branches.activate(db, conv, msg)
+    await db.commit()
+    return await conversation_page(db, conv, message_limit)
+
+# --- Generations ---
+@router.get("/generations/{generation_id}/timeline", response_model=schemas.GenerationTimeline)
+async def get_generation_timeline(generation_id: int, db: AsyncSession = Depends(get_db)):
+    meta = await db.get(models.GenerationMetadata, generation_id)
+    if not meta:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    offsets = timing.unpack_timeline(meta.token_timeline)
+    return schemas.GenerationTimeline(
+        generation_id=meta.id,
+        offsets=offsets,
+        inter_token_latencies=[b - a for a, b in zip(offsets, offsets[1:])],
+        time_to_first_token=meta.time_to_first_token,
+        total_latency=meta.total_latency,
+        itl_p50=meta.itl_p50,
+        itl_p99=meta.itl_p99,
+        max_stall=meta.max_stall,
+    )
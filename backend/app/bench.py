@@ -0,0 +1,221 @@
+"""
+Backend benchmark: drives a running backend's /api/chat/ against the replay server (see
+replay.py), so what is measured is the backend's own overhead rather than a provider's.
+Every worker holds one conversation for --turns turns, so history loading grows as it would
+in use, and the response cache is bypassed.
+
+For every request, backend-added latency is the client-observed latency less the upstream
+generation time the backend recorded (GenerationMetadata.total_latency). That covers HTTP,
+the DB reads and writes, history building, rate-limiter queueing and stream parsing. Per
+concurrency level the report shows it at p50/p90/p99, together with throughput.
+
+    python -m app.replay serve --fixtures fixtures/ --port 8002 --speed 0 &
+    python -m app.bench --api-url http://localhost:8000 --replay-url http://localhost:8002/v1 --concurrency 1,8,32 --requests 200
+    python -m app.bench --fixtures fixtures/ --speed 0 --output bench-v1.5.json --baseline bench-v1.4.json
+
+--fixtures starts the replay server in-process instead; it then shares the event loop with
+the load generator. Reports are labelled with --release (by default `git describe`), so the
+JSON written by --output for one release can be passed as --baseline for the next.
+"""
+from datetime import datetime, timezone
+from typing import List, Optional
+import argparse
+import asyncio
+import json
+import subprocess
+import time
+
+import httpx
+
+from . import replay
+from .timing import distribution
+
+BENCH_PROVIDER = "replay-bench"
+DEFAULT_LEVELS = [1, 8, 32]
+DEFAULT_PROMPT = "Summarize the previous answer in one sentence, then continue."
+
+
+def current_release() -> str:
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+async def ensure_provider(api: httpx.AsyncClient, replay_url: str, model: Optional[str]) -> int:
+    """Registers the replay server as a Provider (or points the existing one at it); returns the model's id."""
+    providers = (await api.get("/api/providers/")).raise_for_status().json()
+    provider = next((p for p in providers if p["name"] == BENCH_PROVIDER), None)
+    body = {"name": BENCH_PROVIDER, "base_url": replay_url, "api_key": "replay"}
+    if provider is None:
+        provider = (await api.post("/api/providers/", json=body)).raise_for_status().json()
+    elif provider["base_url"] != replay_url:
+        provider = (await api.put(f"/api/providers/{provider['id']}", json={**provider, **body})).raise_for_status().json()
+    (await api.post(f"/api/providers/{provider['id']}/sync_models", params={"force": True})).raise_for_status()
+    registered = [
+        m for m in (await api.get("/api/models/", params={"limit": 1000})).raise_for_status().json()
+        if m["provider_id"] == provider["id"] and m["enabled"]
+    ]
+    chosen = next((m for m in registered if model is None or m["model_id"] == model), None)
+    if chosen is None:
+        raise SystemExit(f"Model {model or '(any)'} isn't served by the replay server")
+    return chosen["id"]
+
+
+async def timed_chat(api: httpx.AsyncClient, conversation_id: int, model_id: int, prompt: str) -> dict:
+    start = time.perf_counter()
+    try:
+        response = await api.post("/api/chat/", json={
+            "conversation_id": conversation_id,
+            "models_to_use": [model_id],
+            "system_prompt": "You are a helpful assistant.",
+            "message": prompt,
+            "bypass_cache": True,
+        })
+        response.raise_for_status()
+        messages = response.json()
+    except httpx.HTTPError as e:
+        return {"success": False, "error": str(e), "latency": time.perf_counter() - start}
+    latency = time.perf_counter() - start
+    meta = next((m["generation_metadata"][0] for m in messages if m["role"] == "assistant" and m["generation_metadata"]), None)
+    if meta is None or meta["status"] != "completed" or meta["total_latency"] is None:
+        return {"success": False, "error": meta["status"] if meta else "no reply", "latency": latency}
+    return {
+        "success": True,
+        "latency": latency,
+        "upstream": meta["total_latency"],
+        "backend_added": latency - meta["total_latency"],
+        "output_tokens": meta["output_tokens"] or 0,
+    }
+
+
+async def run_level(api: httpx.AsyncClient, model_id: int, concurrency: int, requests: int, turns: int,
+                    prompt: str, keep: bool) -> dict:
+    samples: List[dict] = []
+    conversations: List[int] = []
+    issued = 0
+
+    async def worker():
+        nonlocal issued
+        conversation_id, turn = None, 0
+        while issued < requests:
+            issued += 1
+            if conversation_id is None or turn == turns:
+                conv = (await api.post("/api/conversations/", json={"title": "bench", "system_prompt": "You are a helpful assistant."})).raise_for_status().json()
+                conversation_id, turn = conv["id"], 0
+                conversations.append(conversation_id)
+            samples.append(await timed_chat(api, conversation_id, model_id, prompt))
+            turn += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_time = time.perf_counter() - start
+    if not keep:
+        for conversation_id in conversations:
+            await api.delete(f"/api/conversations/{conversation_id}")
+
+    ok = [s for s in samples if s["success"]]
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "wall_time": wall_time,
+        "requests_per_second": len(ok) / wall_time if wall_time else 0,
+        "output_tps": sum(s["output_tokens"] for s in ok) / wall_time if wall_time else 0,
+        "latency": distribution([s["latency"] for s in ok]),
+        "upstream": distribution([s["upstream"] for s in ok]),
+        "backend_added": distribution([s["backend_added"] for s in ok]),
+    }
+
+
+def format_report(report: dict, baseline: Optional[dict] = None) -> str:
+    def ms(v):
+        return f"{v * 1000:.1f}" if v is not None else "-"
+
+    def change(now, before):
+        if now is None or not before:
+            return ""
+        return f" ({(now - before) / before * 100:+.0f}%)"
+
+    before = {lv["concurrency"]: lv for lv in (baseline or {}).get("levels", [])}
+    title = f"release {report['release']}" + (f" vs {baseline['release']}" if baseline else "")
+    header = f"{'conc':>5} {'reqs':>6} {'err':>5} {'req/s':>16} {'backend-added p50/p90/p99 (ms)':>40} {'upstream p50 (ms)':>18}"
+    lines = [title, header, "-" * len(header)]
+    for lv in report["levels"]:
+        added, old = lv["backend_added"], before.get(lv["concurrency"])
+        added_text = f"{ms(added['p50'])}/{ms(added['p90'])}/{ms(added['p99'])}"
+        if old:
+            added_text += change(added["p50"], old["backend_added"]["p50"])
+        rps = f"{lv['requests_per_second']:.2f}" + (change(lv["requests_per_second"], old["requests_per_second"]) if old else "")
+        lines.append(
+            f"{lv['concurrency']:>5} {lv['requests']:>6} {lv['errors']:>5} {rps:>16} {added_text:>40} {ms(lv['upstream']['p50']):>18}"
+        )
+    return "\n".join(lines)
+
+
+async def cli(args):
+    server = task = None
+    replay_url = args.replay_url
+    if args.fixtures:
+        server, task, replay_url = await replay.start_server(args.fixtures, args.speed)
+    if not replay_url:
+        raise SystemExit("--replay-url or --fixtures is required")
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    try:
+        async with httpx.AsyncClient(base_url=args.api_url, timeout=None, limits=limits) as api:
+            model_id = await ensure_provider(api, replay_url, args.model)
+            if args.warmup:
+                await run_level(api, model_id, 1, args.warmup, args.turns, args.prompt, False)
+            levels = [
+                await run_level(api, model_id, level, args.requests, args.turns, args.prompt, args.keep)
+                for level in args.concurrency
+            ]
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await task
+    return {
+        "release": args.release,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "api_url": args.api_url,
+        "turns": args.turns,
+        "levels": levels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-url", default="http://localhost:8000", help="the backend under test")
+    parser.add_argument("--replay-url", help="base URL of a running replay server, as the backend reaches it")
+    parser.add_argument("--fixtures", help="start a replay server in-process on these fixtures instead")
+    parser.add_argument("--speed", type=float, default=0.0, help="replay speed factor for --fixtures; 0 replays instantly")
+    parser.add_argument("--model", default=None, help="recorded model to use; the first one by default")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=DEFAULT_LEVELS)
+    parser.add_argument("--requests", type=int, default=200, help="requests per level")
+    parser.add_argument("--turns", type=int, default=5, help="turns per conversation")
+    parser.add_argument("--warmup", type=int, default=10, help="requests before the first level, not reported")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--release", default=None, help="label for the report; `git describe` by default")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report of an earlier release to compare with")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark's conversations")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    if any(level < 1 for level in args.concurrency):
+        raise SystemExit("Concurrency levels must be positive")
+    args.release = args.release or current_release()
+
+    report = asyncio.run(cli(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(json.dumps(report, indent=2) if args.json else format_report(report, baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Conversation tree. Every message points at its parent: a user message at the previous user
+turn of its branch, a reply at the user message it answers. Editing a user message adds a
+sibling under the same parent and regenerating a reply adds a sibling reply, so nothing is
+overwritten or deleted and earlier branches stay around for side-by-side comparison.
+
+The active branch runs from Conversation.head_id, its last user message, up to the root and
+is walked with one recursive CTE; under each of its user messages, a model's active reply is
+the one with `active` set. Replies without a parent (evaluation runs) are always shown.
+
+Conversations written before the tree are linked from their seq order the first time they
+are read, or all at once with:
+
+    python -m app.branches migrate
+"""
+from sqlalchemy import select, update, and_, or_, text, tuple_
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from collections import defaultdict
+from typing import List, Optional
+import argparse
+import asyncio
+
+from . import models, database
+
+Message = models.Message
+MIGRATE_BATCH = 100 # conversations per transaction
+
+# Databases created before the tree have the tables but not these columns
+POSTGRES_DDL = [
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS parent_id INTEGER REFERENCES messages (id) ON DELETE CASCADE",
+    "CREATE INDEX IF NOT EXISTS ix_messages_parent_id ON messages (parent_id)",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS active BOOLEAN NOT NULL DEFAULT true",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS head_id INTEGER",
+    "ALTER TABLE conversations DROP CONSTRAINT IF EXISTS fk_conversations_head_id",
+    "ALTER TABLE conversations ADD CONSTRAINT fk_conversations_head_id FOREIGN KEY (head_id) REFERENCES messages (id) ON DELETE SET NULL",
+    "ALTER TABLE generation_jobs ADD COLUMN IF NOT EXISTS reply_to_id INTEGER REFERENCES messages (id) ON DELETE SET NULL",
+]
+
+
+def ancestors(start):
+    """Recursive CTE of the message `start` (an id or scalar subquery) and every message above it."""
+    path = select(Message.id, Message.parent_id).where(Message.id == start).cte("path", recursive=True)
+    above = aliased(Message)
+    return path.union_all(select(above.id, above.parent_id).where(above.id == path.c.parent_id))
+
+
+def on_branch(head_id: Optional[int]):
+    """Criteria for the messages shown on the branch ending at `head_id`."""
+    root_replies = and_(Message.role == "assistant", Message.active.is_(True), Message.parent_id.is_(None))
+    if head_id is None:
+        return root_replies
+    path = select(ancestors(head_id).c.id)
+    replies = and_(Message.role == "assistant", Message.active.is_(True), Message.parent_id.in_(path))
+    return or_(Message.id.in_(path), replies, root_replies)
+
+
+def history_rows(reply_to_id: int, model_ids: List[int]):
+    """The branch above the user message `reply_to_id`, with the models' active replies, in seq order."""
+    parent = select(Message.parent_id).where(Message.id == reply_to_id).scalar_subquery()
+    path = select(ancestors(parent).c.id)
+    return select(Message.role, Message.model_id, Message.content_hash, Message.legacy_content).where(or_(
+        Message.id.in_(path),
+        and_(Message.parent_id.in_(path), Message.role == "assistant", Message.active.is_(True), Message.model_id.in_(model_ids)),
+    )).order_by(Message.seq)
+
+
+async def link_legacy(db: AsyncSession, conversation: models.Conversation) -> Optional[int]:
+    """Links a conversation written before the tree as a single branch, in the caller's transaction."""
+    of_conversation = Message.conversation_id == conversation.id
+    if await db.scalar(select(Message.id).where(of_conversation, Message.role == "user").limit(1)) is None:
+        # Nothing to link, e.g. an evaluation run's conversation
+        return None
+    # Write order rather than seq, which rows older than seq only have once they are
+    # backfilled (alembic revision 0002); the two agree where both are set
+    previous_user = aliased(Message)
+    parent = select(previous_user.id).where(
+        previous_user.conversation_id == Message.conversation_id,
+        previous_user.role == "user",
+        tuple_(previous_user.created_at, previous_user.id) < tuple_(Message.created_at, Message.id),
+    ).order_by(previous_user.created_at.desc(), previous_user.id.desc()).limit(1).scalar_subquery()
+    await db.execute(
+        update(Message).where(of_conversation, Message.parent_id.is_(None)).values(parent_id=parent)
+        .execution_options(synchronize_session=False)
+    )
+    conversation.head_id = await db.scalar(
+        select(Message.id).where(of_conversation, Message.role == "user")
+        .order_by(Message.created_at.desc(), Message.id.desc()).limit(1)
+    )
+    return conversation.head_id
+
+
+async def ensure_linked(db: AsyncSession, conversation: models.Conversation) -> Optional[int]:
+    """The conversation's head, linking it first if it predates the tree; the caller commits."""
+    if conversation.head_id is None:
+        return await link_legacy(db, conversation)
+    return conversation.head_id
+
+
+async def activate(db: AsyncSession, conversation: models.Conversation, message: models.Message):
+    """
+    Makes the message's branch the active one: a reply becomes its model's active reply, and
+    when its user message isn't on the active path, the head moves to the most recent user
+    message under it.
+    """
+    target = message.id
+    if message.role == "assistant" and message.parent_id is not None:
+        await db.execute(update(Message).where(
+            Message.parent_id == message.parent_id, Message.model_id == message.model_id,
+            Message.role == "assistant", Message.id != message.id,
+        ).values(active=False))
+        message.active = True
+    if message.role == "assistant":
+        target = message.parent_id
+    head_id = await ensure_linked(db, conversation)
+    if target is None:
+        return
+    if head_id is not None:
+        path = ancestors(head_id)
+        if await db.scalar(select(path.c.id).where(path.c.id == target)) is not None:
+            return
+    below = select(Message.id, Message.seq).where(Message.id == target).cte("below", recursive=True)
+    child = aliased(Message)
+    below = below.union_all(select(child.id, child.seq).where(child.parent_id == below.c.id, child.role == "user"))
+    conversation.head_id = await db.scalar(select(below.c.id).order_by(below.c.seq.desc()).limit(1))
+
+
+async def annotate(db: AsyncSession, conversation_id: int, messages: List[models.Message]) -> List[models.Message]:
+    """Sets branch_ids on each message: its alternatives and itself, oldest first."""
+    parents = {m.parent_id for m in messages if m.parent_id is not None}
+    criteria = [and_(Message.parent_id.is_(None), Message.role == "user")]
+    if parents:
+        criteria.append(Message.parent_id.in_(parents))
+    rows = (await db.execute(
+        select(Message.id, Message.parent_id, Message.role, Message.model_id)
+        .where(Message.conversation_id == conversation_id, or_(*criteria)).order_by(Message.seq)
+    )).all()
+    siblings = defaultdict(list)
+    for row in rows:
+        siblings[(row.parent_id, row.role, row.model_id if row.role == "assistant" else None)].append(row.id)
+    for m in messages:
+        if m.role == "assistant" and m.parent_id is None:
+            # Root replies, e.g. one per evaluation prompt, aren't alternatives to each other
+            m.branch_ids = [m.id]
+        else:
+            m.branch_ids = siblings.get((m.parent_id, m.role, m.model_id if m.role == "assistant" else None), [m.id])
+    return messages
+
+
+async def migrate(batch: int = MIGRATE_BATCH) -> int:
+    """Adds the columns if needed, then links every conversation that predates the tree."""
+    await database.init_models()
+    if database.get_engine().dialect.name == "postgresql":
+        async with database.get_engine().begin() as conn:
+            for statement in POSTGRES_DDL:
+                await conn.execute(text(statement))
+    linked = 0
+    last_id = 0
+    async with database.AsyncSessionLocal() as db:
+        while True:
+            conversations = (await db.scalars(
+                select(models.Conversation).where(models.Conversation.head_id.is_(None), models.Conversation.id > last_id)
+                .order_by(models.Conversation.id).limit(batch)
+            )).all()
+            if not conversations:
+                break
+            for conversation in conversations:
+                if await link_legacy(db, conversation) is not None:
+                    linked += 1
+            last_id = conversations[-1].id
+            await db.commit()
+            print(f"Linked {linked} conversations so far")
+    return linked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--batch", type=int, default=MIGRATE_BATCH, help="conversations per transaction")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            print(f"Linked {await migrate(args.batch)} conversations")
+        finally:
+            await database.dispose_engine()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Content-addressed response cache. A completed generation is stored under a hash of
+everything that determines it (provider base_url, model, full message list, sampling
+params) in an in-process LRU and in the response_cache table, so that identical
+requests, e.g. repeated evaluation runs, are answered without calling the provider.
+
+Opt-in with RESPONSE_CACHE_ENABLED=1; individual requests can still bypass it.
+"""
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, delete
+from typing import Optional
+import hashlib
+import json
+import logging
+import os
+
+from . import models, database
+from .database import upsert
+from .lru import LRUCache
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600))) # seconds
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "1024"))
+RESPONSE_CACHE_MEMORY_BYTES = int(os.getenv("RESPONSE_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_DB_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_DB_MAX_ENTRIES", "100000"))
+# The table is pruned once every this many stores rather than on every write
+PRUNE_EVERY = 200
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+get_db = database.get_db
+
+Entry = models.ResponseCacheEntry
+
+
+def cache_key(base_url: str, model_name: str, messages: list, params: dict) -> str:
+    # Canonical JSON so that dict ordering and whitespace never change the key
+    payload = json.dumps(
+        {"base_url": base_url.rstrip("/"), "model": model_name, "messages": messages, "params": params},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+memory = LRUCache(RESPONSE_CACHE_MEMORY_ENTRIES, RESPONSE_CACHE_MEMORY_BYTES, RESPONSE_CACHE_TTL)
+_stores = 0
+
+
+def entry_value(entry: models.ResponseCacheEntry) -> dict:
+    return {
+        "content": entry.content,
+        "input_tokens": entry.input_tokens,
+        "output_tokens": entry.output_tokens,
+        "cached_input_tokens": entry.cached_input_tokens,
+    }
+
+
+async def lookup(key: str) -> Optional[dict]:
+    value = memory.get(key)
+    if value is not None:
+        return value
+    # A cache failure must never fail the generation, it only costs a provider call
+    try:
+        async with database.AsyncSessionLocal() as db:
+            now = datetime.now(timezone.utc)
+            entry = await db.scalar(select(Entry).filter(Entry.key == key, Entry.expires_at > now))
+            if entry is None:
+                return None
+            await db.execute(update(Entry).where(Entry.key == key).values(hits=Entry.hits + 1, last_hit_at=now))
+            await db.commit()
+    except Exception as e:
+        logger.warning("Response cache lookup failed: %s", e)
+        return None
+    value = entry_value(entry)
+    expires_at = entry.expires_at if entry.expires_at.tzinfo else entry.expires_at.replace(tzinfo=timezone.utc)
+    memory.put(key, value, entry.size_bytes, (expires_at - now).total_seconds())
+    return value
+
+
+async def store(key: str, res: dict):
+    global _stores
+    value = {k: res.get(k) for k in ("content", "input_tokens", "output_tokens", "cached_input_tokens")}
+    size = len(value["content"].encode())
+    memory.put(key, value, size)
+    try:
+        async with database.AsyncSessionLocal() as db:
+            now = datetime.now(timezone.utc)
+            row = {**value, "key": key, "size_bytes": size, "created_at": now,
+                   "expires_at": now + timedelta(seconds=RESPONSE_CACHE_TTL), "last_hit_at": now}
+            stmt = upsert(db, Entry.__table__).values(**row)
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=["key"],
+                set_={k: getattr(stmt.excluded, k) for k in row if k != "key"},
+            ))
+            _stores += 1
+            if _stores % PRUNE_EVERY == 0:
+                await prune(db)
+            await db.commit()
+    except Exception as e:
+        logger.warning("Response cache store failed: %s", e)
+
+
+async def prune(db) -> int:
+    """Drops expired rows, then the least recently used ones beyond RESPONSE_CACHE_DB_MAX_ENTRIES."""
+    removed = (await db.execute(delete(Entry).where(Entry.expires_at <= datetime.now(timezone.utc)))).rowcount
+    cutoff = await db.scalar(
+        select(Entry.last_hit_at).order_by(Entry.last_hit_at.desc())
+        .offset(RESPONSE_CACHE_DB_MAX_ENTRIES).limit(1)
+    )
+    if cutoff is not None:
+        removed += (await db.execute(delete(Entry).where(Entry.last_hit_at <= cutoff))).rowcount
+    return removed
+
+
+@router.delete("/cache/")
+async def clear_cache(db: AsyncSession = Depends(get_db)):
+    memory.clear()
+    removed = (await db.execute(delete(Entry))).rowcount
+    await db.commit()
+    return {"status": "success", "removed": removed}
@@ -0,0 +1,120 @@
+"""
+Model catalog sync. Providers' /models listings are fetched concurrently, at most
+CATALOG_SYNC_CONCURRENCY at a time, and each is applied to the models table with one
+diff query and one upsert (persistence.apply_catalog).
+
+Catalogs that haven't changed are skipped: sync-all leaves alone providers synced within
+CATALOG_TTL, the stored ETag is sent as If-None-Match, and a listing with the same set of
+ids as last time isn't diffed again. `force` bypasses all three.
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timezone
+from typing import List
+import asyncio
+import hashlib
+import logging
+import os
+
+from . import models, database, clients, persistence
+
+CATALOG_SYNC_CONCURRENCY = int(os.getenv("CATALOG_SYNC_CONCURRENCY", "8"))
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300")) # seconds
+CATALOG_FETCH_TIMEOUT = 10.0
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+get_db = database.get_db
+
+
+def catalog_hash(model_ids: List[str]) -> str:
+    return hashlib.sha256("\n".join(sorted(set(model_ids))).encode()).hexdigest()
+
+
+def is_fresh(provider: models.Provider, now: datetime, ttl: float) -> bool:
+    synced_at = provider.catalog_synced_at
+    if synced_at is None or ttl <= 0:
+        return False
+    if synced_at.tzinfo is None:
+        synced_at = synced_at.replace(tzinfo=timezone.utc)
+    return (now - synced_at).total_seconds() < ttl
+
+
+async def fetch_catalog(info: dict, etag: str = None) -> dict:
+    client = clients.get_registry().get(info).http
+    headers = {"If-None-Match": etag} if etag else {}
+    response = await client.get(f"{info['base_url'].rstrip('/')}/models", headers=headers, timeout=CATALOG_FETCH_TIMEOUT)
+    if response.status_code == 304:
+        return {"status": "not_modified"}
+    response.raise_for_status()
+    model_ids = [m.get("id") for m in response.json().get("data", [])]
+    return {"status": "fetched", "etag": response.headers.get("etag"), "model_ids": model_ids}
+
+
+async def sync_providers(db: AsyncSession, providers: List[models.Provider], force: bool = False, ttl: float = CATALOG_TTL) -> List[dict]:
+    """Fetches the providers' catalogs concurrently, then applies them in this session and commits."""
+    now = datetime.now(timezone.utc)
+    semaphore = asyncio.Semaphore(CATALOG_SYNC_CONCURRENCY)
+
+    async def fetch(provider: models.Provider) -> dict:
+        if not force and is_fresh(provider, now, ttl):
+            return {"status": "fresh"}
+        async with semaphore:
+            try:
+                return await fetch_catalog(clients.provider_info(provider), None if force else provider.catalog_etag)
+            except Exception as e:
+                logger.warning("Catalog fetch failed for provider %s: %s", provider.id, e)
+                return {"status": "error", "detail": str(e)}
+
+    # Only the HTTP fetches run concurrently; the session is used by one writer at a time
+    fetched = await asyncio.gather(*(fetch(p) for p in providers))
+
+    results = []
+    for provider, catalog in zip(providers, fetched):
+        result = {"provider_id": provider.id, "status": catalog["status"], "added": 0, "delisted": 0, "relisted": 0}
+        if catalog["status"] == "error":
+            result["detail"] = catalog["detail"]
+        elif catalog["status"] == "fetched":
+            digest = catalog_hash([m for m in catalog["model_ids"] if m])
+            if force or digest != provider.catalog_hash:
+                result.update(await persistence.apply_catalog(db, provider.id, catalog["model_ids"]))
+                result["status"] = "synced"
+            else:
+                result["status"] = "unchanged"
+            provider.catalog_etag = catalog["etag"]
+            provider.catalog_hash = digest
+        if catalog["status"] in ("fetched", "not_modified"):
+            provider.catalog_synced_at = now
+        results.append(result)
+    await db.commit()
+    return results
+
+
+@router.post("/providers/sync_models")
+async def sync_all_models(force: bool = False, db: AsyncSession = Depends(get_db)):
+    providers = (await db.scalars(select(models.Provider).order_by(models.Provider.id))).all()
+    results = await sync_providers(db, providers, force)
+    return {
+        "status": "success",
+        "added": sum(r["added"] for r in results),
+        "providers": results,
+    }
+
+
+@router.post("/providers/{provider_id}/sync_models")
+async def sync_models(provider_id: int, force: bool = False, db: AsyncSession = Depends(get_db)):
+    provider = await db.get(models.Provider, provider_id)
+    if not provider:
+        raise HTTPException(status_code=404, detail="Provider not found")
+    # An explicit single-provider sync always asks the provider, conditionally unless forced
+    result = (await sync_providers(db, [provider], force, ttl=0))[0]
+    if result["status"] == "error":
+        raise HTTPException(status_code=400, detail=f"Failed to fetch models: {result['detail']}")
+    return {
+        "status": "success",
+        "catalog": result["status"],
+        "added": result["added"],
+        "delisted": result["delisted"],
+        "relisted": result["relisted"],
+    }
@@ -1,177 +1,569 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session, joinedload
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set
+import json
+import logging
 import time
-from . import models, schemas, database
-import httpx
-from openai import AsyncOpenAI
+from . import models, schemas, database, clients, ratelimit, timing, cache, streams, persistence, content, metrics, hedging, branches, tokens
 import asyncio
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 get_db = database.get_db
 
+# How long a cancel that must wait for partial output to be stored waits, seconds
+CANCEL_WAIT = 5.0
+DISCONNECT_POLL = 0.5 # seconds
+
 class ChatRequest(schemas.BaseModel):
     conversation_id: int
     models_to_use: List[int] # List of model IDs
     system_prompt: str
     message: str # User message content
+    bypass_cache: bool = False
+
+class Generation:
+    """Handle on one model's in-flight upstream generation: its deadlines, and a way to cancel it."""
+
+    def __init__(self, model_id: int, ttft_deadline: Optional[float] = None, total_deadline: Optional[float] = None,
+                 hedge: Optional[hedging.HedgePolicy] = None):
+        self.model_id = model_id
+        self.ttft_deadline = ttft_deadline # seconds from request to first content chunk
+        self.total_deadline = total_deadline # seconds for the whole generation, retries included
+        self.hedge = hedge # set when the model is in a hedging group (see stream_hedged)
+        self.legs: List["Generation"] = [] # per-provider generations of a hedged one
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_requested = False
+
+    def cancel(self) -> bool:
+        if self.cancel_requested:
+            return False
+        self.cancel_requested = True
+        # Not started yet: stream_llm_response checks the flag before calling upstream
+        if self.task is not None:
+            self.task.cancel()
+        for leg in self.legs:
+            leg.cancel()
+        return True
+
+class Turn:
+    """The generations started by one request, registered per conversation until their results are stored."""
+
+    def __init__(self, conversation_id: int, generations: List[Generation]):
+        self.conversation_id = conversation_id
+        self.generations = generations
+        self.done = asyncio.Event()
+
+    def cancel(self, model_ids: Optional[List[int]] = None) -> int:
+        return sum(g.cancel() for g in self.generations if model_ids is None or g.model_id in model_ids)
+
+    def finish(self):
+        in_flight[self.conversation_id].discard(self)
+        if not in_flight[self.conversation_id]:
+            del in_flight[self.conversation_id]
+        self.done.set()
+
+in_flight: Dict[int, Set[Turn]] = defaultdict(set)
+
+def start_turn(conversation_id: int, jobs: List[tuple]) -> Turn:
+    turn = Turn(conversation_id, [job[-1] for job in jobs])
+    in_flight[conversation_id].add(turn)
+    return turn
+
+@asynccontextmanager
+async def track_turn(conversation_id: int, jobs: List[tuple]):
+    turn = start_turn(conversation_id, jobs)
+    try:
+        yield turn
+    finally:
+        turn.finish()
 
-async def fetch_llm_response(model_id: int, sys_prompt: str, history: List[dict], user_msg: str, provider_info: dict, model_name: str):
+async def cancel_generations(conversation_id: int, model_ids: Optional[List[int]] = None, wait: bool = False) -> int:
+    """Cancels the conversation's in-flight generations; with `wait`, until their partial output is stored."""
+    turns = list(in_flight.get(conversation_id, ()))
+    cancelled = sum(turn.cancel(model_ids) for turn in turns)
+    if wait and turns:
+        await asyncio.wait([asyncio.create_task(turn.done.wait()) for turn in turns], timeout=CANCEL_WAIT)
+    return cancelled
+
+def cached_result(model_id: int, hit: dict) -> dict:
+    # No upstream call was made, so there is no latency to report
+    return {
+        "model_id": model_id,
+        "success": True,
+        "status": "completed",
+        "content": hit["content"],
+        "ttft": None,
+        "tps": None,
+        "output_tokens": hit.get("output_tokens") or 0,
+        "input_tokens": hit.get("input_tokens"),
+        "cached_input_tokens": hit.get("cached_input_tokens"),
+        "retry_count": 0,
+        "cache_hit": True
+    }
+
+def error_result(model_id: int, error, retries: int = 0) -> dict:
+    return {
+        "model_id": model_id,
+        "success": False,
+        "status": "error",
+        "content": f"Error: {str(error)}",
+        "ttft": None,
+        "tps": None,
+        "output_tokens": 0,
+        "input_tokens": None,
+        "cached_input_tokens": None,
+        "retry_count": retries
+    }
+
+async def stream_llm_response(model_id: int, sys_prompt: str, history: List[dict], user_msg: str, provider_info: dict, model_name: str,
+                              use_cache: bool = True, generation: Optional[Generation] = None):
+    """
+    Yields ("delta", text) for every content chunk, ("reasoning", text) for every reasoning
+    chunk, then a single ("result", dict). A generation that is cancelled or misses a deadline still yields its partial output,
+    with result["status"] set to 'cancelled' or 'timed_out'.
+    """
+    generation = generation or Generation(model_id)
+    if generation.hedge is not None:
+        async for item in stream_hedged(model_id, sys_prompt, history, user_msg, use_cache, generation):
+            yield item
+        return
     messages = [{"role": "system", "content": sys_prompt}] + history + [{"role": "user", "content": user_msg}]
+    params = {} # sampling parameters sent upstream; provider defaults apply when empty
     
-    client = AsyncOpenAI(
-        api_key=provider_info['api_key'] or "EMPTY",
-        base_url=provider_info['base_url']
-    )
+    cache_key = None
+    if use_cache and cache.RESPONSE_CACHE_ENABLED:
+        cache_key = cache.cache_key(provider_info["base_url"], model_name, messages, params)
+        hit = await cache.lookup(cache_key)
+        if hit is not None:
+            if hit["content"]:
+                yield "delta", hit["content"]
+            result = cached_result(model_id, hit)
+            metrics.observe_generation(provider_info, model_name, result)
+            yield "result", result
+            return
+    
+    # Pooled per-provider client: connection setup only shows up in TTFT while the pool is cold
+    client = clients.get_registry().get(provider_info)
+    limiter = ratelimit.get_limiter(provider_info)
+    max_retries = provider_info.get("max_retries")
+    if max_retries is None:
+        max_retries = ratelimit.DEFAULT_MAX_RETRIES
+    estimated_tokens = tokens.count_messages(messages)
+    loop = asyncio.get_running_loop()
     
-    start_time = time.time()
+    status = "completed"
+    error = None
     ttft = None
+    retries = 0
+    response = None
+    content_parts = [] # joined once at the end; += is quadratic on long outputs
+    reasoning_parts = []
+    input_tokens = None
+    output_tokens = None
+    cached_input_tokens = None
+    arrivals = [] # seconds since start_time of every content-bearing chunk
+    # Monotonic high-resolution clock for every timing below
+    begin = start_time = time.perf_counter()
+    
+    def deadline():
+        # Absolute loop time of the nearest deadline, None when the model has none
+        limits = []
+        if generation.total_deadline:
+            limits.append(begin + generation.total_deadline)
+        if ttft is None and generation.ttft_deadline:
+            limits.append(start_time + generation.ttft_deadline)
+        return loop.time() + min(limits) - time.perf_counter() if limits else None
     
+    # Cancelling the consuming task aborts whatever is awaited here, including the upstream read
+    generation.task = asyncio.current_task()
+    in_flight_gauge = metrics.UPSTREAM_IN_FLIGHT.labels(metrics.provider_label(provider_info))
+    in_flight_gauge.inc()
     try:
-        response = await client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            stream=True,
-            extra_body={"stream_options": {"include_usage": True}}
-        )
-        
-        full_content = ""
-        input_tokens = None
-        output_tokens = None
-        cached_input_tokens = None
-        
-        async for chunk in response:
-            if chunk.choices and len(chunk.choices) > 0:
-                delta = chunk.choices[0].delta.content or ""
-                if ttft is None and delta:
-                    ttft = time.time() - start_time
-                full_content += delta
-                
-            chunk_dict = chunk.model_dump() if hasattr(chunk, 'model_dump') else chunk.dict() if hasattr(chunk, 'dict') else getattr(chunk, '__dict__', {})
-            # Also check model_extra in case it's in extra fields
-            if hasattr(chunk, 'model_extra') and chunk.model_extra:
-                chunk_dict.update(chunk.model_extra)
-                
-            if 'usage' in chunk_dict and chunk_dict['usage']:
-                usage = chunk_dict['usage']
-                if isinstance(usage, dict):
-                    input_tokens = usage.get('prompt_tokens')
-                    output_tokens = usage.get('completion_tokens')
-                    details = usage.get('prompt_tokens_details', {})
-                    if details:
-                        cached_input_tokens = details.get('cached_tokens')
+        if generation.cancel_requested:
+            raise asyncio.CancelledError()
+        # The in-flight slot is held for the whole generation, including retries
+        async with limiter.slot(), asyncio.timeout(deadline()) as scope:
+            # Only opening the stream is retried; once content has been yielded a failure is final
+            while True:
+                await limiter.acquire(estimated_tokens)
+                start_time = time.perf_counter()
+                scope.reschedule(deadline())
+                try:
+                    response = await streams.open_stream(client, provider_info, model_name, messages, params)
+                    break
+                except Exception as e:
+                    delay = ratelimit.retry_delay(e, retries, max_retries)
+                    if delay is None:
+                        raise
+                    retries += 1
+                    metrics.UPSTREAM_RETRIES.labels(metrics.provider_label(provider_info), model_name).inc()
+                    logger.warning("Retrying model %s in %.1fs (attempt %d/%d): %s", model_name, delay, retries, max_retries, e)
+                    await asyncio.sleep(delay)
+            
+            async for kind, value in response.events():
+                if kind == "content":
+                    arrivals.append(time.perf_counter() - start_time)
+                    if ttft is None:
+                        ttft = arrivals[0]
+                        # From here on only the total deadline applies
+                        scope.reschedule(deadline())
+                    content_parts.append(value)
+                    yield "delta", value
+                elif kind == "reasoning":
+                    reasoning_parts.append(value)
+                    yield "reasoning", value
                 else:
-                    input_tokens = getattr(usage, 'prompt_tokens', None)
-                    output_tokens = getattr(usage, 'completion_tokens', None)
-                    details = getattr(usage, 'prompt_tokens_details', None)
-                    if details:
-                        cached_input_tokens = getattr(details, 'cached_tokens', None)
-        
-        end_time = time.time()
+                    input_tokens = value["input_tokens"]
+                    output_tokens = value["output_tokens"]
+                    cached_input_tokens = value["cached_input_tokens"]
+    except TimeoutError:
+        status = "timed_out"
+    except asyncio.CancelledError:
+        # Only a cancel through the handle is turned into a result; anything else (shutdown) propagates
+        if not generation.cancel_requested:
+            raise
+        asyncio.current_task().uncancel()
+        status = "cancelled"
+    except Exception as e:
+        logger.error("Error fetching from model %s: %s", model_name, e)
+        metrics.UPSTREAM_ERRORS.labels(metrics.provider_label(provider_info), model_name, type(e).__name__).inc()
+        status = "error"
+        error = e
+    finally:
+        generation.task = None
+        in_flight_gauge.dec()
+        if response is not None:
+            # Abort the upstream stream (a no-op once it was read to the end) so it stops generating
+            await response.close()
+    
+    if status == "error":
+        result = error_result(model_id, error, retries)
+    else:
+        end_time = time.perf_counter()
+        full_content = "".join(content_parts)
         
         total_time = end_time - start_time
-        # Fallback to rough token approximation if not provided by stream
-        estimated_output_tokens = output_tokens if output_tokens is not None else (len(full_content) / 4)
+        # Counted locally when the stream doesn't report usage
+        estimated_output_tokens = output_tokens if output_tokens is not None else tokens.count(full_content)
         tps = estimated_output_tokens / (total_time - (ttft or 0)) if total_time > (ttft or 0) else 0
+        limiter.settle(estimated_tokens, (input_tokens or estimated_tokens) + int(estimated_output_tokens))
         
-        return {
+        result = {
             "model_id": model_id,
-            "success": True,
+            # Cancelled and timed-out generations keep their partial content, but aren't successes
+            "success": status == "completed",
+            "status": status,
             "content": full_content,
+            "reasoning_content": "".join(reasoning_parts) or None,
             "ttft": ttft,
             "tps": tps,
             "output_tokens": int(estimated_output_tokens),
             "input_tokens": input_tokens,
-            "cached_input_tokens": cached_input_tokens
-        }
-    except Exception as e:
-        print(f"Error fetching from model {model_name}: {e}")
-        return {
-            "model_id": model_id,
-            "success": False,
-            "content": f"Error: {str(e)}",
-            "ttft": None,
-            "tps": None,
-            "output_tokens": 0,
-            "input_tokens": None,
-            "cached_input_tokens": None
+            "cached_input_tokens": cached_input_tokens,
+            "retry_count": retries,
+            "timeline": timing.pack_timeline(arrivals),
+            **timing.timeline_stats(arrivals, total_time),
+            # Waiting on the local rate limiter and retry backoff, before the request that answered
+            "queue_time": start_time - begin,
+            **(response.phases(start_time) if response is not None else {}),
         }
+    metrics.observe_generation(provider_info, model_name, result)
+    hedging.observe(result)
+    if cache_key is not None and result["success"]:
+        await cache.store(cache_key, result)
+    yield "result", result
 
+async def stream_hedged(model_id: int, sys_prompt: str, history: List[dict], user_msg: str, use_cache: bool, generation: Generation):
+    """
+    stream_llm_response across a hedging group: asks the fastest member first, a second one if no
+    output has arrived within the policy's delay (or the first failed), and streams whichever
+    yields first, cancelling the other. The result keeps the requested model_id and records the
+    member that answered in served_model_id.
+    """
+    policy = generation.hedge
+    primary, *backups = policy.ranked()
+    queue: asyncio.Queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    tasks = []
+    results = {}
+    winner = None
 
-@router.post("/chat/", response_model=List[schemas.Message])
-async def chat_with_models(req: ChatRequest, db: Session = Depends(get_db)):
-    conv = db.query(models.Conversation).filter(models.Conversation.id == req.conversation_id).first()
+    async def run(leg: dict, leg_generation: Generation):
+        try:
+            async for kind, payload in stream_llm_response(leg["model_id"], sys_prompt, history, user_msg, leg["provider_info"],
+                                                           leg["model_name"], use_cache, leg_generation):
+                queue.put_nowait((leg["model_id"], kind, payload))
+        except Exception as e:
+            # Raised before stream_llm_response could turn it into a result
+            queue.put_nowait((leg["model_id"], "result", error_result(leg["model_id"], e)))
+        finally:
+            queue.put_nowait((leg["model_id"], "closed", None))
+
+    def start(leg: dict):
+        leg_generation = Generation(leg["model_id"], leg["ttft_deadline"], leg["total_deadline"])
+        generation.legs.append(leg_generation)
+        if generation.cancel_requested:
+            leg_generation.cancel()
+        tasks.append(asyncio.create_task(run(leg, leg_generation)))
+
+    def fire_hedge():
+        if winner is None and backups and len(tasks) < 2:
+            start(backups[0])
+
+    start(primary)
+    timer = loop.call_later(policy.delay(primary["model_id"]), fire_hedge)
+    closed = 0
+    try:
+        while closed < len(tasks):
+            leg_id, kind, payload = await queue.get()
+            if kind == "closed":
+                closed += 1
+                continue
+            if kind == "result":
+                results[leg_id] = payload
+                if winner is None and not payload["success"] and not generation.cancel_requested:
+                    # Failed before any output: hedge now rather than when the timer fires
+                    fire_hedge()
+                if winner is not None or not payload["success"]:
+                    continue
+                # Finished without any output: nothing left to race for
+            if winner is None:
+                winner = leg_id
+                timer.cancel()
+                for leg_generation in generation.legs:
+                    if leg_generation.model_id != winner:
+                        leg_generation.cancel()
+            if leg_id == winner and kind != "result":
+                yield kind, payload
+    finally:
+        timer.cancel()
+        for task in tasks:
+            task.cancel()
+
+    hedged = len(tasks) > 1
+    served = winner
+    if served is None:
+        # Nothing was streamed: prefer a success, then the last leg to fail
+        successes = [mid for mid, res in results.items() if res["success"]]
+        served = successes[0] if successes else (list(results)[-1] if results else primary["model_id"])
+    outcome = "not_fired" if not hedged else ("primary_won" if served == primary["model_id"] else "hedge_won")
+    metrics.UPSTREAM_HEDGES.labels(policy.group_name, outcome).inc()
+    # Every leg normally ends with a result; a leg that didn't still gets one
+    res = results.get(served) or error_result(served, "no result from the hedging group")
+    yield "result", {**res, "model_id": model_id, "served_model_id": served, "hedged": hedged}
+
+async def fetch_llm_response(model_id: int, sys_prompt: str, history: List[dict], user_msg: str, provider_info: dict, model_name: str,
+                             use_cache: bool = True, generation: Optional[Generation] = None):
+    async for kind, payload in stream_llm_response(model_id, sys_prompt, history, user_msg, provider_info, model_name, use_cache, generation):
+        if kind == "result":
+            return payload
+
+async def load_model_histories(db: AsyncSession, model_ids: List[int], reply_to_id: Optional[int]) -> Dict[int, List[dict]]:
+    """
+    Builds every selected model's thread for a reply to the user message `reply_to_id`, with a
+    single query walking the branch above it: a model sees the branch's user turns plus only
+    its own active replies.
+    """
+    histories = {mid: [] for mid in model_ids}
+    if reply_to_id is None:
+        return histories
+    rows = (await db.execute(branches.history_rows(reply_to_id, model_ids))).all()
+    # Bodies come from the content store's LRU; only the ones not in it are fetched
+    texts = await content.texts(db, [row.content_hash for row in rows if row.content_hash])
+    for role, model_id, content_hash, inline in rows:
+        body = texts[content_hash] if content_hash else inline
+        if role == "user":
+            turn = {"role": "user", "content": body}
+            for history in histories.values():
+                history.append(turn)
+        elif model_id in histories:
+            histories[model_id].append({"role": "assistant", "content": body})
+    return histories
+
+async def prepare_jobs(db: AsyncSession, models_to_use: List[int], sys_prompt: str, reply_to_id: Optional[int], user_content: str, use_cache: bool = True) -> List[tuple]:
+    # Resolve provider info up front to avoid passing the session into async routines
+    result = await db.scalars(
+        select(models.Model).options(
+            selectinload(models.Model.provider),
+            # Hedging groups need every member's provider too
+            selectinload(models.Model.group).selectinload(models.ModelGroup.models).selectinload(models.Model.provider),
+        ).filter(models.Model.id.in_(models_to_use))
+    )
+    by_id = {m.id: m for m in result.all()}
+    histories = await load_model_histories(db, list(by_id), reply_to_id)
+    jobs = []
+    for mid in models_to_use:
+        db_model = by_id.get(mid)
+        if db_model:
+            p_info = clients.provider_info(db_model.provider)
+            generation = Generation(mid, db_model.ttft_deadline, db_model.total_deadline, hedging.policy_for(db_model))
+            budget = tokens.input_budget(db_model.context_window, db_model.max_input_tokens)
+            history, dropped = tokens.fit_history(sys_prompt, histories[mid], user_content, budget)
+            if dropped:
+                metrics.CONTEXT_TRIMMED.labels(metrics.provider_label(p_info), db_model.model_id).inc(dropped)
+            jobs.append((mid, sys_prompt, history, user_content, p_info, db_model.model_id, use_cache, generation))
+    return jobs
+
+async def messages_by_id(db: AsyncSession, message_ids: List[int]) -> list:
+    result = await db.scalars(
+        select(models.Message).options(selectinload(models.Message.generation_metadata))
+        .filter(models.Message.id.in_(message_ids)).order_by(models.Message.seq)
+        .execution_options(populate_existing=True)
+    )
+    return result.all()
+
+async def reload_message(db: AsyncSession, message_id: int) -> models.Message:
+    return await db.scalar(
+        select(models.Message).options(selectinload(models.Message.generation_metadata))
+        .filter(models.Message.id == message_id).execution_options(populate_existing=True)
+    )
+
+# --- Streaming (Server-Sent Events) ---
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def serialize_message(msg: models.Message) -> dict:
+    return schemas.Message.model_validate(msg).model_dump(mode="json")
+
+async def multiplex_streams(conversation_id: int, jobs: List[tuple], on_result):
+    """
+    Runs every job concurrently and yields SSE frames as soon as any model produces output.
+    `await on_result(result)` persists a finished model and returns the message to emit.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    turn = start_turn(conversation_id, jobs)
+
+    async def pump(job):
+        # Persisting happens here rather than in the response, so that output is stored even after a disconnect
+        try:
+            async for kind, payload in stream_llm_response(*job):
+                if kind == "result":
+                    payload = serialize_message(await on_result(payload))
+                queue.put_nowait((job[0], kind, payload))
+        except Exception as e:
+            # Storing or serializing the result failed: the client still hears about this model
+            logger.exception("Streaming model %s failed", job[0])
+            queue.put_nowait((job[0], "error", str(e)))
+        finally:
+            queue.put_nowait((job[0], "closed", None))
+
+    tasks = [asyncio.create_task(pump(job)) for job in jobs]
+    asyncio.gather(*tasks, return_exceptions=True).add_done_callback(lambda _: turn.finish())
+    remaining = len(tasks)
+    try:
+        while remaining:
+            mid, kind, payload = await queue.get()
+            if kind == "closed":
+                remaining -= 1
+            elif kind == "delta":
+                yield sse_event("delta", {"model_id": mid, "content": payload})
+            elif kind == "reasoning":
+                yield sse_event("reasoning", {"model_id": mid, "content": payload})
+            elif kind == "result":
+                yield sse_event("result", {"model_id": mid, "message": payload})
+            elif kind == "error":
+                yield sse_event("error", {"model_id": mid, "detail": payload})
+        yield sse_event("end", {})
+    finally:
+        # Client went away or an error bubbled up: abort the remaining upstream streams, keeping their partial output
+        turn.cancel()
+
+def streaming_response(generator) -> StreamingResponse:
+    return StreamingResponse(
+        generator,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def persist_new_results(conversation_id: int, reply_to_id: int):
+    """Returns an on_result callback that inserts each finished model's reply in its own short transaction."""
+    async def persist(res):
+        async with database.AsyncSessionLocal() as db:
+            [message_id] = await persistence.add_results(db, conversation_id, [res], reply_to_id)
+            await db.commit()
+            return await reload_message(db, message_id)
+    return persist
+
+async def add_user_message(db: AsyncSession, conv: models.Conversation, body: str, parent_id: Optional[int]) -> models.Message:
+    """Adds a user message under `parent_id` and makes it the head of the active branch."""
+    user_msg = models.Message(
+        conversation_id=conv.id,
+        seq=await persistence.allocate_seq(db, conv.id),
+        role="user",
+        parent_id=parent_id,
+        content_hash=await content.put(db, body)
+    )
+    db.add(user_msg)
+    await db.flush()
+    conv.head_id = user_msg.id
+    await db.commit()
+    return await reload_message(db, user_msg.id)
+
+async def start_chat(req: ChatRequest, db: AsyncSession) -> tuple:
+    conv = await db.get(models.Conversation, req.conversation_id)
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     # Update system prompt if changed
     if conv.system_prompt != req.system_prompt:
-        conv.system_prompt = req.system_prompt
-        db.commit()
-        
-    # Get history
-    db_messages = db.query(models.Message).options(joinedload(models.Message.generation_metadata)).filter(
-        models.Message.conversation_id == req.conversation_id
-    ).order_by(models.Message.created_at).all()
+        await content.set_system_prompt(db, conv, req.system_prompt)
     
-    # Save user message
-    user_msg = models.Message(
-        conversation_id=req.conversation_id,
-        role="user",
-        content=req.message
-    )
-    db.add(user_msg)
-    db.commit()
-    db.refresh(user_msg)
+    # Save user message at the end of the active branch
+    user_msg = await add_user_message(db, conv, req.message, await branches.ensure_linked(db, conv))
     
-    # Gather provider info to avoid passing session into async routines
-    tasks = []
-    for mid in req.models_to_use:
-        db_model = db.query(models.Model).filter(models.Model.id == mid).first()
-        if db_model:
-            provider = db_model.provider
-            p_info = {
-                "api_key": provider.api_key,
-                "base_url": provider.base_url
-            }
-            model_history = []
-            for m in db_messages:
-                if m.role == "user":
-                    model_history.append({"role": "user", "content": m.content})
-                elif m.role == "assistant":
-                    if any(meta.model_id == mid for meta in m.generation_metadata):
-                        model_history.append({"role": "assistant", "content": m.content})
-                        
-            tasks.append(fetch_llm_response(mid, req.system_prompt, model_history, req.message, p_info, db_model.model_id))
+    return user_msg, await prepare_jobs(db, req.models_to_use, req.system_prompt, user_msg.id, req.message, not req.bypass_cache)
+
+async def cancel_on_disconnect(request: Request, turn: Turn):
+    # A plain (non-streaming) response never notices the client leaving on its own
+    while not turn.done.is_set():
+        if await request.is_disconnected():
+            turn.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL)
+
+async def gather_turn(request: Request, conversation_id: int, jobs: List[tuple]) -> list:
+    async with track_turn(conversation_id, jobs) as turn:
+        watcher = asyncio.create_task(cancel_on_disconnect(request, turn))
+        try:
+            return await asyncio.gather(*(fetch_llm_response(*job) for job in jobs))
+        finally:
+            watcher.cancel()
+
+@router.post("/chat/", response_model=List[schemas.Message])
+async def chat_with_models(req: ChatRequest, request: Request, db: AsyncSession = Depends(get_db)):
+    user_msg, jobs = await start_chat(req, db)
+    # Release the pooled connection while the models generate
+    await db.close()
     
     # Fire requests concurrently
-    results = await asyncio.gather(*tasks)
+    results = await gather_turn(request, req.conversation_id, jobs)
     
-    # Now write results sequentially to the DB using the synchronous session
-    for res in results:
-        ast_msg = models.Message(
-            conversation_id=req.conversation_id,
-            role="assistant",
-            content=res["content"]
-        )
-        db.add(ast_msg)
-        db.flush() # get ast_msg.id
-        
-        meta = models.GenerationMetadata(
-            message_id=ast_msg.id,
-            model_id=res["model_id"],
-            time_to_first_token=res["ttft"],
-            tokens_per_second=res["tps"],
-            output_tokens=res["output_tokens"],
-            input_tokens=res.get("input_tokens"),
-            cached_input_tokens=res.get("cached_input_tokens")
-        )
-        db.add(meta)
-    
-    db.commit()
+    # Now write all results to the DB in one batch
+    message_ids = await persistence.add_results(db, req.conversation_id, results, user_msg.id)
+    await db.commit()
     
-    # Return updated conversation messages
-    return db.query(models.Message).filter(models.Message.conversation_id == req.conversation_id).all()
+    # Return only this turn's messages; clients append them to what they already have
+    return await messages_by_id(db, [user_msg.id] + message_ids)
+
+@router.post("/chat/stream/")
+async def chat_with_models_stream(req: ChatRequest, db: AsyncSession = Depends(get_db)):
+    user_msg, jobs = await start_chat(req, db)
+    user_payload = serialize_message(user_msg)
+    await db.close()
+
+    async def events():
+        yield sse_event("user_message", user_payload)
+        async for frame in multiplex_streams(req.conversation_id, jobs, persist_new_results(req.conversation_id, user_payload["id"])):
+            yield frame
+
+    return streaming_response(events())
 
 
 class EditRequest(schemas.BaseModel):
@@ -180,88 +572,62 @@ class EditRequest(schemas.BaseModel):
     message_id: int
     new_content: str
     system_prompt: str
+    bypass_cache: bool = False
 
-@router.put("/chat/edit/", response_model=List[schemas.Message])
-async def edit_and_regenerate(req: EditRequest, db: Session = Depends(get_db)):
-    conv = db.query(models.Conversation).filter(models.Conversation.id == req.conversation_id).first()
+async def start_edit(req: EditRequest, db: AsyncSession) -> tuple:
+    conv = await db.get(models.Conversation, req.conversation_id)
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
+    await branches.ensure_linked(db, conv)
         
-    target_msg = db.query(models.Message).filter(models.Message.id == req.message_id, models.Message.conversation_id == req.conversation_id).first()
+    target_msg = await db.scalar(select(models.Message).filter(models.Message.id == req.message_id, models.Message.conversation_id == req.conversation_id))
     if not target_msg or target_msg.role != "user":
         raise HTTPException(status_code=400, detail="Invalid user message to edit")
-        
-    # Delete all messages after this one
-    messages_after = db.query(models.Message).filter(
-        models.Message.conversation_id == req.conversation_id,
-        models.Message.created_at > target_msg.created_at
-    ).all()
-    for m in messages_after:
-        db.delete(m)
-        
-    # Update content
-    target_msg.content = req.new_content
     
     if conv.system_prompt != req.system_prompt:
-        conv.system_prompt = req.system_prompt
-    db.commit()
+        await content.set_system_prompt(db, conv, req.system_prompt)
     
-    # Get history up to (and including) this edited message
-    db_messages = db.query(models.Message).options(joinedload(models.Message.generation_metadata)).filter(
-        models.Message.conversation_id == req.conversation_id,
-        models.Message.created_at <= target_msg.created_at
-    ).order_by(models.Message.created_at).all()
+    # The edit is a new branch next to the original, which keeps its replies and anything after it
+    user_msg = await add_user_message(db, conv, req.new_content, target_msg.parent_id)
     
-    tasks = []
-    for mid in req.models_to_use:
-        db_model = db.query(models.Model).filter(models.Model.id == mid).first()
-        if db_model:
-            provider = db_model.provider
-            p_info = {"api_key": provider.api_key, "base_url": provider.base_url}
-            model_history = []
-            for m in db_messages[:-1]:
-                if m.role == "user":
-                    model_history.append({"role": "user", "content": m.content})
-                elif m.role == "assistant":
-                    if any(meta.model_id == mid for meta in m.generation_metadata):
-                        model_history.append({"role": "assistant", "content": m.content})
-                        
-            tasks.append(fetch_llm_response(mid, req.system_prompt, model_history, req.new_content, p_info, db_model.model_id))
+    return user_msg, await prepare_jobs(db, req.models_to_use, req.system_prompt, user_msg.id, req.new_content, not req.bypass_cache)
+
+@router.put("/chat/edit/", response_model=List[schemas.Message])
+async def edit_and_regenerate(req: EditRequest, request: Request, db: AsyncSession = Depends(get_db)):
+    user_msg, jobs = await start_edit(req, db)
+    await db.close()
             
-    results = await asyncio.gather(*tasks)
+    results = await gather_turn(request, req.conversation_id, jobs)
     
-    for res in results:
-        ast_msg = models.Message(
-            conversation_id=req.conversation_id,
-            role="assistant",
-            content=res["content"]
-        )
-        db.add(ast_msg)
-        db.flush()
-        meta = models.GenerationMetadata(
-            message_id=ast_msg.id,
-            model_id=res["model_id"],
-            time_to_first_token=res["ttft"],
-            tokens_per_second=res["tps"],
-            output_tokens=res["output_tokens"],
-            input_tokens=res.get("input_tokens"),
-            cached_input_tokens=res.get("cached_input_tokens")
-        )
-        db.add(meta)
-    db.commit()
-    return db.query(models.Message).filter(models.Message.conversation_id == req.conversation_id).order_by(models.Message.created_at).all()
+    message_ids = await persistence.add_results(db, req.conversation_id, results, user_msg.id)
+    await db.commit()
+    # The edited message, as a new branch, plus its new replies
+    return await messages_by_id(db, [user_msg.id] + message_ids)
+
+@router.put("/chat/edit/stream/")
+async def edit_and_regenerate_stream(req: EditRequest, db: AsyncSession = Depends(get_db)):
+    user_msg, jobs = await start_edit(req, db)
+    user_payload = serialize_message(user_msg)
+    await db.close()
+
+    async def events():
+        yield sse_event("user_message", user_payload)
+        async for frame in multiplex_streams(req.conversation_id, jobs, persist_new_results(req.conversation_id, user_payload["id"])):
+            yield frame
+
+    return streaming_response(events())
 
 class RegenerateRequest(schemas.BaseModel):
     message_id: int
     system_prompt: str
+    bypass_cache: bool = False
 
-@router.post("/chat/regenerate/", response_model=List[schemas.Message])
-async def regenerate_single_message(req: RegenerateRequest, db: Session = Depends(get_db)):
-    target_msg = db.query(models.Message).filter(models.Message.id == req.message_id).first()
+async def start_regenerate(req: RegenerateRequest, db: AsyncSession) -> tuple:
+    target_msg = await db.get(models.Message, req.message_id, options=[selectinload(models.Message.conversation)])
     if not target_msg or target_msg.role != "assistant":
         raise HTTPException(status_code=400, detail="Invalid assistant message to regenerate")
         
-    meta = db.query(models.GenerationMetadata).filter(models.GenerationMetadata.message_id == target_msg.id).first()
+    meta = await db.scalar(select(models.GenerationMetadata).filter(models.GenerationMetadata.message_id == target_msg.id))
     if not meta:
         raise HTTPException(status_code=400, detail="Missing metadata for regeneration")
         
@@ -269,48 +635,50 @@ async def regenerate_single_message(req: RegenerateRequest, db: Session = Depend
     model_id = meta.model_id
     
     if conv.system_prompt != req.system_prompt:
-        conv.system_prompt = req.system_prompt
-        db.commit()
+        await content.set_system_prompt(db, conv, req.system_prompt)
+    if conv.head_id is None:
+        await branches.ensure_linked(db, conv)
+        await db.refresh(target_msg, ["parent_id"])
+    await db.commit()
         
-    # Get history leading up to the closest user message before this assistant message
-    all_msgs = db.query(models.Message).filter(
-        models.Message.conversation_id == target_msg.conversation_id,
-        models.Message.created_at < target_msg.created_at
-    ).order_by(models.Message.created_at.desc()).all()
-    
-    last_user_msg = next((m for m in all_msgs if m.role == "user"), None)
-    if not last_user_msg:
+    # The new reply answers the same user message, with the branch above it as history
+    user_msg = await db.get(models.Message, target_msg.parent_id) if target_msg.parent_id is not None else None
+    if not user_msg:
          raise HTTPException(status_code=400, detail="No preceding user message to regenerate from")
-         
-    db_messages = db.query(models.Message).options(joinedload(models.Message.generation_metadata)).filter(
-        models.Message.conversation_id == target_msg.conversation_id,
-        models.Message.created_at < last_user_msg.created_at
-    ).order_by(models.Message.created_at).all()
-    
-    model_history = []
-    for m in db_messages:
-        if m.role == "user":
-            model_history.append({"role": "user", "content": m.content})
-        elif m.role == "assistant":
-            if any(meta.model_id == model_id for meta in m.generation_metadata):
-                 model_history.append({"role": "assistant", "content": m.content})
     
     # Re-fetch just for this model
-    db_model = db.query(models.Model).filter(models.Model.id == model_id).first()
-    provider = db_model.provider
-    p_info = {"api_key": provider.api_key, "base_url": provider.base_url}
+    jobs = await prepare_jobs(db, [model_id], req.system_prompt, user_msg.id, user_msg.content, not req.bypass_cache)
+    if not jobs:
+        raise HTTPException(status_code=400, detail="Model for regeneration no longer exists")
+    return target_msg, user_msg, jobs[0]
+
+@router.post("/chat/regenerate/", response_model=List[schemas.Message])
+async def regenerate_single_message(req: RegenerateRequest, request: Request, db: AsyncSession = Depends(get_db)):
+    target_msg, user_msg, job = await start_regenerate(req, db)
+    await db.commit() # end the read transaction so no connection is held during generation
     
     # Do generation request
-    res = await fetch_llm_response(model_id, req.system_prompt, model_history, last_user_msg.content, p_info, db_model.model_id)
+    [res] = await gather_turn(request, target_msg.conversation_id, [job])
     
-    # Update in-place
-    target_msg.content = res["content"]
-    meta.time_to_first_token = res["ttft"]
-    meta.tokens_per_second = res["tps"]
-    meta.output_tokens = res["output_tokens"]
-    meta.input_tokens = res.get("input_tokens")
-    meta.cached_input_tokens = res.get("cached_input_tokens")
-    db.commit()
+    # Stored next to the original, which stays as an inactive alternative
+    message_ids = await persistence.add_results(db, target_msg.conversation_id, [res], user_msg.id)
+    await db.commit()
     
-    return db.query(models.Message).filter(models.Message.conversation_id == target_msg.conversation_id).order_by(models.Message.created_at).all()
+    return await messages_by_id(db, message_ids)
+
+@router.post("/chat/regenerate/stream/")
+async def regenerate_single_message_stream(req: RegenerateRequest, db: AsyncSession = Depends(get_db)):
+    target_msg, user_msg, job = await start_regenerate(req, db)
+    conversation_id, reply_to_id = target_msg.conversation_id, user_msg.id
+    await db.close()
+    return streaming_response(multiplex_streams(conversation_id, [job], persist_new_results(conversation_id, reply_to_id)))
+
+class CancelRequest(schemas.BaseModel):
+    conversation_id: int
+    model_ids: Optional[List[int]] = None # all models when omitted
 
+@router.post("/chat/cancel/")
+async def cancel_chat(req: CancelRequest):
+    """Aborts the conversation's in-flight generations; their partial output is stored with status 'cancelled'."""
+    cancelled = await cancel_generations(req.conversation_id, req.model_ids)
+    return {"status": "success", "cancelled": cancelled}
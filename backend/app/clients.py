@@ -0,0 +1,153 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+# Defaults for providers that don't override their pool settings
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 600.0
+# The settings a client is built from; rate limits and the like don't need a new connection pool
+CONNECTION_SETTINGS = ("base_url", "api_key", "http2", "max_connections", "max_keepalive_connections",
+                       "keepalive_expiry", "connect_timeout", "read_timeout")
+
+
+def provider_info(provider) -> dict:
+    # Plain dict snapshot of a Provider row so async routines never touch the session
+    return {
+        "id": provider.id,
+        "name": provider.name,
+        "api_key": provider.api_key,
+        "base_url": provider.base_url,
+        "max_connections": provider.max_connections,
+        "max_keepalive_connections": provider.max_keepalive_connections,
+        "keepalive_expiry": provider.keepalive_expiry,
+        "http2": provider.http2,
+        "connect_timeout": provider.connect_timeout,
+        "read_timeout": provider.read_timeout,
+        "requests_per_minute": provider.requests_per_minute,
+        "tokens_per_minute": provider.tokens_per_minute,
+        "max_in_flight": provider.max_in_flight,
+        "max_retries": provider.max_retries,
+        "stream_decoder": provider.stream_decoder,
+    }
+
+
+def _fingerprint(info: dict) -> tuple:
+    return tuple(info.get(k) for k in CONNECTION_SETTINGS)
+
+
+def _or(value, default):
+    return default if value is None else value
+
+
+@dataclass
+class ProviderClient:
+    fingerprint: tuple
+    http: httpx.AsyncClient
+    openai: AsyncOpenAI
+
+
+class ClientRegistry:
+    """
+    Long-lived upstream clients keyed by provider id, so every model call reuses
+    warm keep-alive connections instead of paying DNS/TCP/TLS setup in its TTFT.
+    """
+
+    def __init__(self):
+        self._clients: Dict[int, ProviderClient] = {}
+        self._stale: List[ProviderClient] = []
+        self._closing: Dict[asyncio.Task, ProviderClient] = {} # grace-period closes of stale clients
+
+    def _build(self, info: dict) -> ProviderClient:
+        limits = httpx.Limits(
+            max_connections=_or(info.get("max_connections"), DEFAULT_MAX_CONNECTIONS),
+            max_keepalive_connections=_or(info.get("max_keepalive_connections"), DEFAULT_MAX_KEEPALIVE_CONNECTIONS),
+            keepalive_expiry=_or(info.get("keepalive_expiry"), DEFAULT_KEEPALIVE_EXPIRY),
+        )
+        timeout = httpx.Timeout(
+            _or(info.get("read_timeout"), DEFAULT_READ_TIMEOUT),
+            connect=_or(info.get("connect_timeout"), DEFAULT_CONNECT_TIMEOUT),
+        )
+        headers = {}
+        if info.get("api_key"):
+            headers["Authorization"] = f"Bearer {info['api_key']}"
+        http = httpx.AsyncClient(limits=limits, timeout=timeout, http2=bool(info.get("http2")), headers=headers)
+        openai_client = AsyncOpenAI(
+            api_key=info.get("api_key") or "EMPTY",
+            base_url=info["base_url"],
+            http_client=http,
+            # Retries are owned by ratelimit so they respect the provider's limits and get counted
+            max_retries=0,
+        )
+        return ProviderClient(fingerprint=_fingerprint(info), http=http, openai=openai_client)
+
+    def get(self, info: dict) -> ProviderClient:
+        # Must be called from the event loop
+        self._reap_stale()
+        provider_id = info["id"]
+        client = self._clients.get(provider_id)
+        if client is not None and client.fingerprint != _fingerprint(info):
+            # Provider row changed since the client was built
+            self.invalidate(provider_id)
+            self._reap_stale()
+            client = None
+        if client is None:
+            client = self._build(info)
+            self._clients[provider_id] = client
+        return client
+
+    def invalidate(self, provider_id: int):
+        # Safe to call from sync handlers; the old pool is closed later from the loop
+        client = self._clients.pop(provider_id, None)
+        if client is not None:
+            self._stale.append(client)
+
+    def _reap_stale(self):
+        stale, self._stale = self._stale, []
+        for client in stale:
+            task = asyncio.get_running_loop().create_task(self._close_after_grace(client))
+            self._closing[task] = client
+            task.add_done_callback(lambda task: self._closing.pop(task, None))
+
+    async def _close_after_grace(self, client: ProviderClient):
+        # Give in-flight streams on the old pool time to finish before closing it
+        try:
+            await asyncio.sleep(client.http.timeout.read or DEFAULT_READ_TIMEOUT)
+        finally:
+            await client.http.aclose()
+
+    async def close(self):
+        # A grace-period task cancelled before it ran never reaches its aclose, so its client is closed here too
+        clients = list(self._clients.values()) + self._stale + list(self._closing.values())
+        self._clients, self._stale = {}, []
+        closing = list(self._closing)
+        for task in closing:
+            task.cancel()
+        await asyncio.gather(*closing, return_exceptions=True)
+        await asyncio.gather(*(c.http.aclose() for c in clients), return_exceptions=True)
+
+
+registry: Optional[ClientRegistry] = None
+
+
+def get_registry() -> ClientRegistry:
+    global registry
+    if registry is None:
+        registry = ClientRegistry()
+    return registry
+
+
+async def startup():
+    get_registry()
+
+
+async def shutdown():
+    global registry
+    if registry is not None:
+        await registry.close()
+        registry = None
@@ -0,0 +1,245 @@
+"""
+Content store. Message bodies and system prompts are kept once per distinct text in
+content_blobs, keyed by the sha256 of the text: a prompt sent to ten models, or a system
+prompt shared by a thousand conversations, is a single row. Texts of at least
+CONTENT_COMPRESS_MIN_BYTES are zlib-compressed when that makes them smaller. Decoded
+texts stay in an in-process LRU, so hot histories skip both the fetch and the decompression.
+
+Rows written before the store keep their text inline until migrated:
+
+    python -m app.content migrate    # adds the columns if needed, then moves inline texts over in batches
+    python -m app.content stats      # storage saved, and history load times with a cold and a warm LRU
+    python -m app.content gc         # drops blobs nothing references any more
+"""
+from sqlalchemy import select, update, delete, func, exists, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import time
+import zlib
+
+from . import models, database
+from .database import upsert
+from .lru import LRUCache
+
+CONTENT_COMPRESS_MIN_BYTES = int(os.getenv("CONTENT_COMPRESS_MIN_BYTES", "1024"))
+CONTENT_CACHE_ENTRIES = int(os.getenv("CONTENT_CACHE_ENTRIES", "10000"))
+CONTENT_CACHE_BYTES = int(os.getenv("CONTENT_CACHE_BYTES", str(64 * 1024 * 1024)))
+COMPRESS_LEVEL = 6
+MIGRATE_BATCH = 1000
+# Blobs younger than this are never collected: a writer may be about to reference one
+GC_GRACE = timedelta(hours=1)
+
+# Decoded texts by hash; they never change, so entries only leave by LRU eviction
+hot = LRUCache(CONTENT_CACHE_ENTRIES, CONTENT_CACHE_BYTES, math.inf)
+
+
+def content_hash(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def encode(value: str) -> dict:
+    raw = value.encode()
+    if len(raw) >= CONTENT_COMPRESS_MIN_BYTES:
+        packed = zlib.compress(raw, COMPRESS_LEVEL)
+        if len(packed) < len(raw):
+            return {"codec": "zlib", "data": packed, "size": len(raw)}
+    return {"codec": "none", "data": raw, "size": len(raw)}
+
+
+def decode(key: str, codec: str, data: bytes, size: int, remember: bool = True) -> str:
+    value = hot.get(key)
+    if value is None:
+        value = (zlib.decompress(data) if codec == "zlib" else data).decode()
+        if remember:
+            hot.put(key, value, size)
+    return value
+
+
+def text_of(blob: Optional["models.ContentBlob"], inline: Optional[str]) -> Optional[str]:
+    """Text of a loaded blob, or the inline text of a row written before the store."""
+    if blob is None:
+        return inline
+    return decode(blob.hash, blob.codec, blob.data, blob.size)
+
+
+async def put_many(db: AsyncSession, values: List[str]) -> List[str]:
+    """Stores the texts in the caller's transaction, each distinct one once; returns their hashes in order."""
+    hashes = [content_hash(v) for v in values]
+    rows = {}
+    for key, value in zip(hashes, values):
+        if key not in rows:
+            rows[key] = {"hash": key, **encode(value)}
+            hot.put(key, value, rows[key]["size"])
+    if rows:
+        stmt = upsert(db, models.ContentBlob.__table__).values(list(rows.values()))
+        await db.execute(stmt.on_conflict_do_nothing(index_elements=["hash"]))
+    return hashes
+
+
+async def put(db: AsyncSession, value: str) -> str:
+    return (await put_many(db, [value]))[0]
+
+
+async def texts(db: AsyncSession, hashes: Iterable[str], remember: bool = True) -> Dict[str, str]:
+    """Texts by hash: from the LRU where possible, the rest with one query."""
+    found = {}
+    missing = []
+    for key in set(hashes):
+        value = hot.get(key)
+        if value is None:
+            missing.append(key)
+        else:
+            found[key] = value
+    if missing:
+        Blob = models.ContentBlob
+        rows = await db.execute(select(Blob.hash, Blob.codec, Blob.data, Blob.size).filter(Blob.hash.in_(missing)))
+        for key, codec, data, size in rows:
+            found[key] = decode(key, codec, data, size, remember)
+    return found
+
+
+async def set_content(db: AsyncSession, msg: "models.Message", value: str):
+    msg.content_hash = await put(db, value)
+    msg.content_blob = await db.get(models.ContentBlob, msg.content_hash)
+    msg.legacy_content = None
+
+
+async def set_system_prompt(db: AsyncSession, conv: "models.Conversation", value: str):
+    conv.system_prompt_hash = await put(db, value)
+    conv.system_prompt_blob = await db.get(models.ContentBlob, conv.system_prompt_hash)
+    conv.legacy_system_prompt = None
+
+
+# --- Migration and maintenance ---
+
+# Databases created before the store have the tables but not these columns
+POSTGRES_DDL = [
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64) REFERENCES content_blobs (hash)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_content_hash ON messages (content_hash)",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS system_prompt_hash VARCHAR(64) REFERENCES content_blobs (hash)",
+    "CREATE INDEX IF NOT EXISTS ix_conversations_system_prompt_hash ON conversations (system_prompt_hash)",
+]
+
+def stored_texts() -> list:
+    # (table, hash column, inline column); a function because models imports this module
+    return [
+        ("messages", models.Message.content_hash, models.Message.legacy_content),
+        ("conversations", models.Conversation.system_prompt_hash, models.Conversation.legacy_system_prompt),
+    ]
+
+
+async def migrate(batch: int = MIGRATE_BATCH) -> dict:
+    """Moves inline texts into the store, one transaction per batch, so it can run while the app is up."""
+    await database.init_models()
+    if database.get_engine().dialect.name == "postgresql":
+        async with database.get_engine().begin() as conn:
+            for statement in POSTGRES_DDL:
+                await conn.execute(text(statement))
+    counts = {}
+    async with database.AsyncSessionLocal() as db:
+        for table, hash_column, inline in stored_texts():
+            model = hash_column.class_
+            counts[table] = 0
+            while True:
+                rows = (await db.execute(
+                    select(model.id, inline).filter(inline.is_not(None)).order_by(model.id).limit(batch)
+                )).all()
+                if not rows:
+                    break
+                hashes = await put_many(db, [value for _, value in rows])
+                await db.execute(
+                    update(model),
+                    [{"id": row_id, hash_column.key: key, inline.key: None} for (row_id, _), key in zip(rows, hashes)],
+                )
+                await db.commit()
+                counts[table] += len(rows)
+                print(f"Migrated {counts[table]} {table}")
+    return counts
+
+
+async def collect_garbage(db: AsyncSession) -> int:
+    """Deletes blobs that no message or conversation references."""
+    Blob = models.ContentBlob
+    stmt = delete(Blob).where(Blob.created_at < datetime.now(timezone.utc) - GC_GRACE)
+    for _, hash_column, _ in stored_texts():
+        stmt = stmt.where(~exists().where(hash_column == Blob.hash))
+    removed = (await db.execute(stmt)).rowcount
+    await db.commit()
+    return removed
+
+
+async def stats(db: AsyncSession, sample: int = 50) -> dict:
+    """Storage effect of the store, and history load times for recent conversations."""
+    Blob = models.ContentBlob
+    report = {}
+    logical = 0
+    for table, hash_column, inline in stored_texts():
+        referenced, size = (await db.execute(
+            select(func.count(), func.coalesce(func.sum(Blob.size), 0)).select_from(hash_column.class_)
+            .join(Blob, Blob.hash == hash_column)
+        )).one()
+        unmigrated = await db.scalar(select(func.count()).select_from(hash_column.class_).filter(inline.is_not(None)))
+        report[table] = {"stored_rows": referenced, "unmigrated_rows": unmigrated}
+        logical += size
+    blobs, raw, stored, compressed = (await db.execute(select(
+        func.count(), func.coalesce(func.sum(Blob.size), 0), func.coalesce(func.sum(func.length(Blob.data)), 0),
+        func.count().filter(Blob.codec == "zlib"),
+    ))).one()
+    report["blobs"] = {"count": blobs, "compressed": compressed}
+    report["bytes"] = {
+        "referenced": logical, # what inline columns would hold
+        "distinct": raw, # after deduplication
+        "stored": stored, # after compression
+        "saved_ratio": round(1 - stored / logical, 3) if logical else 0.0,
+    }
+
+    conversation_ids = (await db.scalars(
+        select(models.Conversation.id).order_by(models.Conversation.id.desc()).limit(sample)
+    )).all()
+    timings = {}
+    for label in ("cold", "warm"):
+        if label == "cold":
+            hot.clear()
+        start = time.perf_counter()
+        for conversation_id in conversation_ids:
+            hashes = (await db.scalars(
+                select(models.Message.content_hash).filter(models.Message.conversation_id == conversation_id)
+                .order_by(models.Message.seq)
+            )).all()
+            await texts(db, [h for h in hashes if h])
+        elapsed = time.perf_counter() - start
+        timings[f"{label}_ms_per_history"] = round(elapsed * 1000 / max(len(conversation_ids), 1), 3)
+    report["history_load"] = {"conversations": len(conversation_ids), **timings}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["migrate", "stats", "gc"])
+    parser.add_argument("--batch", type=int, default=MIGRATE_BATCH, help="rows per transaction when migrating")
+    parser.add_argument("--sample", type=int, default=50, help="conversations timed by stats")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            if args.command == "migrate":
+                print(await migrate(args.batch))
+                return
+            async with database.AsyncSessionLocal() as db:
+                if args.command == "stats":
+                    print(await stats(db, args.sample))
+                else:
+                    print(f"Removed {await collect_garbage(db)} blobs")
+        finally:
+            await database.dispose_engine()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
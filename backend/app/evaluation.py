@@ -0,0 +1,393 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select, update, func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+import asyncio
+import json
+import logging
+import os
+
+from . import models, schemas, database, clients, content, jobs
+from .chat import fetch_llm_response, Generation
+from .persistence import add_results
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+get_db = database.get_db
+
+PROMPT_FIELDS = ("prompt", "message", "content", "body", "text", "question")
+KEY_FIELDS = ("id", "request_id", "key")
+MAX_RUNS = int(os.getenv("EVALUATION_MAX_RUNS", "4")) # runs executing at once in one process
+POLL_INTERVAL = float(os.getenv("EVALUATION_POLL_INTERVAL", "2.0")) # seconds
+HEARTBEAT_INTERVAL = float(os.getenv("EVALUATION_HEARTBEAT_INTERVAL", "5.0")) # seconds
+# A running run without a heartbeat for this long lost its process and is claimed again
+STALE_AFTER = float(os.getenv("EVALUATION_STALE_AFTER", "60")) # seconds
+
+def parse_dataset(text: str, prompt_field: Optional[str] = None) -> List[dict]:
+    """
+    Parses a JSONL prompt dataset. Each non-empty line is either a JSON string or an
+    object holding the prompt under `prompt_field` (or one of the common field names).
+    """
+    rows = []
+    for lineno, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {lineno}: invalid JSON ({e})")
+        if isinstance(row, str):
+            rows.append({"index": lineno, "key": None, "prompt": row})
+            continue
+        if not isinstance(row, dict):
+            raise ValueError(f"Line {lineno}: expected a string or an object")
+        fields = (prompt_field,) if prompt_field else PROMPT_FIELDS
+        field = next((f for f in fields if isinstance(row.get(f), str)), None)
+        if field is None:
+            raise ValueError(f"Line {lineno}: no prompt field found (tried {', '.join(fields)})")
+        prompt = row[field]
+        # Keep the title in front of the body for request-style rows
+        if field == "body" and isinstance(row.get("title"), str):
+            prompt = f"{row['title']}\n\n{prompt}"
+        key = next((str(row[f]) for f in KEY_FIELDS if row.get(f) is not None), None)
+        rows.append({"index": lineno, "key": key, "prompt": prompt})
+    return rows
+
+
+# --- Scheduler ---
+# Every process polls for runs to claim, like the job workers; a run belongs to one process at
+# a time, which heartbeats it and stops it when a cancel is flagged through any process
+
+class ActiveRun:
+    """A run executing in this process."""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.generations: Set[Generation] = set()
+        self.stopping: Optional[str] = None # 'cancelled', 'lost' or 'shutdown'
+
+    def stop(self, reason: str):
+        # Generations end with what they have, which isn't stored; their items stay pending
+        if self.stopping is None:
+            self.stopping = reason
+        for generation in self.generations:
+            generation.cancel()
+
+active_runs: Dict[int, ActiveRun] = {}
+_poller: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+
+Run = models.EvaluationRun
+Item = models.EvaluationItem
+
+async def claim_run(db: AsyncSession) -> Optional[int]:
+    now = datetime.now(timezone.utc)
+    while True:
+        run = await db.scalar(
+            select(Run).filter(or_(
+                Run.status == "pending",
+                # Left running by a process that is gone
+                and_(Run.status == "running", or_(
+                    Run.heartbeat_at.is_(None), Run.heartbeat_at < now - timedelta(seconds=STALE_AFTER)
+                )),
+            )).order_by(Run.id).limit(1).with_for_update(skip_locked=True)
+        )
+        if run is None:
+            await db.rollback()
+            return None
+        if run.cancel_requested or run.conversation_id is None:
+            # Cancelled while nobody was running it, or its conversation was deleted
+            run.status = "cancelled"
+            run.worker_id = None
+            run.finished_at = now
+            await db.commit()
+            continue
+        run.status = "running"
+        run.worker_id = jobs.WORKER_ID
+        run.heartbeat_at = now
+        await db.commit()
+        return run.id
+
+def stop_run(run_id: int, reason: str):
+    state = active_runs.get(run_id)
+    if state is not None:
+        state.stop(reason)
+
+async def heartbeat(run_id: int):
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        async with database.AsyncSessionLocal() as db:
+            cancel_requested = await db.scalar(
+                update(Run).where(Run.id == run_id, Run.worker_id == jobs.WORKER_ID)
+                .values(heartbeat_at=datetime.now(timezone.utc)).returning(Run.cancel_requested)
+            )
+            await db.commit()
+        if cancel_requested is None:
+            # Taken over after missed heartbeats; the new owner runs the remaining items
+            stop_run(run_id, "lost")
+        elif cancel_requested:
+            stop_run(run_id, "cancelled")
+
+async def execute_item(run: models.EvaluationRun, state: ActiveRun, item_id: int, prompt: str, model_info: dict,
+                       global_sem: asyncio.Semaphore, provider_sem: asyncio.Semaphore):
+    # Provider first: items queued behind a saturated provider mustn't hold global slots idle providers could use
+    async with provider_sem, global_sem:
+        if state.stopping:
+            return
+        generation = Generation(model_info["id"], model_info["ttft_deadline"], model_info["total_deadline"])
+        state.generations.add(generation)
+        try:
+            res = await fetch_llm_response(
+                model_info["id"], run.system_prompt, [], prompt, model_info["provider"], model_info["model_name"],
+                not run.bypass_cache, generation
+            )
+        finally:
+            state.generations.discard(generation)
+    if state.stopping:
+        return
+    # The result and the item's completion are committed together, so a crash never re-issues a finished item
+    async with database.AsyncSessionLocal() as db:
+        [message_id] = await add_results(db, run.conversation_id, [res])
+        owned = select(Run.id).where(Run.id == run.id, Run.worker_id == jobs.WORKER_ID)
+        completed = await db.execute(
+            update(Item).where(Item.id == item_id, Item.status == "pending", Item.run_id.in_(owned)).values(
+                status="completed" if res["success"] else "failed",
+                message_id=message_id,
+                completed_at=func.now(),
+            )
+        )
+        if completed.rowcount == 0:
+            # The run changed hands meanwhile and the item is the new owner's
+            await db.rollback()
+            return
+        await db.commit()
+
+async def run_evaluation(run_id: int, state: ActiveRun):
+    async with database.AsyncSessionLocal() as db:
+        run = await db.get(Run, run_id)
+        items = (await db.scalars(
+            select(Item).options(
+                selectinload(Item.model).selectinload(models.Model.provider)
+            ).filter(
+                Item.run_id == run_id,
+                Item.status == "pending"
+            ).order_by(Item.id)
+        )).all()
+
+    global_sem = asyncio.Semaphore(max(1, run.max_concurrency))
+    provider_sems = defaultdict(lambda: asyncio.Semaphore(max(1, run.per_provider_concurrency)))
+    tasks = []
+    for item in items:
+        if item.model is None:
+            continue
+        model_info = {
+            "id": item.model.id,
+            "model_name": item.model.model_id,
+            "ttft_deadline": item.model.ttft_deadline,
+            "total_deadline": item.model.total_deadline,
+            "provider": clients.provider_info(item.model.provider),
+        }
+        tasks.append(execute_item(run, state, item.id, item.prompt, model_info, global_sem, provider_sems[item.model.provider_id]))
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for r in results:
+        if isinstance(r, Exception):
+            logger.error("Evaluation run %s: item failed to persist: %s", run_id, r)
+
+    async with database.AsyncSessionLocal() as db:
+        owned = and_(Run.id == run_id, Run.worker_id == jobs.WORKER_ID)
+        if state.stopping == "cancelled":
+            await db.execute(update(Run).where(owned).values(status="cancelled", worker_id=None, finished_at=func.now()))
+        elif state.stopping is None:
+            pending = await db.scalar(
+                select(func.count(Item.id)).filter(Item.run_id == run_id, Item.status == "pending")
+            )
+            # Items that failed to persist stay pending; without heartbeats the run goes stale and
+            # is claimed again after STALE_AFTER
+            if not pending:
+                await db.execute(update(Run).where(owned).values(status="completed", worker_id=None, finished_at=func.now()))
+        await db.commit()
+
+async def own_run(run_id: int, state: ActiveRun):
+    beat = asyncio.create_task(heartbeat(run_id))
+    try:
+        await run_evaluation(run_id, state)
+    finally:
+        beat.cancel()
+        await asyncio.gather(beat, return_exceptions=True)
+
+async def poll_runs():
+    while True:
+        run_id = None
+        if len(active_runs) < MAX_RUNS:
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    run_id = await claim_run(db)
+            except Exception:
+                logger.exception("Evaluation scheduler %s: claim failed", jobs.WORKER_ID)
+        if run_id is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+            continue
+        state = active_runs[run_id] = ActiveRun()
+        state.task = asyncio.create_task(own_run(run_id, state))
+
+        def finished(_, run_id=run_id):
+            active_runs.pop(run_id, None)
+            notify()
+        state.task.add_done_callback(finished)
+
+def notify():
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def startup():
+    # Runs interrupted by a crash or restart are claimed again once their heartbeat is stale
+    global _poller, _wakeup
+    _wakeup = asyncio.Event()
+    _poller = asyncio.create_task(poll_runs())
+
+async def shutdown():
+    global _poller
+    if _poller is not None:
+        _poller.cancel()
+        await asyncio.gather(_poller, return_exceptions=True)
+        _poller = None
+    states = list(active_runs.values())
+    for state in states:
+        state.stop("shutdown")
+    await asyncio.gather(*(state.task for state in states), return_exceptions=True)
+    # Hand this process's runs back right away instead of waiting for them to go stale
+    async with database.AsyncSessionLocal() as db:
+        await db.execute(
+            update(Run).where(Run.status == "running", Run.worker_id == jobs.WORKER_ID).values(status="pending", worker_id=None)
+        )
+        await db.commit()
+
+
+# --- API ---
+async def run_with_progress(db: AsyncSession, run: models.EvaluationRun) -> schemas.EvaluationRun:
+    counts = dict((await db.execute(
+        select(models.EvaluationItem.status, func.count(models.EvaluationItem.id))
+        .filter(models.EvaluationItem.run_id == run.id)
+        .group_by(models.EvaluationItem.status)
+    )).all())
+    out = schemas.EvaluationRun.model_validate(run)
+    out.pending_items = counts.get("pending", 0)
+    out.completed_items = counts.get("completed", 0)
+    out.failed_items = counts.get("failed", 0)
+    out.total_items = sum(counts.values())
+    return out
+
+@router.post("/evaluations/", response_model=schemas.EvaluationRun)
+async def create_evaluation(req: schemas.EvaluationRunCreate, db: AsyncSession = Depends(get_db)):
+    try:
+        rows = parse_dataset(req.dataset, req.prompt_field)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not rows:
+        raise HTTPException(status_code=400, detail="Dataset contains no prompts")
+
+    model_ids = (await db.scalars(select(models.Model.id).filter(models.Model.id.in_(req.models_to_use)))).all()
+    missing = set(req.models_to_use) - set(model_ids)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Models not found: {sorted(missing)}")
+
+    conv = models.Conversation(title=f"Evaluation: {req.name}")
+    await content.set_system_prompt(db, conv, req.system_prompt)
+    db.add(conv)
+    await db.flush()
+    run = models.EvaluationRun(
+        name=req.name,
+        system_prompt=req.system_prompt,
+        status="pending",
+        max_concurrency=req.max_concurrency,
+        per_provider_concurrency=req.per_provider_concurrency,
+        bypass_cache=req.bypass_cache,
+        conversation_id=conv.id,
+    )
+    db.add(run)
+    await db.flush()
+    db.add_all(
+        models.EvaluationItem(
+            run_id=run.id, prompt_index=row["index"], prompt_key=row["key"], prompt=row["prompt"], model_id=mid
+        )
+        for row in rows for mid in req.models_to_use
+    )
+    await db.commit()
+    await db.refresh(run)
+
+    notify()
+    return await run_with_progress(db, run)
+
+@router.get("/evaluations/", response_model=List[schemas.EvaluationRun])
+async def read_evaluations(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    runs = (await db.scalars(
+        select(models.EvaluationRun).order_by(models.EvaluationRun.created_at.desc()).offset(skip).limit(limit)
+    )).all()
+    return [await run_with_progress(db, run) for run in runs]
+
+@router.get("/evaluations/{run_id}", response_model=schemas.EvaluationRun)
+async def get_evaluation(run_id: int, db: AsyncSession = Depends(get_db)):
+    run = await db.get(models.EvaluationRun, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Evaluation run not found")
+    return await run_with_progress(db, run)
+
+@router.get("/evaluations/{run_id}/items", response_model=List[schemas.EvaluationItem])
+async def read_evaluation_items(run_id: int, status: Optional[str] = None, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    query = select(models.EvaluationItem).options(
+        selectinload(models.EvaluationItem.message).selectinload(models.Message.generation_metadata)
+    ).filter(models.EvaluationItem.run_id == run_id)
+    if status:
+        query = query.filter(models.EvaluationItem.status == status)
+    items = await db.scalars(query.order_by(models.EvaluationItem.id).offset(skip).limit(limit))
+    return items.all()
+
+@router.post("/evaluations/{run_id}/resume", response_model=schemas.EvaluationRun)
+async def resume_evaluation(run_id: int, retry_failed: bool = False, db: AsyncSession = Depends(get_db)):
+    run = await db.get(models.EvaluationRun, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Evaluation run not found")
+    if run.conversation_id is None:
+        raise HTTPException(status_code=400, detail="The run's conversation was deleted")
+    if retry_failed:
+        await db.execute(
+            update(models.EvaluationItem).where(
+                models.EvaluationItem.run_id == run_id,
+                models.EvaluationItem.status == "failed"
+            ).values(status="pending", message_id=None, completed_at=None)
+        )
+    if run.status != "running":
+        # A running run's owner picks up retried items when it, or its successor, runs them again
+        run.status = "pending"
+        run.cancel_requested = False
+        run.finished_at = None
+    await db.commit()
+    notify()
+    return await run_with_progress(db, run)
+
+@router.post("/evaluations/{run_id}/cancel", response_model=schemas.EvaluationRun)
+async def cancel_evaluation(run_id: int, db: AsyncSession = Depends(get_db)):
+    run = await db.get(models.EvaluationRun, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Evaluation run not found")
+    # Not claimed by a worker yet: cancelled right away
+    cancelled = await db.scalar(
+        update(Run).where(Run.id == run_id, Run.status == "pending")
+        .values(status="cancelled", finished_at=func.now()).returning(Run.id)
+    )
+    if cancelled is None:
+        # Running somewhere: its owner sees the flag at its next heartbeat
+        await db.execute(update(Run).where(Run.id == run_id, Run.status == "running").values(cancel_requested=True))
+    await db.commit()
+    stop_run(run_id, "cancelled")
+    await db.refresh(run)
+    return await run_with_progress(db, run)
@@ -0,0 +1,564 @@
+"""
+Bulk export and import of messages with their generation metadata, model and provider,
+one flat row per message, for offline analysis (pandas, NumPy, DuckDB).
+
+Rows are read through a server-side cursor and encoded EXPORT_CHUNK_ROWS at a time, so
+memory stays bounded however many generations are exported. Formats: NDJSON, Arrow IPC
+stream and Parquet (one row group per chunk); the columnar ones need pyarrow.
+
+An exported file can be imported back: each source conversation becomes a new
+conversation, models are matched by provider name and model id, and missing ones are
+registered disabled.
+
+    python -m app.export export -o results.parquet --start 2024-05-01 --model-id 3
+    python -m app.export import results.parquet
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, insert, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Iterable, List, Optional
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import tempfile
+
+from . import models, database, analytics, content
+from .database import upsert
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+# Uploaded Arrow/Parquet files are spooled to disk beyond this size
+IMPORT_SPOOL_BYTES = 64 * 1024 * 1024
+
+router = APIRouter()
+get_db = database.get_db
+
+Message = models.Message
+Meta = models.GenerationMetadata
+# The group member that answered a hedged generation
+ServedModel = aliased(models.Model)
+ServedProvider = aliased(models.Provider)
+
+# (name, column, type); the type picks the Arrow type and the NDJSON encoding. Texts in the
+# content store have no column; they are looked up per chunk (see TEXT_COLUMNS).
+COLUMNS = [
+    ("conversation_id", Message.conversation_id, "int"),
+    ("conversation_title", models.Conversation.title, "str"),
+    ("conversation_head_id", models.Conversation.head_id, "int"),
+    ("system_prompt", None, "str"),
+    ("message_id", Message.id, "int"),
+    ("parent_message_id", Message.parent_id, "int"),
+    ("active", Message.active, "bool"),
+    ("seq", Message.seq, "int"),
+    ("role", Message.role, "str"),
+    ("content", None, "str"),
+    ("created_at", Message.created_at, "time"),
+    ("provider_name", models.Provider.name, "str"),
+    ("provider_base_url", models.Provider.base_url, "str"),
+    ("model_id", models.Model.model_id, "str"),
+    ("model_name", models.Model.name, "str"),
+    ("served_provider_name", ServedProvider.name, "str"),
+    ("served_provider_base_url", ServedProvider.base_url, "str"),
+    ("served_model_id", ServedModel.model_id, "str"),
+    ("generation_id", Meta.id, "int"),
+    ("status", Meta.status, "str"),
+    ("cache_hit", Meta.cache_hit, "bool"),
+    ("hedged", Meta.hedged, "bool"),
+    ("time_to_first_token", Meta.time_to_first_token, "float"),
+    ("tokens_per_second", Meta.tokens_per_second, "float"),
+    ("total_latency", Meta.total_latency, "float"),
+    ("itl_p50", Meta.itl_p50, "float"),
+    ("itl_p99", Meta.itl_p99, "float"),
+    ("max_stall", Meta.max_stall, "float"),
+    ("queue_time", Meta.queue_time, "float"),
+    ("connect_time", Meta.connect_time, "float"),
+    ("tls_time", Meta.tls_time, "float"),
+    ("connection_reused", Meta.connection_reused, "bool"),
+    ("time_to_request_sent", Meta.time_to_request_sent, "float"),
+    ("time_to_headers", Meta.time_to_headers, "float"),
+    ("time_to_first_byte", Meta.time_to_first_byte, "float"),
+    ("input_tokens", Meta.input_tokens, "int"),
+    ("output_tokens", Meta.output_tokens, "int"),
+    ("cached_input_tokens", Meta.cached_input_tokens, "int"),
+    ("retry_count", Meta.retry_count, "int"),
+    ("token_timeline", Meta.token_timeline, "bytes"),
+]
+
+# name -> (content store hash, inline text of rows not migrated yet)
+TEXT_COLUMNS = {
+    "system_prompt": (models.Conversation.system_prompt_hash, models.Conversation.legacy_system_prompt),
+    "content": (Message.content_hash, Message.legacy_content),
+}
+
+# Columns stored on generation_metadata when importing
+META_FIELDS = [name for name, column, _ in COLUMNS if column is not None and column.class_ is Meta and name != "generation_id"]
+# For fields a file leaves out or null, e.g. one from before they were exported; cache_hit is NOT NULL
+META_DEFAULTS = {name: Meta.__table__.c[name].default.arg for name in META_FIELDS if Meta.__table__.c[name].default is not None}
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def load_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise HTTPException(status_code=400, detail="Arrow and Parquet need pyarrow installed; use format=ndjson")
+    return pyarrow
+
+
+def arrow_schema(pa):
+    types = {
+        "int": pa.int64(), "float": pa.float64(), "str": pa.string(), "bool": pa.bool_(),
+        "time": pa.timestamp("us", tz="UTC"), "bytes": pa.binary(),
+    }
+    return pa.schema([(name, types[kind]) for name, _, kind in COLUMNS])
+
+
+def export_query(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    model_ids: Optional[List[int]] = None,
+    conversation_ids: Optional[List[int]] = None,
+):
+    query = (
+        select(
+            *[column.label(name) for name, column, _ in COLUMNS if column is not None],
+            *[column.label(f"{name}_{part}") for name, pair in TEXT_COLUMNS.items() for part, column in zip(("hash", "inline"), pair)],
+        )
+        .join(models.Conversation, models.Conversation.id == Message.conversation_id)
+        .outerjoin(Meta, Meta.message_id == Message.id)
+        .outerjoin(models.Model, models.Model.id == func.coalesce(Meta.model_id, Message.model_id))
+        .outerjoin(models.Provider, models.Provider.id == models.Model.provider_id)
+        .outerjoin(ServedModel, ServedModel.id == Meta.served_model_id)
+        .outerjoin(ServedProvider, ServedProvider.id == ServedModel.provider_id)
+    )
+    if start is not None:
+        query = query.filter(Message.created_at >= start)
+    if end is not None:
+        query = query.filter(Message.created_at < end)
+    if model_ids:
+        # Generations only: user messages have no model
+        query = query.filter(Message.model_id.in_(model_ids))
+    if conversation_ids:
+        query = query.filter(Message.conversation_id.in_(conversation_ids))
+    # Walks ix_messages_conversation_seq, so the cursor can start returning rows right away
+    return query.order_by(Message.conversation_id, Message.seq, Meta.id)
+
+
+async def export_chunks(query, chunk_rows: int = EXPORT_CHUNK_ROWS) -> AsyncIterator[List[dict]]:
+    # Own sessions: a streaming response outlives the request's dependencies, and the
+    # cursor's connection stays busy while texts are looked up
+    async with database.AsyncSessionLocal() as db, database.AsyncSessionLocal() as lookup_db:
+        result = await db.stream(query.execution_options(yield_per=chunk_rows))
+        async for rows in result.mappings().partitions():
+            hashes = {row[f"{name}_hash"] for row in rows for name in TEXT_COLUMNS} - {None}
+            # One pass over a large export would only flush the hot entries out of the LRU
+            texts = await content.texts(lookup_db, hashes, remember=False)
+            chunk = []
+            for row in rows:
+                values = {}
+                for name, _, _ in COLUMNS:
+                    if name in TEXT_COLUMNS:
+                        key = row[f"{name}_hash"]
+                        values[name] = texts[key] if key else row[f"{name}_inline"]
+                    else:
+                        values[name] = row[name]
+                chunk.append(values)
+            yield chunk
+
+
+# --- Encoders ---
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+class ChunkSink:
+    """Write-only file object for pyarrow writers; drain() hands back what was written since the last call."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # Parquet footers record absolute offsets, so this counts everything ever written
+        return self.position
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+async def encode(fmt: str, chunks: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    if fmt == "ndjson":
+        async for rows in chunks:
+            yield "".join(json.dumps(row, default=json_default) + "\n" for row in rows).encode()
+        return
+
+    pa = load_pyarrow()
+    schema = arrow_schema(pa)
+    sink = ChunkSink()
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+        write = writer.write_table
+        to_arrow = pa.Table.from_pylist
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+        write = writer.write_batch
+        to_arrow = pa.RecordBatch.from_pylist
+    async for rows in chunks:
+        write(to_arrow(rows, schema=schema))
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+
+@router.get("/export/generations")
+async def export_generations(
+    format: str = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    model_ids: Optional[List[int]] = Query(None),
+    conversation_ids: Optional[List[int]] = Query(None),
+    run_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    if format != "ndjson":
+        load_pyarrow()
+    if run_id is not None:
+        run = await db.get(models.EvaluationRun, run_id)
+        if run is None:
+            raise HTTPException(status_code=404, detail="Evaluation run not found")
+        conversation_ids = (conversation_ids or []) + [run.conversation_id]
+    media_type, extension = FORMATS[format]
+    query = export_query(start, end, model_ids, conversation_ids)
+    return StreamingResponse(
+        encode(format, export_chunks(query)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="generations.{extension}"'},
+    )
+
+
+# --- Import ---
+
+def parse_row(row: dict) -> dict:
+    # NDJSON carries timestamps and timelines as strings
+    if isinstance(row.get("created_at"), str):
+        row["created_at"] = datetime.fromisoformat(row["created_at"])
+    if isinstance(row.get("token_timeline"), str):
+        row["token_timeline"] = base64.b64decode(row["token_timeline"])
+    return row
+
+
+async def ndjson_chunks(lines: AsyncIterator[str], chunk_rows: int = EXPORT_CHUNK_ROWS) -> AsyncIterator[List[dict]]:
+    rows = []
+    async for line in lines:
+        if line.strip():
+            rows.append(parse_row(json.loads(line)))
+        if len(rows) >= chunk_rows:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+async def body_lines(request: Request) -> AsyncIterator[str]:
+    pending = b""
+    async for data in request.stream():
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode()
+    if pending:
+        yield pending.decode()
+
+
+def columnar_chunks(fmt: str, file, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterable[List[dict]]:
+    pa = load_pyarrow()
+    if fmt == "parquet":
+        batches = pa.parquet.ParquetFile(file).iter_batches(batch_size=chunk_rows)
+    else:
+        batches = pa.ipc.open_stream(file)
+    for batch in batches:
+        yield batch.to_pylist()
+
+
+async def iterate(chunks) -> AsyncIterator[List[dict]]:
+    if hasattr(chunks, "__aiter__"):
+        async for rows in chunks:
+            yield rows
+    else:
+        for rows in chunks:
+            yield rows
+
+
+class Importer:
+    """Loads exported rows chunk by chunk; every source conversation becomes a new conversation."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.conversations = {} # source conversation id -> new id
+        self.message_ids = {} # source message id -> new id, for parents and heads
+        self.heads = {} # new conversation id -> source head message id
+        self.providers = {} # name -> id
+        self.models = {} # (provider name, model id) -> models.id
+        self.messages = 0
+        self.generations = 0
+        self.first_at = None
+        self.last_at = None
+
+    async def provider_id(self, name: str, base_url: Optional[str]) -> int:
+        if name not in self.providers:
+            provider_id = await self.db.scalar(select(models.Provider.id).filter(models.Provider.name == name))
+            if provider_id is None:
+                # Registered without a key: it exists so the results have somewhere to belong
+                provider_id = await self.db.scalar(
+                    insert(models.Provider).values(name=name, base_url=base_url or "", api_key="")
+                    .returning(models.Provider.id)
+                )
+            self.providers[name] = provider_id
+        return self.providers[name]
+
+    async def model_id(self, row: dict, prefix: str = "") -> Optional[int]:
+        """The model of the row's `<prefix>provider_name` and `<prefix>model_id` columns."""
+        provider_name, model_id = row.get(f"{prefix}provider_name"), row.get(f"{prefix}model_id")
+        if not provider_name or not model_id:
+            return None
+        key = (provider_name, model_id)
+        if key not in self.models:
+            provider_id = await self.provider_id(provider_name, row.get(f"{prefix}provider_base_url"))
+            await self.db.execute(
+                upsert(self.db, models.Model.__table__).values(
+                    provider_id=provider_id, model_id=model_id, name=row.get(f"{prefix}model_name") or model_id,
+                    is_reasoning=False, enabled=False, delisted=False,
+                ).on_conflict_do_nothing(index_elements=["provider_id", "model_id"])
+            )
+            self.models[key] = await self.db.scalar(
+                select(models.Model.id).filter(models.Model.provider_id == provider_id, models.Model.model_id == model_id)
+            )
+        return self.models[key]
+
+    async def add(self, rows: List[dict]):
+        new = {}
+        for row in rows:
+            source = row["conversation_id"]
+            if source not in self.conversations and source not in new:
+                new[source] = {"title": f"{row.get('conversation_title') or 'Conversation'} (imported)", "system_prompt": row.get("system_prompt")}
+        if new:
+            prompts = await content.put_many(self.db, [conv.pop("system_prompt") or "" for conv in new.values()])
+            ids = (await self.db.scalars(
+                insert(models.Conversation).returning(models.Conversation.id, sort_by_parameter_order=True),
+                [{**conv, "system_prompt_hash": key} for conv, key in zip(new.values(), prompts)],
+            )).all()
+            self.conversations.update(zip(new, ids))
+
+        now = datetime.now(timezone.utc)
+        content_hashes = await content.put_many(self.db, [row["content"] or "" for row in rows])
+        values = []
+        for row, content_hash in zip(rows, content_hashes):
+            values.append({
+                "conversation_id": self.conversations[row["conversation_id"]],
+                "seq": row["seq"],
+                "role": row["role"],
+                "model_id": await self.model_id(row),
+                "active": row.get("active", True) is not False,
+                "content_hash": content_hash,
+                "created_at": row.get("created_at") or now,
+            })
+            at = values[-1]["created_at"]
+            self.first_at = at if self.first_at is None else min(self.first_at, at)
+            self.last_at = at if self.last_at is None else max(self.last_at, at)
+        message_ids = (await self.db.scalars(
+            insert(Message).returning(Message.id, sort_by_parameter_order=True), values
+        )).all()
+        await self.link(rows, message_ids)
+        metadata = [
+            {
+                "message_id": message_id,
+                "model_id": value["model_id"],
+                "served_model_id": await self.model_id(row, "served_"),
+                "created_at": value["created_at"],
+                **{name: row[name] if row.get(name) is not None else META_DEFAULTS.get(name) for name in META_FIELDS},
+            }
+            for message_id, value, row in zip(message_ids, values, rows)
+            if row.get("generation_id") is not None
+        ]
+        if metadata:
+            await self.db.execute(insert(Meta), metadata)
+        self.messages += len(values)
+        self.generations += len(metadata)
+
+    async def link(self, rows: List[dict], message_ids: List[int]):
+        # Parents come before their children in seq order but may be in the same chunk,
+        # so the tree is linked after the insert
+        for row, message_id in zip(rows, message_ids):
+            if row.get("message_id") is not None:
+                self.message_ids[row["message_id"]] = message_id
+            if row.get("conversation_head_id") is not None:
+                self.heads[self.conversations[row["conversation_id"]]] = row["conversation_head_id"]
+        parents = [
+            {"id": message_id, "parent_id": self.message_ids[row["parent_message_id"]]}
+            for row, message_id in zip(rows, message_ids)
+            if self.message_ids.get(row.get("parent_message_id")) is not None
+        ]
+        if parents:
+            await self.db.execute(update(Message), parents)
+
+    async def finish(self) -> dict:
+        heads = [
+            {"id": conversation_id, "head_id": self.message_ids[source]}
+            for conversation_id, source in self.heads.items() if source in self.message_ids
+        ]
+        if heads:
+            # Files without the tree columns are linked from seq order when first read (see branches.py)
+            await self.db.execute(update(models.Conversation), heads)
+        if self.conversations:
+            # Later messages in the imported conversations are numbered after the imported ones
+            last_seq = select(func.coalesce(func.max(Message.seq), 0)).filter(
+                Message.conversation_id == models.Conversation.id
+            ).scalar_subquery()
+            await self.db.execute(
+                update(models.Conversation).where(models.Conversation.id.in_(self.conversations.values()))
+                .values(next_seq=last_seq)
+            )
+        await self.db.commit()
+        if self.generations and self.db.bind.dialect.name == "postgresql":
+            # Rollups are derived from the raw rows, so recompute the hours the import landed in
+            await analytics.rebuild_rollups(self.db, self.first_at, analytics.hour_bucket(self.last_at) + timedelta(hours=1))
+        return {"conversations": len(self.conversations), "messages": self.messages, "generations": self.generations}
+
+
+async def import_chunks(db: AsyncSession, chunks) -> dict:
+    importer = Importer(db)
+    async for rows in iterate(chunks):
+        await importer.add(rows)
+    return await importer.finish()
+
+
+@router.post("/import/generations")
+async def import_generations(request: Request, format: str = "ndjson", db: AsyncSession = Depends(get_db)):
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    try:
+        if format == "ndjson":
+            counts = await import_chunks(db, ndjson_chunks(body_lines(request)))
+        else:
+            load_pyarrow()
+            with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as file:
+                async for data in request.stream():
+                    file.write(data)
+                file.seek(0)
+                counts = await import_chunks(db, columnar_chunks(format, file))
+    except (ValueError, KeyError) as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Invalid {format} export: {e}")
+    return {"status": "success", **counts}
+
+
+# --- CLI ---
+
+def format_for(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    for name, (_, extension) in FORMATS.items():
+        if path.endswith("." + extension) or (name == "arrow" and path.endswith(".arrow")):
+            return name
+    return "ndjson"
+
+
+async def file_lines(path: str) -> AsyncIterator[str]:
+    with open(path) as f:
+        for line in f:
+            yield line
+
+
+async def run_export(args) -> int:
+    fmt = format_for(args.output or "", args.format)
+    query = export_query(args.start, args.end, args.model_id, args.conversation_id)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    size = 0
+    try:
+        async for data in encode(fmt, export_chunks(query)):
+            out.write(data)
+            size += len(data)
+    finally:
+        if args.output:
+            out.close()
+    return size
+
+
+async def run_import(args) -> dict:
+    fmt = format_for(args.path, args.format)
+    async with database.AsyncSessionLocal() as db:
+        if fmt == "ndjson":
+            return await import_chunks(db, ndjson_chunks(file_lines(args.path)))
+        with open(args.path, "rb") as f:
+            return await import_chunks(db, columnar_chunks(fmt, f))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write messages and generation metadata to a file (or stdout)")
+    export.add_argument("-o", "--output", help="file to write; the format is taken from its extension unless --format is given")
+    export.add_argument("--format", choices=list(FORMATS))
+    export.add_argument("--start", type=datetime.fromisoformat)
+    export.add_argument("--end", type=datetime.fromisoformat)
+    export.add_argument("--model-id", type=int, action="append", help="models.id; repeatable")
+    export.add_argument("--conversation-id", type=int, action="append", help="repeatable")
+    load = commands.add_parser("import", help="load a file written by export")
+    load.add_argument("path")
+    load.add_argument("--format", choices=list(FORMATS))
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            if args.command == "export":
+                size = await run_export(args)
+                print(f"Wrote {size} bytes", file=sys.stderr)
+            else:
+                print(await run_import(args), file=sys.stderr)
+        finally:
+            await database.dispose_engine()
+
+    try:
+        asyncio.run(run())
+    except HTTPException as e:
+        parser.error(e.detail)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Hedged requests within model groups. A group collects registrations of the same upstream
+model on different providers; when a member of a hedging group is asked for, chat sends the
+request to the member with the lowest recent TTFT and, if no output has arrived after a
+delay taken from that member's recent TTFT distribution (p95 by default), sends the same
+request to the next fastest. Whichever stream yields first is kept and the other is
+cancelled (see chat.stream_hedged).
+
+Recent TTFTs are kept per model in this process only, so a fresh worker starts from the
+group's initial_hedge_delay until it has seen HEDGE_MIN_SAMPLES generations.
+"""
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional
+import os
+
+from . import models, clients, timing
+
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "100")) # recent TTFTs kept per model
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+recent_ttfts: Dict[int, Deque[float]] = defaultdict(lambda: deque(maxlen=HEDGE_WINDOW))
+
+
+def observe(res: dict):
+    # Cache hits and cancelled legs say nothing about the provider's TTFT
+    if res.get("ttft") is not None and not res.get("cache_hit") and res.get("status") == "completed":
+        recent_ttfts[res["model_id"]].append(res["ttft"])
+
+
+def ttft_quantile(model_id: int, q: float) -> Optional[float]:
+    samples = recent_ttfts.get(model_id)
+    if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return timing.percentile(list(samples), q * 100)
+
+
+class HedgePolicy:
+    """The members a generation may be sent to, and when to fire the hedge."""
+
+    def __init__(self, group: models.ModelGroup, candidates: List[dict]):
+        self.group_name = group.name
+        self.quantile = group.hedge_quantile or 0.95
+        self.min_delay = group.min_hedge_delay or 0.0
+        self.initial_delay = group.initial_hedge_delay or 2.0
+        # {"model_id", "provider_info", "model_name", "ttft_deadline", "total_deadline"}, requested model first
+        self.candidates = candidates
+
+    def ranked(self) -> List[dict]:
+        """Candidates by recent median TTFT; ones without samples go first so they get some."""
+        def key(candidate):
+            median = ttft_quantile(candidate["model_id"], 0.5)
+            return -1.0 if median is None else median
+        return sorted(self.candidates, key=key)
+
+    def delay(self, model_id: int) -> float:
+        tail = ttft_quantile(model_id, self.quantile)
+        return max(self.min_delay, self.initial_delay if tail is None else tail)
+
+
+def candidate(db_model: models.Model) -> dict:
+    return {
+        "model_id": db_model.id,
+        "provider_info": clients.provider_info(db_model.provider),
+        "model_name": db_model.model_id,
+        "ttft_deadline": db_model.ttft_deadline,
+        "total_deadline": db_model.total_deadline,
+    }
+
+
+def policy_for(db_model: models.Model) -> Optional[HedgePolicy]:
+    """A policy when the model is in a hedging group with another usable member; needs group.models.provider loaded."""
+    group = db_model.group
+    if group is None or not group.hedging:
+        return None
+    others = [m for m in group.models if m.id != db_model.id and m.enabled and not m.delisted]
+    if not others:
+        return None
+    return HedgePolicy(group, [candidate(db_model)] + [candidate(m) for m in others])
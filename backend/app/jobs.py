@@ -0,0 +1,344 @@
+"""
+Generation job queue. A turn submitted through /jobs/ is stored as one generation_jobs
+row per model and the request returns immediately. Every backend process runs a pool of
+workers that claim queued rows with FOR UPDATE SKIP LOCKED, stream the reply while
+checkpointing partial content, and store the result the same way /chat/ does.
+
+Progress is available by polling GET /jobs/{id} or as SSE from GET /jobs/{id}/stream,
+from any replica.
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select, update, or_, and_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+import asyncio
+import logging
+import os
+import socket
+
+from . import models, schemas, database, chat, persistence, metrics
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+get_db = database.get_db
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0")) # seconds
+CHECKPOINT_INTERVAL = float(os.getenv("JOB_CHECKPOINT_INTERVAL", "1.0")) # seconds
+# A running job without a heartbeat for this long lost its worker and is claimed again
+STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "60")) # seconds
+MAX_ATTEMPTS = 3
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+Job = models.GenerationJob
+# Job status for each generation result status; errors and missed deadlines are failures
+JOB_STATUS = {"completed": "completed", "cancelled": "cancelled"}
+job_options = [selectinload(Job.message).selectinload(models.Message.generation_metadata)]
+
+
+class LiveJob:
+    """A job running in this process; streams subscribe here instead of polling the table."""
+
+    def __init__(self, generation: chat.Generation):
+        self.generation = generation
+        self.chunks: List[str] = []
+        self.listeners: Set[asyncio.Queue] = set()
+
+    def publish(self, kind: str, payload):
+        for queue in self.listeners:
+            queue.put_nowait((kind, payload))
+
+
+live: Dict[int, LiveJob] = {}
+metrics.gauge_function(metrics.JOBS_RUNNING, lambda: len(live))
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+
+
+# --- Workers ---
+
+async def claim_job(db: AsyncSession) -> Optional[models.GenerationJob]:
+    now = datetime.now(timezone.utc)
+    job = await db.scalar(
+        select(Job).filter(or_(
+            Job.status == "queued",
+            and_(Job.status == "running", Job.heartbeat_at < now - timedelta(seconds=STALE_AFTER)),
+        )).order_by(Job.id).limit(1).with_for_update(skip_locked=True)
+    )
+    if job is None:
+        await db.rollback()
+        return None
+    job.status = "running"
+    job.worker_id = WORKER_ID
+    job.claimed_at = now
+    job.heartbeat_at = now
+    job.attempts = (job.attempts or 0) + 1
+    await db.commit()
+    return job
+
+async def finish_job(job_id: int, **values):
+    async with database.AsyncSessionLocal() as db:
+        await db.execute(update(Job).where(Job.id == job_id).values(finished_at=func.now(), **values))
+        await db.commit()
+
+async def checkpoint(job_id: int, state: LiveJob):
+    # Also the heartbeat, so a reasoning model that is silent for minutes isn't taken for a lost worker,
+    # and where a cancel requested through any replica reaches the worker
+    saved = 0
+    while True:
+        await asyncio.sleep(CHECKPOINT_INTERVAL)
+        values = {"heartbeat_at": datetime.now(timezone.utc)}
+        if len(state.chunks) != saved:
+            saved = len(state.chunks)
+            values["partial_content"] = "".join(state.chunks)
+        async with database.AsyncSessionLocal() as db:
+            cancel_requested = await db.scalar(
+                update(Job).where(Job.id == job_id, Job.worker_id == WORKER_ID).values(**values).returning(Job.cancel_requested)
+            )
+            await db.commit()
+        if cancel_requested:
+            state.generation.cancel()
+
+async def store_result(job: models.GenerationJob, res: dict) -> models.Message:
+    # The reply and the job's completion are committed together
+    async with database.AsyncSessionLocal() as db:
+        # A regenerated reply goes next to the one it replaces, which stays as an inactive alternative
+        [message_id] = await persistence.add_results(db, job.conversation_id, [res], job.reply_to_id)
+        await db.execute(update(Job).where(Job.id == job.id).values(
+            status=JOB_STATUS.get(res["status"], "failed"),
+            message_id=message_id,
+            partial_content=res["content"],
+            error=None if res["success"] else res["content"],
+            finished_at=func.now(),
+        ))
+        await db.commit()
+        return await chat.reload_message(db, message_id)
+
+async def run_job(job: models.GenerationJob):
+    if job.attempts > MAX_ATTEMPTS:
+        await finish_job(job.id, status="failed", error=f"Gave up after {MAX_ATTEMPTS} attempts")
+        return
+    async with database.AsyncSessionLocal() as db:
+        prepared = await chat.prepare_jobs(
+            db, [job.model_id], job.system_prompt, job.reply_to_id, job.user_content, job.use_cache
+        )
+    if not prepared:
+        await finish_job(job.id, status="failed", error="Model no longer exists")
+        return
+
+    generation = prepared[0][-1]
+    if job.cancel_requested:
+        generation.cancel()
+    state = LiveJob(generation)
+    live[job.id] = state
+    heartbeat = asyncio.create_task(checkpoint(job.id, state))
+    try:
+        # Registered like any other turn, so edits and /chat/cancel/ in this process stop it too
+        async with chat.track_turn(job.conversation_id, prepared):
+            res = None
+            async for kind, payload in chat.stream_llm_response(*prepared[0]):
+                if kind == "delta":
+                    state.chunks.append(payload)
+                    state.publish("delta", payload)
+                elif kind == "result":
+                    res = payload
+            heartbeat.cancel()
+            msg = await store_result(job, res)
+        state.publish("result", chat.serialize_message(msg))
+    finally:
+        heartbeat.cancel()
+        # Streams still attached fall back to reading the stored job
+        state.publish("closed", None)
+        live.pop(job.id, None)
+
+async def worker():
+    while True:
+        try:
+            async with database.AsyncSessionLocal() as db:
+                job = await claim_job(db)
+        except Exception:
+            logger.exception("Job worker %s: claim failed", WORKER_ID)
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+            continue
+        try:
+            await run_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            await finish_job(job.id, status="failed", error=str(e))
+
+async def startup():
+    global _wakeup
+    _wakeup = asyncio.Event()
+    _workers.extend(asyncio.create_task(worker()) for _ in range(JOB_WORKERS))
+
+async def shutdown():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    # Hand unfinished jobs back to the queue right away instead of waiting for them to go stale
+    async with database.AsyncSessionLocal() as db:
+        await db.execute(
+            update(Job).where(Job.status == "running", Job.worker_id == WORKER_ID).values(status="queued", worker_id=None)
+        )
+        await db.commit()
+
+def notify():
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+# --- API ---
+
+async def queue_jobs(db: AsyncSession, prepared: List[tuple], conversation_id: int, reply_to_id: int,
+                     kind: str = "chat", message_id: Optional[int] = None) -> List[models.GenerationJob]:
+    rows = [
+        Job(
+            kind=kind,
+            status="queued",
+            conversation_id=conversation_id,
+            model_id=mid,
+            system_prompt=sys_prompt,
+            user_content=user_content,
+            reply_to_id=reply_to_id,
+            use_cache=use_cache,
+            message_id=message_id,
+            partial_content="",
+            attempts=0,
+        )
+        for mid, sys_prompt, _, user_content, _, _, use_cache, _ in prepared
+    ]
+    db.add_all(rows)
+    await db.commit()
+    notify()
+    result = await db.scalars(
+        select(Job).options(*job_options).filter(Job.id.in_([j.id for j in rows])).order_by(Job.id)
+    )
+    return result.all()
+
+@router.post("/jobs/chat/", response_model=schemas.JobSubmission)
+async def submit_chat(req: chat.ChatRequest, db: AsyncSession = Depends(get_db)):
+    user_msg, prepared = await chat.start_chat(req, db)
+    jobs = await queue_jobs(db, prepared, req.conversation_id, user_msg.id)
+    return schemas.JobSubmission(message=user_msg, jobs=jobs)
+
+@router.post("/jobs/edit/", response_model=schemas.JobSubmission)
+async def submit_edit(req: chat.EditRequest, db: AsyncSession = Depends(get_db)):
+    user_msg, prepared = await chat.start_edit(req, db)
+    jobs = await queue_jobs(db, prepared, req.conversation_id, user_msg.id)
+    return schemas.JobSubmission(message=user_msg, jobs=jobs)
+
+@router.post("/jobs/regenerate/", response_model=schemas.JobSubmission)
+async def submit_regenerate(req: chat.RegenerateRequest, db: AsyncSession = Depends(get_db)):
+    target_msg, user_msg, job = await chat.start_regenerate(req, db)
+    jobs = await queue_jobs(db, [job], target_msg.conversation_id, user_msg.id, "regenerate", target_msg.id)
+    return schemas.JobSubmission(message=await chat.reload_message(db, target_msg.id), jobs=jobs)
+
+@router.get("/jobs/", response_model=List[schemas.GenerationJob])
+async def read_jobs(conversation_id: Optional[int] = None, status: Optional[str] = None, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    query = select(Job).options(*job_options)
+    if conversation_id is not None:
+        query = query.filter(Job.conversation_id == conversation_id)
+    if status:
+        query = query.filter(Job.status == status)
+    jobs = await db.scalars(query.order_by(Job.id.desc()).offset(skip).limit(limit))
+    return jobs.all()
+
+@router.get("/jobs/{job_id}", response_model=schemas.GenerationJob)
+async def get_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await db.get(Job, job_id, options=job_options)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    state = live.get(job_id)
+    if state is not None:
+        # Fresher than the last checkpoint when the job runs in this process
+        job.partial_content = "".join(state.chunks)
+    return job
+
+@router.post("/jobs/{job_id}/cancel", response_model=schemas.GenerationJob)
+async def cancel_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await db.get(Job, job_id, options=job_options)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Conditional, so a worker claiming the job meanwhile gets the cancel flag instead
+    cancelled = await db.scalar(
+        update(Job).where(Job.id == job_id, Job.status == "queued")
+        .values(status="cancelled", finished_at=func.now()).returning(Job.id)
+    )
+    if cancelled is None:
+        # Picked up at the worker's next checkpoint; its partial output is stored as the reply
+        await db.execute(
+            update(Job).where(Job.id == job_id, Job.status == "running").values(cancel_requested=True)
+        )
+        state = live.get(job_id)
+        if state is not None:
+            state.generation.cancel()
+    await db.commit()
+    await db.refresh(job, ["status", "cancel_requested", "finished_at"])
+    return job
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    model_id = job.model_id
+    await db.close()
+
+    async def events():
+        sent = 0 # characters of content already sent
+        while True:
+            state = live.get(job_id)
+            if state is not None:
+                queue: asyncio.Queue = asyncio.Queue()
+                state.listeners.add(queue)
+                try:
+                    content = "".join(state.chunks)
+                    if len(content) > sent:
+                        yield chat.sse_event("delta", {"job_id": job_id, "model_id": model_id, "content": content[sent:]})
+                        sent = len(content)
+                    while True:
+                        kind, payload = await queue.get()
+                        if kind == "delta":
+                            sent += len(payload)
+                            yield chat.sse_event("delta", {"job_id": job_id, "model_id": model_id, "content": payload})
+                        elif kind == "result":
+                            yield chat.sse_event("result", {"job_id": job_id, "model_id": model_id, "message": payload})
+                            yield chat.sse_event("end", {})
+                            return
+                        else:
+                            break
+                finally:
+                    state.listeners.discard(queue)
+
+            # Queued, running on another replica, or finished: follow the checkpoints
+            async with database.AsyncSessionLocal() as stream_db:
+                job = await stream_db.get(Job, job_id, options=job_options)
+            if job is None:
+                yield chat.sse_event("error", {"job_id": job_id, "detail": "Job not found"})
+                return
+            content = job.partial_content or ""
+            if job.status in ("completed", "failed", "cancelled"):
+                if job.message is not None:
+                    yield chat.sse_event("result", {"job_id": job_id, "model_id": model_id, "message": chat.serialize_message(job.message)})
+                else:
+                    yield chat.sse_event("error", {"job_id": job_id, "detail": job.error})
+                yield chat.sse_event("end", {})
+                return
+            if len(content) > sent:
+                yield chat.sse_event("delta", {"job_id": job_id, "model_id": model_id, "content": content[sent:]})
+                sent = len(content)
+            if job_id not in live:
+                await asyncio.sleep(POLL_INTERVAL)
+
+    return chat.streaming_response(events())
@@ -0,0 +1,188 @@
+"""
+Load-testing mode: fires a fixed prompt at one model at increasing concurrency levels
+and reports TTFT / inter-token latency / TPS percentiles, error rate and aggregate
+throughput per level, to locate each provider's saturation point.
+
+    python -m app.loadtest --base-url http://localhost:8001/v1 --model mock-model --concurrency 1,4,16,64 --requests 200
+    python -m app.loadtest --mock --mock-ttft 0.2 --mock-tps 80 --duration 10
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Optional
+import argparse
+import asyncio
+import json
+import time
+
+from . import models, schemas, database, clients, timing
+from .chat import stream_llm_response
+from .timing import distribution
+
+router = APIRouter()
+get_db = database.get_db
+
+DEFAULT_LEVELS = [1, 4, 16, 64]
+DEFAULT_PROMPT = "Write a short paragraph about the history of the printing press."
+
+class LoadTestRequest(schemas.BaseModel):
+    model_id: int
+    prompt: str = DEFAULT_PROMPT
+    system_prompt: str = "You are a helpful assistant."
+    concurrency_levels: List[int] = DEFAULT_LEVELS
+    # Each level runs for a fixed duration, or until a fixed number of requests completed
+    duration_seconds: Optional[float] = None
+    requests_per_level: Optional[int] = None
+
+async def timed_request(provider_info: dict, model_name: str, system_prompt: str, prompt: str) -> dict:
+    start = time.perf_counter()
+    result = None
+    # Never served from the response cache: every request must reach the provider
+    async for kind, payload in stream_llm_response(0, system_prompt, [], prompt, provider_info, model_name, use_cache=False):
+        if kind == "result":
+            result = payload
+    end = time.perf_counter()
+    arrivals = timing.unpack_timeline(result.get("timeline"))
+    return {
+        "success": result["success"],
+        "ttft": result["ttft"],
+        "tps": result["tps"],
+        "output_tokens": result["output_tokens"] if result["success"] else 0,
+        "latency": end - start,
+        # Gaps between consecutive content chunks (a chunk may carry more than one token)
+        "itl": [b - a for a, b in zip(arrivals, arrivals[1:])],
+    }
+
+def summarize(concurrency: int, samples: List[dict], wall_time: float) -> dict:
+    ok = [s for s in samples if s["success"]]
+    output_tokens = sum(s["output_tokens"] for s in ok)
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "error_rate": (len(samples) - len(ok)) / len(samples) if samples else 0,
+        "wall_time": wall_time,
+        "requests_per_second": len(ok) / wall_time if wall_time else 0,
+        "aggregate_output_tps": output_tokens / wall_time if wall_time else 0,
+        "ttft": distribution([s["ttft"] for s in ok if s["ttft"] is not None]),
+        "inter_token_latency": distribution([gap for s in ok for gap in s["itl"]]),
+        "output_tps": distribution([s["tps"] for s in ok if s["tps"]]),
+        "latency": distribution([s["latency"] for s in ok]),
+    }
+
+async def run_level(provider_info: dict, model_name: str, system_prompt: str, prompt: str, concurrency: int,
+                    duration: Optional[float] = None, requests: Optional[int] = None) -> dict:
+    if duration is None and requests is None:
+        requests = concurrency * 4
+    samples: List[dict] = []
+    issued = 0
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+
+    async def worker():
+        nonlocal issued
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if requests is not None and issued >= requests:
+                return
+            issued += 1
+            samples.append(await timed_request(provider_info, model_name, system_prompt, prompt))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(concurrency, samples, time.perf_counter() - start)
+
+async def run_load_test(provider_info: dict, model_name: str, system_prompt: str, prompt: str, levels: List[int],
+                        duration: Optional[float] = None, requests: Optional[int] = None) -> List[dict]:
+    # Levels run one after another so they don't compete for the same upstream
+    return [
+        await run_level(provider_info, model_name, system_prompt, prompt, level, duration, requests)
+        for level in levels
+    ]
+
+@router.post("/loadtest/")
+async def load_test(req: LoadTestRequest, db: AsyncSession = Depends(get_db)):
+    if any(level < 1 for level in req.concurrency_levels):
+        raise HTTPException(status_code=400, detail="Concurrency levels must be positive")
+    db_model = await db.get(models.Model, req.model_id, options=[selectinload(models.Model.provider)])
+    if not db_model:
+        raise HTTPException(status_code=404, detail="Model not found")
+    p_info = clients.provider_info(db_model.provider)
+    await db.close()
+
+    levels = await run_load_test(
+        p_info, db_model.model_id, req.system_prompt, req.prompt, req.concurrency_levels,
+        req.duration_seconds, req.requests_per_level
+    )
+    return {"model_id": req.model_id, "model": db_model.model_id, "levels": levels}
+
+
+# --- CLI ---
+
+def format_report(levels: List[dict]) -> str:
+    def ms(v):
+        return f"{v * 1000:.0f}" if v is not None else "-"
+
+    def num(v):
+        return f"{v:.1f}" if v is not None else "-"
+
+    header = f"{'conc':>5} {'reqs':>6} {'err%':>6} {'req/s':>7} {'agg tok/s':>10} {'ttft p50/p90/p99 (ms)':>24} {'itl p50/p99 (ms)':>18} {'tps p50':>8}"
+    lines = [header, "-" * len(header)]
+    for lv in levels:
+        ttft, itl = lv["ttft"], lv["inter_token_latency"]
+        lines.append(
+            f"{lv['concurrency']:>5} {lv['requests']:>6} {lv['error_rate'] * 100:>6.1f} {lv['requests_per_second']:>7.2f} "
+            f"{lv['aggregate_output_tps']:>10.1f} {ms(ttft['p50']) + '/' + ms(ttft['p90']) + '/' + ms(ttft['p99']):>24} "
+            f"{ms(itl['p50']) + '/' + ms(itl['p99']):>18} {num(lv['output_tps']['p50']):>8}"
+        )
+    return "\n".join(lines)
+
+async def start_mock(ttft: float, tps: float, output_tokens: int):
+    import uvicorn
+    from .mock_server import MockConfig, create_app
+
+    config = MockConfig(ttft=ttft, tps=tps, output_tokens=output_tokens)
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=0, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}/v1"
+
+async def cli(args):
+    server = task = None
+    base_url = args.base_url
+    if args.mock:
+        # In-process mock shares the event loop with the load generator; run it separately for precise numbers
+        server, task, base_url = await start_mock(args.mock_ttft, args.mock_tps, args.mock_output_tokens)
+    if not base_url:
+        raise SystemExit("--base-url or --mock is required")
+    p_info = {"id": "loadtest", "api_key": args.api_key, "base_url": base_url, "max_connections": max(args.concurrency)}
+    try:
+        levels = await run_load_test(p_info, args.model, args.system_prompt, args.prompt, args.concurrency, args.duration, args.requests)
+    finally:
+        await clients.shutdown()
+        if server is not None:
+            server.should_exit = True
+            await task
+    print(json.dumps(levels, indent=2) if args.json else format_report(levels))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="OpenAI-compatible base URL, e.g. https://api.openai.com/v1")
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--model", default="mock-model")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--system-prompt", default="You are a helpful assistant.")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=DEFAULT_LEVELS)
+    parser.add_argument("--duration", type=float, default=None, help="seconds per level")
+    parser.add_argument("--requests", type=int, default=None, help="requests per level")
+    parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    parser.add_argument("--mock", action="store_true", help="run against the bundled mock server")
+    parser.add_argument("--mock-ttft", type=float, default=0.2)
+    parser.add_argument("--mock-tps", type=float, default=50)
+    parser.add_argument("--mock-output-tokens", type=int, default=100)
+    asyncio.run(cli(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+from collections import OrderedDict
+from typing import Optional
+import time
+
+
+class LRUCache:
+    """Bounded by entry count and by total content size; entries expire after `ttl` seconds."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict() # key -> (expires_at, size, value)
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key: str, value: dict, size: int, ttl: Optional[float] = None):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), size, value)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        self.size -= self._entries.pop(key)[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
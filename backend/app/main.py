@@ -1,15 +1,36 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .database import engine, Base
+from . import clients, database, evaluation, jobs, metrics, tokens
 from .api import router as core_router
 from .chat import router as chat_router
+from .evaluation import router as evaluation_router
+from .loadtest import router as loadtest_router
+from .analytics import router as analytics_router
+from .cache import router as cache_router
+from .jobs import router as jobs_router
+from .catalog import router as catalog_router
+from .export import router as export_router
+from .metrics import router as metrics_router
 
-# In a real app we would use Alembic for migrations,
-# but for simplicity we can trigger creation here as a fallback 
-# (though Alembic is preferred and will be setup)
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Migrations run once, outside the workers (app.migrate); creating missing tables here is for development
+    if database.DB_AUTO_CREATE:
+        await database.init_models()
+    metrics.startup(database.get_engine())
+    await clients.startup()
+    await tokens.startup()
+    await evaluation.startup()
+    await jobs.startup()
+    yield
+    await jobs.shutdown()
+    await evaluation.shutdown()
+    await clients.shutdown()
+    await metrics.shutdown()
+    await database.dispose_engine()
 
-app = FastAPI(title="LLM Evaluator API")
+app = FastAPI(title="LLM Evaluator API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,9 +39,19 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.include_router(core_router, prefix="/api")
 app.include_router(chat_router, prefix="/api")
+app.include_router(evaluation_router, prefix="/api")
+app.include_router(loadtest_router, prefix="/api")
+app.include_router(analytics_router, prefix="/api")
+app.include_router(cache_router, prefix="/api")
+app.include_router(jobs_router, prefix="/api")
+app.include_router(catalog_router, prefix="/api")
+app.include_router(export_router, prefix="/api")
+# Scrape and debug endpoints sit next to /health, outside /api
+app.include_router(metrics_router)
 
 @app.get("/health")
 def health_check():
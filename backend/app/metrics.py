@@ -0,0 +1,323 @@
+"""
+Prometheus metrics, served at /metrics:
+
+- http_request_duration_seconds per method, route template and status, measured to the
+  end of the response body (so streams count in full); http_requests_in_progress
+- upstream_* per provider and model: TTFT (also after the request was sent), tokens/s and
+  generation time histograms, connection setup time, generations by status, retries, errors
+  by type, and generations in flight; hedged generations per model group by outcome
+- context_trimmed_messages_total per provider and model: history left out to fit the input budget
+- db_query_duration_seconds per statement kind, from SQLAlchemy cursor events, and
+  db_pool_checked_out connections
+- event_loop_lag_seconds: how late a sleep on the event loop wakes up
+- jobs_running: jobs being generated
+
+With several worker processes (app.serve --workers), PROMETHEUS_MULTIPROC_DIR names a
+directory the workers share; /metrics then aggregates all of them, and the gauges are summed
+over live workers. Gauges read from a function (db_pool_checked_out, jobs_running) are
+sampled at the event loop lag interval there.
+
+A sampling profiler can be switched on at runtime when PROFILER_ENABLED=1. It samples the
+event loop thread's stack from a background thread and returns folded stacks, the input
+format of flamegraph.pl and speedscope:
+
+    curl -X POST 'localhost:8000/debug/profiler/start?duration=30'
+    curl localhost:8000/debug/profiler > stacks.folded
+"""
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.responses import PlainTextResponse
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from collections import Counter as Tally
+from typing import Optional
+import asyncio
+import os
+import sys
+import threading
+import time
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5")) # seconds
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0").lower() in ("1", "true", "yes")
+PROFILER_MAX_DURATION = 300.0 # seconds
+# Read by prometheus_client itself at import; set by app.serve when it starts several workers
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+router = APIRouter()
+
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency, to the end of the response body",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being served, including open streams", multiprocess_mode="livesum")
+
+UPSTREAM_TTFT = Histogram(
+    "upstream_ttft_seconds", "Time to first content token from the provider",
+    ["provider", "model"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 15, 30, 60),
+)
+UPSTREAM_SERVER_TTFT = Histogram(
+    "upstream_server_ttft_seconds", "Time to first content token after the request was sent",
+    ["provider", "model"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 15, 30, 60),
+)
+UPSTREAM_CONNECT = Histogram(
+    "upstream_connect_seconds", "Connection setup (DNS, TCP and TLS) for requests that opened a new connection",
+    ["provider"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+UPSTREAM_TPS = Histogram(
+    "upstream_tokens_per_second", "Output tokens per second after the first token",
+    ["provider", "model"],
+    buckets=(1, 5, 10, 20, 30, 40, 60, 80, 100, 150, 200, 300, 500),
+)
+UPSTREAM_DURATION = Histogram(
+    "upstream_generation_seconds", "Generation time from request to end of stream",
+    ["provider", "model"],
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+UPSTREAM_GENERATIONS = Counter("upstream_generations_total", "Generations by outcome", ["provider", "model", "status"])
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Retried upstream requests", ["provider", "model"])
+UPSTREAM_ERRORS = Counter("upstream_errors_total", "Failed generations by exception type", ["provider", "model", "error"])
+UPSTREAM_HEDGES = Counter("upstream_hedged_generations_total", "Generations in hedging groups by outcome", ["group", "outcome"])
+CONTEXT_TRIMMED = Counter("context_trimmed_messages_total", "History messages left out to fit a model's input budget", ["provider", "model"])
+UPSTREAM_IN_FLIGHT = Gauge("upstream_generations_in_flight", "Generations waiting on or streaming from a provider", ["provider"], multiprocess_mode="livesum")
+
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Database statement execution time",
+    ["statement"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_ERRORS = Counter("db_errors_total", "Database statements that raised")
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out of the pool", multiprocess_mode="livesum")
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Delay of event loop wakeups past their scheduled time",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+JOBS_RUNNING = Gauge("jobs_running", "Generation jobs running in the workers", multiprocess_mode="livesum")
+
+STATEMENT_KINDS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware, so streaming responses and disconnect detection pass through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            # The router stores the matched route in the scope; templates keep label cardinality bounded
+            route = scope.get("route")
+            HTTP_DURATION.labels(scope["method"], route.path if route is not None else "unmatched", str(status)).observe(
+                time.perf_counter() - start
+            )
+
+
+def provider_label(provider_info: dict) -> str:
+    return provider_info.get("name") or str(provider_info.get("id"))
+
+
+def observe_generation(provider_info: dict, model_name: str, res: dict):
+    provider = provider_label(provider_info)
+    status = "cache_hit" if res.get("cache_hit") else res["status"]
+    UPSTREAM_GENERATIONS.labels(provider, model_name, status).inc()
+    if res.get("cache_hit"):
+        return
+    if res.get("ttft") is not None:
+        UPSTREAM_TTFT.labels(provider, model_name).observe(res["ttft"])
+        if res.get("time_to_request_sent") is not None:
+            UPSTREAM_SERVER_TTFT.labels(provider, model_name).observe(max(0.0, res["ttft"] - res["time_to_request_sent"]))
+    if res.get("connect_time") is not None:
+        UPSTREAM_CONNECT.labels(provider).observe(res["connect_time"] + (res.get("tls_time") or 0.0))
+    if res.get("tps"):
+        UPSTREAM_TPS.labels(provider, model_name).observe(res["tps"])
+    if res.get("total_latency") is not None:
+        UPSTREAM_DURATION.labels(provider, model_name).observe(res["total_latency"])
+
+
+# --- Database ---
+
+def statement_kind(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    kind = words[0].upper() if words else ""
+    return kind if kind in STATEMENT_KINDS else "OTHER"
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start"].pop()
+    DB_QUERY_DURATION.labels(statement_kind(statement)).observe(time.perf_counter() - started)
+
+
+def handle_error(context):
+    DB_ERRORS.inc()
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+def instrument_engine(engine):
+    sync_engine = engine.sync_engine
+    for name, listener in (("before_cursor_execute", before_cursor_execute),
+                           ("after_cursor_execute", after_cursor_execute),
+                           ("handle_error", handle_error)):
+        if not event.contains(sync_engine, name, listener):
+            event.listen(sync_engine, name, listener)
+    pool = sync_engine.pool
+    if hasattr(pool, "checkedout"):
+        gauge_function(DB_POOL_CHECKED_OUT, pool.checkedout)
+
+
+# --- Function gauges and event loop lag ---
+
+_sampled = [] # (gauge, function)
+
+
+def gauge_function(gauge: Gauge, function):
+    """Gauge.set_function that also works with several workers."""
+    if MULTIPROCESS:
+        # Function gauges aren't written to the shared directory, so monitor_loop_lag sets them
+        _sampled.append((gauge, function))
+    else:
+        gauge.set_function(function)
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - scheduled))
+        for gauge, function in _sampled:
+            gauge.set(function())
+
+
+_lag_task: Optional[asyncio.Task] = None
+
+
+def startup(engine):
+    global _lag_task
+    instrument_engine(engine)
+    _lag_task = asyncio.get_running_loop().create_task(monitor_loop_lag())
+
+
+async def shutdown():
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        await asyncio.gather(_lag_task, return_exceptions=True)
+        _lag_task = None
+    # Joins the sampling thread, so off the event loop
+    await asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+# --- Sampling profiler ---
+
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval from a daemon thread."""
+
+    def __init__(self):
+        self.stacks = Tally()
+        self.samples = 0
+        self.interval = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id: int, interval: float, duration: float):
+        self.stacks = Tally()
+        self.samples = 0
+        self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(thread_id, interval, duration), daemon=True, name="sampling-profiler")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, thread_id: int, interval: float, duration: float):
+        ends = time.monotonic() + duration
+        while not self._stop.is_set() and time.monotonic() < ends:
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+            self._stop.wait(interval)
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+profiler = SamplingProfiler()
+
+
+def require_profiler():
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled; set PROFILER_ENABLED=1")
+
+
+@router.get("/metrics")
+def read_metrics():
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@router.post("/debug/profiler/start")
+async def start_profiler(interval: float = 0.005, duration: float = 30.0):
+    require_profiler()
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    if interval <= 0 or not 0 < duration <= PROFILER_MAX_DURATION:
+        raise HTTPException(status_code=400, detail=f"interval must be positive and duration in (0, {PROFILER_MAX_DURATION:g}]")
+    # Handlers run on the event loop thread, which is the one worth sampling
+    profiler.start(threading.get_ident(), interval, duration)
+    return {"status": "running", "interval": interval, "duration": duration}
+
+
+@router.post("/debug/profiler/stop")
+async def stop_profiler():
+    require_profiler()
+    await asyncio.to_thread(profiler.stop)
+    return {"status": "stopped", "samples": profiler.samples}
+
+
+@router.get("/debug/profiler")
+def read_profile():
+    require_profiler()
+    return PlainTextResponse(profiler.folded(), headers={"X-Profile-Samples": str(profiler.samples)})
@@ -0,0 +1,203 @@
+"""
+Schema migrations, with Alembic (backend/alembic). Run them once per deploy, before any
+worker starts; app.serve does this itself. Workers started by app.serve don't create tables.
+
+    python -m app.migrate            # upgrade to the latest revision
+    python -m app.migrate current    # the database's revision
+    python -m app.migrate sql        # print the upgrade's SQL instead of running it
+
+A database created before migrations (by create_all at startup) has the tables but no
+revision. It is adopted first: the tables, columns and indexes of the baseline revision that
+it lacks are added, as the content and branches migrations did, it is stamped with the latest
+revision its schema matches, and the revisions after that run on it like on any other database.
+
+Concurrent runs are serialized on Postgres by an advisory lock, and each run is one
+transaction, so a failed migration leaves the schema as it was. New revisions are written
+with Alembic from backend/:
+
+    alembic revision --autogenerate -m "add models.max_output_tokens"
+"""
+from sqlalchemy import Column, ForeignKeyConstraint, Index, MetaData, Table, UniqueConstraint, create_engine, inspect, text
+from typing import Optional
+import argparse
+import asyncio
+import os
+
+from alembic import command
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from alembic.script import ScriptDirectory
+
+from . import branches, content, database, models
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATE_LOCK_KEY = 0x6d696772 # 'migr'
+# The schema create_all made before migrations; adopting a database starts from it
+BASELINE_REVISION = "0001"
+
+
+def alembic_config(connection=None) -> Config:
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "alembic"))
+    # env.py migrates on this connection, inside our transaction, instead of opening its own
+    config.attributes["connection"] = connection
+    return config
+
+
+def current_revision(conn) -> Optional[str]:
+    return MigrationContext.configure(conn).get_current_revision()
+
+
+def added_column(column: Column, dialect: str) -> Column:
+    if dialect == "sqlite":
+        # SQLite can't add a foreign key to an existing table (it doesn't enforce them anyway),
+        # nor a NOT NULL column without a default
+        nullable = column.nullable or column.server_default is None
+        return Column(column.name, column.type, nullable=nullable, server_default=column.server_default)
+    return column._copy()
+
+
+def revision_schemas() -> list:
+    """
+    [(revision, {table: (columns, indexes)})] from the baseline to the head, as the revisions
+    create them on a scratch database.
+    """
+    script = ScriptDirectory.from_config(alembic_config())
+    revisions = [r.revision for r in script.walk_revisions(BASELINE_REVISION, "heads")][::-1]
+    engine = create_engine("sqlite://")
+    schemas = []
+    try:
+        with engine.begin() as conn:
+            for revision in revisions:
+                command.upgrade(alembic_config(conn), revision)
+                inspector = inspect(conn)
+                schemas.append((revision, {
+                    t: ({c["name"] for c in inspector.get_columns(t)}, {i["name"] for i in inspector.get_indexes(t)})
+                    for t in inspector.get_table_names() if t != "alembic_version"
+                }))
+    finally:
+        engine.dispose()
+    return schemas
+
+
+def matching_revision(conn, schemas: list) -> str:
+    """
+    The latest revision whose tables and columns the database already has: create_all at
+    startup makes the tables as the models are now, so a database it touched can be past the
+    baseline. Revisions that leave the tables as they were (data backfills, constraints) only
+    count as applied when a later one is, and otherwise run.
+    """
+    inspector = inspect(conn)
+    present = {t: {c["name"] for c in inspector.get_columns(t)} for t in inspector.get_table_names()}
+    matched, previous = BASELINE_REVISION, schemas[0][1]
+    for revision, schema in schemas[1:]:
+        if any(t not in present or not columns <= present[t] for t, (columns, _) in schema.items()):
+            break
+        if schema != previous:
+            matched = revision
+        previous = schema
+    return matched
+
+
+def baseline_metadata(schema: dict) -> MetaData:
+    """The current models trimmed to the baseline's tables, columns and indexes."""
+    metadata = MetaData()
+    for model in database.Base.metadata.sorted_tables:
+        if model.name not in schema:
+            continue
+        columns, indexes = schema[model.name]
+        table = Table(model.name, metadata, *(c._copy() for c in model.columns if c.name in columns))
+        # The copied columns bring their index=True indexes, but not their foreign keys
+        for constraint in model.constraints:
+            if not set(constraint.columns.keys()) <= columns:
+                continue
+            if isinstance(constraint, ForeignKeyConstraint):
+                table.append_constraint(constraint._copy())
+            elif isinstance(constraint, UniqueConstraint):
+                table.append_constraint(UniqueConstraint(*constraint.columns.keys(), name=constraint.name))
+        created = {i.name for i in table.indexes}
+        for index in model.indexes:
+            if index.name in indexes and index.name not in created:
+                Index(index.name, *(table.c[c.name] for c in index.columns), unique=index.unique)
+    return metadata
+
+
+def adopt(conn, schemas: list) -> list:
+    """Brings a create_all database up to the baseline schema; returns what was added."""
+    metadata = baseline_metadata(schemas[0][1])
+    tables = set(inspect(conn).get_table_names())
+    added = [t.name for t in metadata.sorted_tables if t.name not in tables]
+    metadata.create_all(conn)
+    if conn.dialect.name == "postgresql":
+        for statement in content.POSTGRES_DDL + branches.POSTGRES_DDL:
+            conn.execute(text(statement))
+    inspector = inspect(conn)
+    operations = Operations(MigrationContext.configure(conn))
+    for table in metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                operations.add_column(table.name, added_column(column, conn.dialect.name))
+                added.append(f"{table.name}.{column.name}")
+        indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(conn)
+                added.append(index.name)
+    return added
+
+
+def upgrade_sync(conn, revision: str) -> dict:
+    if conn.dialect.name == "postgresql":
+        # Released at the end of the transaction
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATE_LOCK_KEY})
+    before = current_revision(conn)
+    adopted = None
+    if before is None and inspect(conn).has_table(models.Conversation.__tablename__):
+        schemas = revision_schemas()
+        adopted = adopt(conn, schemas)
+        # The revisions after it, data backfills included, then run like on any other database
+        command.stamp(alembic_config(conn), matching_revision(conn, schemas))
+    command.upgrade(alembic_config(conn), revision)
+    return {"from": before, "to": current_revision(conn), "adopted": adopted}
+
+
+async def upgrade(revision: str = "head") -> dict:
+    async with database.get_engine().begin() as conn:
+        return await conn.run_sync(upgrade_sync, revision)
+
+
+async def current() -> Optional[str]:
+    async with database.get_engine().connect() as conn:
+        return await conn.run_sync(current_revision)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", choices=["upgrade", "current", "sql"], default="upgrade")
+    parser.add_argument("--revision", default="head", help="revision to upgrade to")
+    args = parser.parse_args()
+
+    if args.command == "sql":
+        # Offline mode: env.py renders the statements for DATABASE_URL's dialect
+        command.upgrade(alembic_config(), args.revision, sql=True)
+        return
+
+    async def run():
+        try:
+            if args.command == "current":
+                print(f"Revision: {await current() or '(none)'}")
+                return
+            result = await upgrade(args.revision)
+            if result["adopted"] is not None:
+                print(f"Adopted a database created before migrations; added: {', '.join(result['adopted']) or 'nothing'}")
+            print(f"Revision: {result['from'] or '(none)'} -> {result['to']}")
+        finally:
+            await database.dispose_engine()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Local OpenAI-compatible mock server with configurable latency and token rate.
+
+    python -m app.mock_server --port 8001 --ttft 0.3 --tps 60 --output-tokens 200
+
+Register it as a Provider with base_url http://localhost:8001/v1 to load-test the
+backend without touching a real upstream.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from dataclasses import dataclass
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do")
+
+
+@dataclass
+class MockConfig:
+    ttft: float = float(os.getenv("MOCK_TTFT", "0.2")) # seconds before the first token
+    tps: float = float(os.getenv("MOCK_TPS", "50")) # output tokens per second after the first
+    output_tokens: int = int(os.getenv("MOCK_OUTPUT_TOKENS", "100"))
+    jitter: float = float(os.getenv("MOCK_JITTER", "0.1")) # +/- fraction applied to every delay
+    error_rate: float = float(os.getenv("MOCK_ERROR_RATE", "0")) # fraction of requests answered with 500
+    models: str = os.getenv("MOCK_MODELS", "mock-model")
+
+
+def create_app(config: MockConfig = None) -> FastAPI:
+    config = config or MockConfig()
+    app = FastAPI(title="Mock OpenAI-compatible API")
+
+    def delay(base: float) -> float:
+        return max(0.0, base * (1 + random.uniform(-config.jitter, config.jitter)))
+
+    def chunk(model: str, choices: list, **extra) -> str:
+        body = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": choices}
+        body.update(extra)
+        return f"data: {json.dumps(body)}\n\n"
+
+    @app.get("/v1/models")
+    def list_models(request: Request):
+        # Weak validator over the model list, so catalog sync can exercise If-None-Match
+        etag = 'W/"%s"' % hashlib.sha1(config.models.encode()).hexdigest()[:16]
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        body = {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "mock"} for m in config.models.split(",")]}
+        return JSONResponse(body, headers={"ETag": etag})
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(body: dict):
+        if config.error_rate and random.random() < config.error_rate:
+            raise HTTPException(status_code=500, detail="Injected mock failure")
+
+        model = body.get("model", "mock-model")
+        n_tokens = min(body.get("max_tokens") or config.output_tokens, config.output_tokens)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": n_tokens, "total_tokens": prompt_tokens + n_tokens}
+        words = [WORDS[i % len(WORDS)] + " " for i in range(n_tokens)]
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay(config.ttft) + delay(n_tokens / config.tps))
+            return {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def stream():
+            await asyncio.sleep(delay(config.ttft))
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(delay(1 / config.tps))
+                yield chunk(model, [{"index": 0, "delta": {"content": word}, "finish_reason": None}])
+            yield chunk(model, [{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield chunk(model, [], usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    defaults = MockConfig()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=defaults.ttft)
+    parser.add_argument("--tps", type=float, default=defaults.tps)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens)
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--models", default=defaults.models)
+    args = parser.parse_args()
+
+    import uvicorn
+    config = MockConfig(args.ttft, args.tps, args.output_tokens, args.jitter, args.error_rate, args.models)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
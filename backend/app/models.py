@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, ForeignKey, DateTime, Float
+from sqlalchemy import Column, Integer, String, Text, Boolean, ForeignKey, DateTime, Float, LargeBinary, Index, UniqueConstraint, BigInteger
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
+from . import content
 
 class Provider(Base):
     __tablename__ = "providers"
@@ -11,10 +12,34 @@ class Provider(Base):
     base_url = Column(String)
     api_key = Column(String)
     
+    # Upstream connection pool settings; NULL falls back to the registry defaults
+    max_connections = Column(Integer, nullable=True)
+    max_keepalive_connections = Column(Integer, nullable=True)
+    keepalive_expiry = Column(Float, nullable=True) # seconds
+    http2 = Column(Boolean, default=False)
+    connect_timeout = Column(Float, nullable=True) # seconds
+    read_timeout = Column(Float, nullable=True) # seconds
+    
+    # Upstream rate limits; NULL means unlimited
+    requests_per_minute = Column(Integer, nullable=True)
+    tokens_per_minute = Column(Integer, nullable=True)
+    max_in_flight = Column(Integer, nullable=True)
+    max_retries = Column(Integer, nullable=True) # NULL falls back to ratelimit.DEFAULT_MAX_RETRIES
+    # 'fast' parses the SSE stream directly, 'sdk' goes through the openai client (see streams.py)
+    stream_decoder = Column(String, default="fast", server_default="fast")
+    # Last /models fetch, used to skip unchanged catalogs (see catalog.py)
+    catalog_etag = Column(String, nullable=True)
+    catalog_hash = Column(String(64), nullable=True)
+    catalog_synced_at = Column(DateTime(timezone=True), nullable=True)
+    
     models = relationship("Model", back_populates="provider", cascade="all, delete-orphan")
 
 class Model(Base):
     __tablename__ = "models"
+    __table_args__ = (
+        # Catalog sync upserts on this
+        UniqueConstraint("provider_id", "model_id", name="uq_models_provider_model"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     provider_id = Column(Integer, ForeignKey("providers.id"))
@@ -22,44 +47,254 @@ class Model(Base):
     name = Column(String) # For display e.g., 'GPT-4 Turbo'
     is_reasoning = Column(Boolean, default=False)
     enabled = Column(Boolean, default=True)
+    # Generation deadlines in seconds; NULL means none
+    ttft_deadline = Column(Float, nullable=True)
+    total_deadline = Column(Float, nullable=True)
+    # In tokens; NULL means unknown, and older turns are only left out when one of them is set (see tokens.py)
+    context_window = Column(Integer, nullable=True)
+    max_input_tokens = Column(Integer, nullable=True)
+    # Set while the model is missing from the provider's catalog; it can't be chosen then, whatever `enabled` says
+    delisted = Column(Boolean, default=False, server_default="false", nullable=False)
+    # Registrations of the same upstream model on other providers, which chat may hedge across
+    group_id = Column(Integer, ForeignKey("model_groups.id", ondelete="SET NULL"), nullable=True, index=True)
     
     provider = relationship("Provider", back_populates="models")
-    generation_metadata = relationship("GenerationMetadata", back_populates="model", cascade="all, delete-orphan")
+    group = relationship("ModelGroup", back_populates="models")
+    generation_metadata = relationship("GenerationMetadata", back_populates="model", cascade="all, delete-orphan",
+                                       foreign_keys="GenerationMetadata.model_id")
+
+class ModelGroup(Base):
+    """The same upstream model served by several providers (see hedging.py)."""
+    __tablename__ = "model_groups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True)
+    hedging = Column(Boolean, default=True)
+    # A hedge fires when the first token is later than this quantile of the primary's recent TTFTs
+    hedge_quantile = Column(Float, default=0.95)
+    min_hedge_delay = Column(Float, default=0.1) # seconds
+    initial_hedge_delay = Column(Float, default=2.0) # seconds, until the primary has enough TTFT samples
+
+    models = relationship("Model", back_populates="group")
+
+    @property
+    def model_ids(self) -> list:
+        return [m.id for m in self.models]
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Keyset pagination of the conversation list
+        Index("ix_conversations_created_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, default="New Conversation")
-    system_prompt = Column(Text, default="You are a helpful assistant.")
+    # The prompt lives in content_blobs (see content.py); the inline column only holds rows
+    # written before the content store, until `python -m app.content migrate` moves them
+    system_prompt_hash = Column(String(64), ForeignKey("content_blobs.hash"), nullable=True, index=True)
+    legacy_system_prompt = Column("system_prompt", Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Last Message.seq handed out in this conversation (see persistence.allocate_seq)
+    next_seq = Column(Integer, default=0, server_default="0", nullable=False)
+    # Last user message of the active branch (see branches.py); conversations and messages
+    # reference each other, so this constraint is created after both tables
+    head_id = Column(Integer, ForeignKey("messages.id", ondelete="SET NULL", use_alter=True, name="fk_conversations_head_id"), nullable=True)
     
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan", order_by="Message.seq",
+                            foreign_keys="Message.conversation_id")
+    system_prompt_blob = relationship("ContentBlob", lazy="joined")
+
+    @property
+    def system_prompt(self) -> str:
+        return content.text_of(self.system_prompt_blob, self.legacy_system_prompt)
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+        # Orders a conversation without created_at ties and serves per-model history lookups
+        Index("ix_messages_conversation_seq", "conversation_id", "seq", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
+    seq = Column(Integer) # position within the conversation
     role = Column(String) # 'user' or 'assistant'
-    content = Column(Text)
+    # Generating model for assistant messages, denormalized from GenerationMetadata for history lookups
+    model_id = Column(Integer, ForeignKey("models.id", ondelete="SET NULL"), nullable=True)
+    # The previous user turn of the branch for user messages, the user message answered for replies
+    parent_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=True, index=True)
+    # Whether this is its model's current reply to the parent; regenerating adds an active sibling
+    active = Column(Boolean, default=True, server_default="true", nullable=False)
+    # Body in content_blobs, shared by every message with the same text (see content.py)
+    content_hash = Column(String(64), ForeignKey("content_blobs.hash"), nullable=True, index=True)
+    legacy_content = Column("content", Text, nullable=True) # pre-content-store rows, until migrated
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
-    conversation = relationship("Conversation", back_populates="messages")
+    conversation = relationship("Conversation", back_populates="messages", foreign_keys=[conversation_id])
     generation_metadata = relationship("GenerationMetadata", back_populates="message", cascade="all, delete-orphan")
+    content_blob = relationship("ContentBlob", lazy="joined")
+
+    @property
+    def content(self) -> str:
+        return content.text_of(self.content_blob, self.legacy_content)
 
 class GenerationMetadata(Base):
     __tablename__ = "generation_metadata"
 
     id = Column(Integer, primary_key=True, index=True)
-    message_id = Column(Integer, ForeignKey("messages.id"))
-    model_id = Column(Integer, ForeignKey("models.id"))
+    message_id = Column(Integer, ForeignKey("messages.id"), index=True)
+    model_id = Column(Integer, ForeignKey("models.id"), index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     
     time_to_first_token = Column(Float, nullable=True) # in ms or s
     input_tokens = Column(Integer, nullable=True)
     output_tokens = Column(Integer, nullable=True)
     tokens_per_second = Column(Float, nullable=True)
     cached_input_tokens = Column(Integer, nullable=True)
+    retry_count = Column(Integer, default=0)
+    
+    # Per-chunk arrival times, packed by timing.pack_timeline (float32 deltas, seconds)
+    token_timeline = Column(LargeBinary, nullable=True)
+    total_latency = Column(Float, nullable=True) # seconds, request to end of stream
+    itl_p50 = Column(Float, nullable=True) # inter-token latency, seconds
+    itl_p99 = Column(Float, nullable=True)
+    max_stall = Column(Float, nullable=True) # longest gap between chunks, seconds
+    # Phases of the request that answered, from httpcore trace events (see streams.PhaseTrace), seconds.
+    # Offsets are from the request being issued; TTFT minus time_to_request_sent is the server's share.
+    queue_time = Column(Float, nullable=True) # local rate-limit wait and retry backoff
+    connect_time = Column(Float, nullable=True) # DNS and TCP connect; null on a reused connection
+    tls_time = Column(Float, nullable=True)
+    connection_reused = Column(Boolean, nullable=True)
+    time_to_request_sent = Column(Float, nullable=True)
+    time_to_headers = Column(Float, nullable=True)
+    time_to_first_byte = Column(Float, nullable=True)
+    # Served from the response cache: no upstream call, so excluded from TTFT/TPS statistics
+    cache_hit = Column(Boolean, default=False, server_default="false", nullable=False)
+    # Hedged generations: the group member that answered (model_id stays the one requested),
+    # and whether a second provider was asked. Both are null outside hedging groups.
+    served_model_id = Column(Integer, ForeignKey("models.id", ondelete="SET NULL"), nullable=True, index=True)
+    hedged = Column(Boolean, nullable=True)
+    # 'completed', 'error', or 'cancelled'/'timed_out' with the partial output kept as the message content
+    status = Column(String, default="completed", server_default="completed")
     
     message = relationship("Message", back_populates="generation_metadata")
-    model = relationship("Model", back_populates="generation_metadata")
+    model = relationship("Model", back_populates="generation_metadata", foreign_keys=[model_id])
+
+class ContentBlob(Base):
+    """A distinct message body or system prompt, stored once and compressed when large (see content.py)."""
+    __tablename__ = "content_blobs"
+
+    hash = Column(String(64), primary_key=True) # sha256 of the UTF-8 text
+    codec = Column(String, default="none") # 'none' or 'zlib'
+    data = Column(LargeBinary)
+    size = Column(Integer) # UTF-8 bytes before compression
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ModelPerfRollup(Base):
+    """Hourly per-model aggregates, maintained incrementally as generations are stored (see analytics.py)."""
+    __tablename__ = "model_perf_rollups"
+    __table_args__ = (
+        UniqueConstraint("model_id", "bucket_start", name="uq_model_perf_rollups_model_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    model_id = Column(Integer, ForeignKey("models.id", ondelete="CASCADE"), index=True)
+    bucket_start = Column(DateTime(timezone=True), index=True)
+
+    generations = Column(Integer, default=0)
+    errors = Column(Integer, default=0)
+    ttft_count = Column(Integer, default=0)
+    ttft_sum = Column(Float, default=0)
+    tps_count = Column(Integer, default=0)
+    tps_sum = Column(Float, default=0)
+    input_tokens = Column(BigInteger, default=0)
+    output_tokens = Column(BigInteger, default=0)
+    cached_input_tokens = Column(BigInteger, default=0)
+
+class ResponseCacheEntry(Base):
+    """Postgres tier of the response cache (see cache.py), keyed by the sha256 of the request."""
+    __tablename__ = "response_cache"
+
+    key = Column(String(64), primary_key=True)
+    content = Column(Text)
+    input_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+    cached_input_tokens = Column(Integer, nullable=True)
+    size_bytes = Column(Integer, default=0)
+    hits = Column(Integer, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), index=True)
+    last_hit_at = Column(DateTime(timezone=True), index=True) # eviction order once the table is full
+
+class GenerationJob(Base):
+    """One model's reply to one turn, generated by the worker pool in jobs.py rather than in the HTTP request."""
+    __tablename__ = "generation_jobs"
+    __table_args__ = (
+        # Workers claim the oldest queued job
+        Index("ix_generation_jobs_status_id", "status", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, default="chat") # 'chat' (a new reply) or 'regenerate' (another reply next to message_id)
+    status = Column(String, default="queued") # 'queued', 'running', 'completed', 'failed', 'cancelled'
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), index=True)
+    model_id = Column(Integer, ForeignKey("models.id", ondelete="CASCADE"))
+    system_prompt = Column(Text)
+    user_content = Column(Text)
+    # The user message being answered; the history is the branch above it
+    reply_to_id = Column(Integer, ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    use_cache = Column(Boolean, default=True)
+    # The reply once stored; for 'regenerate' until then, the reply it is an alternative to
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    partial_content = Column(Text, default="") # checkpointed while running
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    cancel_requested = Column(Boolean, default=False) # seen by the running worker at its next checkpoint
+    worker_id = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    message = relationship("Message", foreign_keys=[message_id])
+
+class EvaluationRun(Base):
+    __tablename__ = "evaluation_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String)
+    system_prompt = Column(Text, default="You are a helpful assistant.")
+    status = Column(String, default="pending", index=True) # 'pending', 'running', 'completed', 'cancelled'
+    max_concurrency = Column(Integer, default=8)
+    per_provider_concurrency = Column(Integer, default=4)
+    bypass_cache = Column(Boolean, default=False, server_default="false")
+    # Results are stored as assistant messages (with their GenerationMetadata) in this conversation
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="SET NULL"))
+    # Claimed by one worker process at a time, like generation jobs (see evaluation.claim_run)
+    worker_id = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    cancel_requested = Column(Boolean, default=False, server_default="false", nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    conversation = relationship("Conversation")
+    items = relationship("EvaluationItem", back_populates="run", cascade="all, delete-orphan")
+
+class EvaluationItem(Base):
+    __tablename__ = "evaluation_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("evaluation_runs.id"), index=True)
+    prompt_index = Column(Integer) # line number in the submitted dataset
+    prompt_key = Column(String, nullable=True) # optional id from the dataset row
+    prompt = Column(Text)
+    model_id = Column(Integer, ForeignKey("models.id"))
+    status = Column(String, default="pending", index=True) # 'pending', 'completed', 'failed'
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
+    run = relationship("EvaluationRun", back_populates="items")
+    model = relationship("Model")
+    message = relationship("Message", foreign_keys=[message_id])
@@ -0,0 +1,142 @@
+"""
+Set-based writes for the hot paths: a turn's replies and their metadata go in with one
+multi-row INSERT each, and deleting a conversation is a fixed handful of statements,
+so the number of round trips doesn't grow with the number of models or messages.
+"""
+from sqlalchemy import select, insert, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+
+from . import models, analytics, content
+from .database import upsert
+
+
+async def allocate_seq(db: AsyncSession, conversation_id: int, count: int = 1) -> int:
+    # Atomic per-conversation counter; the row lock serializes concurrent writers until commit
+    last = await db.scalar(
+        update(models.Conversation).where(models.Conversation.id == conversation_id)
+        .values(next_seq=models.Conversation.next_seq + count)
+        .returning(models.Conversation.next_seq)
+    )
+    return last - count + 1
+
+def metadata_values(res: dict) -> dict:
+    """GenerationMetadata columns for a stream_llm_response result."""
+    return {
+        "time_to_first_token": res["ttft"],
+        "tokens_per_second": res["tps"],
+        "output_tokens": res["output_tokens"],
+        "input_tokens": res.get("input_tokens"),
+        "cached_input_tokens": res.get("cached_input_tokens"),
+        "retry_count": res.get("retry_count", 0),
+        "token_timeline": res.get("timeline"),
+        "total_latency": res.get("total_latency"),
+        "itl_p50": res.get("itl_p50"),
+        "itl_p99": res.get("itl_p99"),
+        "max_stall": res.get("max_stall"),
+        "queue_time": res.get("queue_time"),
+        "connect_time": res.get("connect_time"),
+        "tls_time": res.get("tls_time"),
+        "connection_reused": res.get("connection_reused"),
+        "time_to_request_sent": res.get("time_to_request_sent"),
+        "time_to_headers": res.get("time_to_headers"),
+        "time_to_first_byte": res.get("time_to_first_byte"),
+        "cache_hit": res.get("cache_hit", False),
+        "served_model_id": res.get("served_model_id"),
+        "hedged": res.get("hedged"),
+        "status": res.get("status", "completed"),
+    }
+
+async def add_results(db: AsyncSession, conversation_id: int, results: List[dict], parent_id: Optional[int] = None) -> List[int]:
+    """
+    Stores each result as an assistant message answering `parent_id`, with its metadata, in order;
+    returns the message ids. Earlier replies of the same models to that message stay, inactive.
+    """
+    if not results:
+        return []
+    if parent_id is not None:
+        await db.execute(
+            update(models.Message).where(
+                models.Message.parent_id == parent_id,
+                models.Message.model_id.in_({res["model_id"] for res in results}),
+                models.Message.active.is_(True),
+            ).values(active=False)
+        )
+    first_seq = await allocate_seq(db, conversation_id, len(results))
+    content_hashes = await content.put_many(db, [res["content"] for res in results])
+    message_ids = (await db.scalars(
+        insert(models.Message).returning(models.Message.id, sort_by_parameter_order=True),
+        [
+            {
+                "conversation_id": conversation_id,
+                "seq": first_seq + i,
+                "role": "assistant",
+                "model_id": res["model_id"],
+                "parent_id": parent_id,
+                "active": True,
+                "content_hash": content_hashes[i],
+            }
+            for i, res in enumerate(results)
+        ],
+    )).all()
+    await db.execute(
+        insert(models.GenerationMetadata),
+        [
+            {"message_id": message_id, "model_id": res["model_id"], **metadata_values(res)}
+            for message_id, res in zip(message_ids, results)
+        ],
+    )
+    await analytics.record_generations(db, results)
+    return list(message_ids)
+
+async def delete_conversation(db: AsyncSession, conversation_id: int):
+    """
+    Deletes the conversation with every branch's messages and their metadata. Evaluation runs
+    that stored their results there are kept, without them, and stop if they haven't finished.
+    """
+    of_conversation = models.Message.conversation_id == conversation_id
+    doomed = select(models.Message.id).filter(of_conversation)
+    Run = models.EvaluationRun
+    of_run = Run.conversation_id == conversation_id
+    await db.execute(update(Run).where(of_run, Run.status == "pending").values(status="cancelled", finished_at=func.now()))
+    await db.execute(update(Run).where(of_run, Run.status == "running").values(cancel_requested=True))
+    await db.execute(delete(models.GenerationMetadata).where(models.GenerationMetadata.message_id.in_(doomed)))
+    await db.execute(update(models.Conversation).where(models.Conversation.id == conversation_id).values(head_id=None))
+    await db.execute(delete(models.Message).where(of_conversation))
+    await db.execute(delete(models.Conversation).where(models.Conversation.id == conversation_id))
+
+async def apply_catalog(db: AsyncSession, provider_id: int, model_ids: List[str]) -> dict:
+    """
+    Brings a provider's models in line with its catalog: new ids are inserted, registered ids
+    that are no longer listed are delisted, and delisted ids that are listed again are relisted.
+    `enabled` is the user's and isn't touched. Returns the counts.
+    """
+    # dict keeps the listing order and drops duplicates
+    listed = [m for m in dict.fromkeys(model_ids) if m]
+    existing = dict((await db.execute(
+        select(models.Model.model_id, models.Model.delisted).filter(models.Model.provider_id == provider_id)
+    )).all())
+    listed_set = set(listed)
+    new = [m for m in listed if m not in existing]
+    relisted = [m for m, delisted in existing.items() if delisted and m in listed_set]
+    # An empty listing is far more likely a provider hiccup than a real catalog
+    gone = [m for m, delisted in existing.items() if not delisted and m not in listed_set] if listed else []
+
+    added = 0
+    if new:
+        stmt = upsert(db, models.Model.__table__).values([
+            # Name defaults to the ID, user can edit later
+            {"provider_id": provider_id, "model_id": m, "name": m, "is_reasoning": False, "enabled": True, "delisted": False}
+            for m in new
+        ])
+        # A concurrent sync of the same provider may have inserted some of them already
+        stmt = stmt.on_conflict_do_nothing(index_elements=["provider_id", "model_id"]).returning(models.Model.id)
+        added = len((await db.execute(stmt)).all())
+    of_provider = models.Model.provider_id == provider_id
+    if relisted:
+        await db.execute(update(models.Model).where(of_provider, models.Model.model_id.in_(relisted))
+                         .values(delisted=False))
+    if gone:
+        await db.execute(update(models.Model).where(of_provider, models.Model.model_id.in_(gone))
+                         .values(delisted=True))
+    return {"added": added, "delisted": len(gone), "relisted": len(relisted)}
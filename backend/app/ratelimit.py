@@ -0,0 +1,126 @@
+import asyncio
+import email.utils
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import openai
+
+DEFAULT_MAX_RETRIES = 3
+BACKOFF_BASE = 0.5 # seconds
+BACKOFF_CAP = 30.0 # seconds
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Refills continuously at `per_minute / 60` units per second up to `per_minute`."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self, amount: float):
+        # A single oversized request must still be admitted once the bucket is full
+        amount = min(amount, self.capacity)
+        # Waiters queue on the lock so they're served in arrival order
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def adjust(self, amount: float):
+        # Settle an estimate against actual usage; a negative balance delays later requests
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class ProviderLimiter:
+    def __init__(self, requests_per_minute: Optional[int], tokens_per_minute: Optional[int], max_in_flight: Optional[int]):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.in_flight = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+
+    @asynccontextmanager
+    async def slot(self):
+        # Held for a whole generation, including its retries
+        if self.in_flight is None:
+            yield
+            return
+        async with self.in_flight:
+            yield
+
+    async def acquire(self, estimated_tokens: int):
+        # Called before every attempt, so retries are paced like any other request
+        if self.requests is not None:
+            await self.requests.take(1)
+        if self.tokens is not None:
+            await self.tokens.take(estimated_tokens)
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+_limiters: Dict[object, tuple] = {}
+
+
+def get_limiter(provider_info: dict) -> ProviderLimiter:
+    # Rebuilt whenever the provider's limits change, like the client registry
+    key = (provider_info.get("requests_per_minute"), provider_info.get("tokens_per_minute"), provider_info.get("max_in_flight"))
+    entry = _limiters.get(provider_info["id"])
+    if entry is None or entry[0] != key:
+        entry = (key, ProviderLimiter(*key))
+        _limiters[provider_info["id"]] = entry
+    return entry[1]
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # HTTP-date form
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(exc: Exception, attempt: int, max_retries: int) -> Optional[float]:
+    """Seconds to wait before retrying `exc`, or None if it shouldn't be retried."""
+    if attempt >= max_retries:
+        return None
+    if isinstance(exc, openai.APIStatusError):
+        if exc.status_code not in RETRYABLE_STATUS:
+            return None
+        retry_after = parse_retry_after(exc.response.headers)
+    elif isinstance(exc, openai.APIConnectionError):
+        retry_after = None
+    else:
+        return None
+    if retry_after is not None:
+        return min(BACKOFF_CAP * 4, retry_after) + random.uniform(0, BACKOFF_BASE)
+    # Full jitter keeps a burst of throttled requests from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
@@ -0,0 +1,229 @@
+"""
+Record and replay of upstream chat-completion streams, for benchmarks that don't depend on a
+live provider's latency or on the network.
+
+Recording: with STREAM_RECORD_DIR set, every stream read on the fast path (streams.RawStream)
+that runs to [DONE] is saved under that directory as a fixture. A fixture is a gzipped JSON
+file holding the SSE data lines with their offsets from when the request was sent, plus the
+time to response headers. Streams can also be recorded without the backend:
+
+    python -m app.replay record --base-url https://api.openai.com/v1 --api-key sk-... --model gpt-4o-mini --count 20 --out fixtures/
+
+Replay: an OpenAI-compatible server that answers from the fixtures at the recorded speed,
+at N times that speed, or instantly (--speed 0). Register it as a Provider with base_url
+http://localhost:8002/v1; its /models lists the recorded models.
+
+    python -m app.replay serve --fixtures fixtures/ --port 8002 --speed 1
+
+A request gets a fixture recorded for the same model and messages when there is one, else
+the next fixture of that model, else the next fixture of any model. See app.bench for the
+benchmark suite on top of this.
+"""
+from collections import defaultdict
+from itertools import cycle
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+
+FIXTURE_VERSION = 1
+FIXTURE_SUFFIX = ".json.gz"
+DEFAULT_PROMPT = "Write a short paragraph about the history of the printing press."
+
+
+def request_hash(model: str, messages: list) -> str:
+    return hashlib.sha256(json.dumps([model, messages], sort_keys=True).encode()).hexdigest()
+
+
+class Recording:
+    """Data lines of one upstream stream, with their offsets from when the request was sent."""
+
+    def __init__(self, directory: str, model: str, messages: list, sent_at: float):
+        self.directory = directory
+        self.model = model
+        self.request_hash = request_hash(model, messages)
+        self.sent_at = sent_at
+        self.time_to_headers = None
+        self.lines = [] # [offset, payload]
+        self.complete = False
+
+    def headers(self):
+        self.time_to_headers = round(time.perf_counter() - self.sent_at, 6)
+
+    def line(self, payload: str):
+        self.lines.append([round(time.perf_counter() - self.sent_at, 6), payload])
+        if payload == "[DONE]":
+            self.complete = True
+
+    def save(self) -> Optional[str]:
+        """Writes the fixture if the stream ran to the end; returns its path. Blocking."""
+        if not self.complete:
+            return None
+        directory = os.path.join(self.directory, self.model.replace("/", "_"))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{time.time_ns()}-{self.request_hash[:12]}{FIXTURE_SUFFIX}")
+        fixture = {
+            "version": FIXTURE_VERSION,
+            "model": self.model,
+            "request_hash": self.request_hash,
+            "time_to_headers": self.time_to_headers,
+            "lines": self.lines,
+        }
+        with gzip.open(path, "wt") as f:
+            json.dump(fixture, f, separators=(",", ":"))
+        return path
+
+
+def load_fixtures(directory: str) -> List[dict]:
+    fixtures = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.endswith(FIXTURE_SUFFIX):
+                with gzip.open(os.path.join(root, name), "rt") as f:
+                    fixture = json.load(f)
+                if fixture.get("version") == FIXTURE_VERSION:
+                    fixtures.append(fixture)
+    return fixtures
+
+
+# --- Replay server ---
+
+class FixtureIndex:
+    """Picks the fixture that answers a request."""
+
+    def __init__(self, fixtures: List[dict]):
+        if not fixtures:
+            raise ValueError("No fixtures to replay")
+        self.models = sorted({f["model"] for f in fixtures})
+        by_request: Dict[str, List[dict]] = defaultdict(list)
+        by_model: Dict[str, List[dict]] = defaultdict(list)
+        for fixture in fixtures:
+            by_request[fixture["request_hash"]].append(fixture)
+            by_model[fixture["model"]].append(fixture)
+        self.by_request = {key: cycle(group) for key, group in by_request.items()}
+        self.by_model = {key: cycle(group) for key, group in by_model.items()}
+        self.any = cycle(fixtures)
+
+    def pick(self, model: str, messages: list) -> dict:
+        group = self.by_request.get(request_hash(model, messages)) or self.by_model.get(model) or self.any
+        return next(group)
+
+
+def create_app(index: FixtureIndex, speed: float = 1.0):
+    from fastapi import FastAPI, HTTPException
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI(title="Replay OpenAI-compatible API")
+
+    def scaled(offset: Optional[float]) -> float:
+        # speed 0 replays without any delay
+        return offset / speed if speed and offset else 0.0
+
+    @app.get("/v1/models")
+    def list_models():
+        return {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "replay"} for m in index.models]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(body: dict):
+        if not body.get("stream"):
+            raise HTTPException(status_code=400, detail="Only streaming requests are replayed")
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        fixture = index.pick(body.get("model", ""), body.get("messages", []))
+        await asyncio.sleep(scaled(fixture.get("time_to_headers")))
+
+        async def stream():
+            for offset, payload in fixture["lines"]:
+                wait = start + scaled(offset) - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                yield f"data: {payload}\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+async def start_server(fixtures_dir: str, speed: float):
+    """Serves the fixtures in-process on a free port; returns (server, task, base_url)."""
+    import uvicorn
+
+    app = create_app(FixtureIndex(load_fixtures(fixtures_dir)), speed)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}/v1"
+
+
+# --- CLI ---
+
+async def record(args) -> List[str]:
+    from . import clients, streams
+
+    info = {"id": "replay-record", "api_key": args.api_key, "base_url": args.base_url, "max_connections": args.concurrency}
+    client = clients.get_registry().get(info)
+    prompts = [args.prompt] if args.prompt else [f"{DEFAULT_PROMPT} ({i + 1})" for i in range(args.count)]
+    queue = asyncio.Queue()
+    for i in range(args.count):
+        queue.put_nowait(prompts[i % len(prompts)])
+    paths = []
+
+    async def worker():
+        while not queue.empty():
+            prompt = queue.get_nowait()
+            messages = [{"role": "system", "content": args.system_prompt}, {"role": "user", "content": prompt}]
+            stream = await streams.open_stream(client, info, args.model, messages, {}, record_dir=args.out)
+            try:
+                async for _ in stream.events():
+                    pass
+            finally:
+                path = await stream.close()
+            if path:
+                paths.append(path)
+                print(f"Recorded {path}")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    finally:
+        await clients.shutdown()
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    rec = commands.add_parser("record", help="record streams straight from a provider")
+    rec.add_argument("--base-url", required=True, help="OpenAI-compatible base URL")
+    rec.add_argument("--api-key", default=None)
+    rec.add_argument("--model", required=True)
+    rec.add_argument("--prompt", default=None, help="one prompt for every request; numbered variants of a default one otherwise")
+    rec.add_argument("--system-prompt", default="You are a helpful assistant.")
+    rec.add_argument("--count", type=int, default=10)
+    rec.add_argument("--concurrency", type=int, default=1)
+    rec.add_argument("--out", required=True, help="fixture directory")
+    serve = commands.add_parser("serve", help="serve fixtures as an OpenAI-compatible API")
+    serve.add_argument("--fixtures", required=True)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8002)
+    serve.add_argument("--speed", type=float, default=1.0, help="replay speed factor; 0 replays instantly")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        paths = asyncio.run(record(args))
+        print(f"Recorded {len(paths)} of {args.count} streams")
+        return
+    import uvicorn
+    fixtures = load_fixtures(args.fixtures)
+    index = FixtureIndex(fixtures)
+    print(f"Replaying {len(fixtures)} fixtures of {', '.join(index.models)}")
+    uvicorn.run(create_app(index, args.speed), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
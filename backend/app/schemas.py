@@ -7,12 +7,24 @@ class ProviderBase(BaseModel):
     name: str
     base_url: str
     api_key: str
+    max_connections: Optional[int] = None
+    max_keepalive_connections: Optional[int] = None
+    keepalive_expiry: Optional[float] = None
+    http2: bool = False
+    connect_timeout: Optional[float] = None
+    read_timeout: Optional[float] = None
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    max_in_flight: Optional[int] = None
+    max_retries: Optional[int] = None
+    stream_decoder: str = "fast"
 
 class ProviderCreate(ProviderBase):
     pass
 
 class Provider(ProviderBase):
     id: int
+    catalog_synced_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -23,6 +35,11 @@ class ModelBase(BaseModel):
     name: str
     is_reasoning: bool = False
     enabled: bool = True
+    ttft_deadline: Optional[float] = None
+    total_deadline: Optional[float] = None
+    context_window: Optional[int] = None
+    max_input_tokens: Optional[int] = None
+    group_id: Optional[int] = None
 
 class ModelCreate(ModelBase):
     provider_id: int
@@ -30,6 +47,25 @@ class ModelCreate(ModelBase):
 class Model(ModelBase):
     id: int
     provider_id: int
+    delisted: bool = False
+
+    class Config:
+        from_attributes = True
+
+# Model Group Schemas
+class ModelGroupBase(BaseModel):
+    name: str
+    hedging: bool = True
+    hedge_quantile: float = 0.95
+    min_hedge_delay: float = 0.1
+    initial_hedge_delay: float = 2.0
+
+class ModelGroupCreate(ModelGroupBase):
+    pass
+
+class ModelGroup(ModelGroupBase):
+    id: int
+    model_ids: List[int] = []
 
     class Config:
         from_attributes = True
@@ -42,6 +78,22 @@ class GenerationMetadataBase(BaseModel):
     output_tokens: Optional[int] = None
     tokens_per_second: Optional[float] = None
     cached_input_tokens: Optional[int] = None
+    retry_count: Optional[int] = 0
+    total_latency: Optional[float] = None
+    itl_p50: Optional[float] = None
+    itl_p99: Optional[float] = None
+    max_stall: Optional[float] = None
+    queue_time: Optional[float] = None
+    connect_time: Optional[float] = None
+    tls_time: Optional[float] = None
+    connection_reused: Optional[bool] = None
+    time_to_request_sent: Optional[float] = None
+    time_to_headers: Optional[float] = None
+    time_to_first_byte: Optional[float] = None
+    cache_hit: bool = False
+    served_model_id: Optional[int] = None
+    hedged: Optional[bool] = None
+    status: Optional[str] = "completed"
 
 class GenerationMetadataCreate(GenerationMetadataBase):
     message_id: int
@@ -53,6 +105,17 @@ class GenerationMetadata(GenerationMetadataBase):
     class Config:
         from_attributes = True
 
+class GenerationTimeline(BaseModel):
+    generation_id: int
+    # Arrival offset of each content chunk, seconds since the request was sent
+    offsets: List[float]
+    inter_token_latencies: List[float]
+    time_to_first_token: Optional[float] = None
+    total_latency: Optional[float] = None
+    itl_p50: Optional[float] = None
+    itl_p99: Optional[float] = None
+    max_stall: Optional[float] = None
+
 # Message Schemas
 class MessageBase(BaseModel):
     role: str
@@ -64,6 +127,13 @@ class MessageCreate(MessageBase):
 class Message(MessageBase):
     id: int
     conversation_id: int
+    seq: Optional[int] = None
+    model_id: Optional[int] = None
+    parent_id: Optional[int] = None
+    active: bool = True
+    # This message and its alternatives (edits of a user message, regenerations of a reply), oldest first;
+    # filled in on conversation pages
+    branch_ids: List[int] = []
     created_at: datetime
     generation_metadata: List[GenerationMetadata] = []
 
@@ -81,7 +151,99 @@ class ConversationCreate(ConversationBase):
 class Conversation(ConversationBase):
     id: int
     created_at: datetime
+    # Last user message of the active branch, whose messages are the ones included
+    head_id: Optional[int] = None
     messages: List[Message] = []
+    # True when only the latest page of messages is included
+    has_more_messages: bool = False
+
+    class Config:
+        from_attributes = True
+
+class ConversationSummary(BaseModel):
+    id: int
+    title: str
+    created_at: datetime
+    message_count: int
+    last_activity: datetime
+
+class ConversationSummaryPage(BaseModel):
+    items: List[ConversationSummary]
+    # Opaque keyset cursor for the next page, None on the last page
+    next_cursor: Optional[str] = None
+
+class MessagePage(BaseModel):
+    items: List[Message]
+    has_more: bool
+
+# Generation Job Schemas
+class GenerationJob(BaseModel):
+    id: int
+    kind: str
+    status: str
+    conversation_id: int
+    model_id: int
+    reply_to_id: Optional[int] = None
+    message_id: Optional[int] = None
+    partial_content: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    message: Optional[Message] = None
+
+    class Config:
+        from_attributes = True
+
+class JobSubmission(BaseModel):
+    # The stored user turn for chat and edit submissions, the regenerated message otherwise
+    message: Message
+    jobs: List[GenerationJob]
+
+# Evaluation Schemas
+class EvaluationRunCreate(BaseModel):
+    name: str
+    system_prompt: str = "You are a helpful assistant."
+    models_to_use: List[int]
+    # JSONL text: one prompt per line, either a JSON string or an object with a prompt field
+    dataset: str
+    prompt_field: Optional[str] = None
+    max_concurrency: int = 8
+    per_provider_concurrency: int = 4
+    # Always call the providers, even when the response cache is enabled
+    bypass_cache: bool = False
+
+class EvaluationRun(BaseModel):
+    id: int
+    name: str
+    system_prompt: str
+    status: str
+    max_concurrency: int
+    per_provider_concurrency: int
+    bypass_cache: Optional[bool] = False
+    conversation_id: Optional[int] = None # None once the conversation is deleted
+    cancel_requested: bool = False
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    total_items: int = 0
+    pending_items: int = 0
+    completed_items: int = 0
+    failed_items: int = 0
+
+    class Config:
+        from_attributes = True
+
+class EvaluationItem(BaseModel):
+    id: int
+    run_id: int
+    prompt_index: int
+    prompt_key: Optional[str] = None
+    prompt: str
+    model_id: int
+    status: str
+    message_id: Optional[int] = None
+    completed_at: Optional[datetime] = None
+    message: Optional[Message] = None
 
     class Config:
         from_attributes = True
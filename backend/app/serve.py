@@ -0,0 +1,248 @@
+"""
+Production serving: migrates the schema once, then starts uvicorn with several worker
+processes.
+
+    python -m app.serve run --workers 4 --port 8000
+    python -m app.serve startup-bench --workers 4 --max-startup 5 --max-worker-rss 150
+
+Workers don't create tables (DB_AUTO_CREATE=0) and open their engine and provider clients in
+the lifespan, not at import. Each takes DB_MAX_CONNECTIONS / workers connections (see
+database.py). With more than one worker, PROMETHEUS_MULTIPROC_DIR points at a fresh directory
+so /metrics covers all of them.
+
+startup-bench launches `run` as a deploy would and reports the import time of app.main, the
+time until the schema is migrated, until /health answers and until every worker has finished
+its startup, and each worker's resident memory once started (from /proc, so Linux only).
+With --max-startup or --max-worker-rss it exits non-zero when a run goes over.
+"""
+from typing import List, Optional
+import argparse
+import asyncio
+import glob
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from .timing import distribution
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_TIMEOUT = 120.0 # seconds
+
+
+def prepare_environment(workers: int) -> Optional[str]:
+    """
+    Settings the workers inherit; set before they (or app.database) are imported. Returns the
+    metrics directory if one was created here.
+    """
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    os.environ["DB_AUTO_CREATE"] = "0"
+    if workers == 1:
+        return None
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory is None:
+        directory = os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+        return directory
+    # Files of a previous run would be counted as live workers
+    for path in glob.glob(os.path.join(directory, "*.db")):
+        os.remove(path)
+    return None
+
+
+async def migrate_schema() -> dict:
+    from . import database, migrate
+
+    try:
+        return await migrate.upgrade()
+    finally:
+        await database.dispose_engine()
+
+
+def run(args):
+    metrics_dir = prepare_environment(args.workers)
+    try:
+        if not args.skip_migrate:
+            result = asyncio.run(migrate_schema())
+            print(f"Schema at revision {result['to']}", flush=True)
+        import uvicorn
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+    finally:
+        if metrics_dir is not None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+# --- Startup benchmark ---
+
+def import_time() -> float:
+    code = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def worker_pids(pid: int) -> List[int]:
+    """uvicorn's worker processes under `pid`, or `pid` itself when it serves alone."""
+    workers = []
+    for stat in glob.glob("/proc/[0-9]*/stat"):
+        try:
+            with open(stat) as f:
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            if parent != pid:
+                continue
+            child = int(stat.split("/")[2])
+            with open(f"/proc/{child}/cmdline", "rb") as f:
+                # Spawned workers; not e.g. multiprocessing's resource tracker
+                if b"spawn_main" in f.read():
+                    workers.append(child)
+        except (OSError, ValueError, IndexError):
+            continue
+    return sorted(workers) or [pid]
+
+
+def measure_startup(workers: int) -> dict:
+    port = free_port()
+    events = [] # (seconds since launch, line)
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "run", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+
+    def read_output():
+        for line in proc.stdout:
+            events.append((time.perf_counter() - start, line.rstrip()))
+
+    reader = threading.Thread(target=read_output, daemon=True)
+    reader.start()
+
+    def times_of(text: str) -> List[float]:
+        return [at for at, line in list(events) if text in line]
+
+    first_response = None
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - start < STARTUP_TIMEOUT:
+                if proc.poll() is not None:
+                    raise SystemExit("Server exited during startup:\n" + "\n".join(line for _, line in events))
+                if first_response is None:
+                    try:
+                        if client.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                            first_response = time.perf_counter() - start
+                    except httpx.HTTPError:
+                        pass
+                if first_response is not None and len(times_of("Application startup complete")) >= workers:
+                    break
+                time.sleep(0.02)
+            else:
+                raise SystemExit(f"Server didn't start within {STARTUP_TIMEOUT:g}s")
+        migrated = times_of("Schema at revision")
+        memory = [rss_mb(pid) for pid in worker_pids(proc.pid)]
+        return {
+            "migrated": migrated[0] if migrated else None,
+            "first_response": first_response,
+            "all_workers_ready": max(times_of("Application startup complete")),
+            "worker_rss_mb": [m for m in memory if m is not None],
+            "supervisor_rss_mb": rss_mb(proc.pid) if workers > 1 else None,
+        }
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def startup_bench(workers: int, runs: int) -> dict:
+    imports = [import_time() for _ in range(runs)]
+    samples = [measure_startup(workers) for _ in range(runs)]
+    rss = [m for s in samples for m in s["worker_rss_mb"]]
+    return {
+        "workers": workers,
+        "runs": runs,
+        "import_seconds": distribution(imports),
+        "migrated_seconds": distribution([s["migrated"] for s in samples if s["migrated"] is not None]),
+        "first_response_seconds": distribution([s["first_response"] for s in samples]),
+        "all_workers_ready_seconds": distribution([s["all_workers_ready"] for s in samples]),
+        "worker_rss_mb": {"max": max(rss) if rss else None, **distribution(rss)},
+        "supervisor_rss_mb": samples[-1]["supervisor_rss_mb"],
+    }
+
+
+def format_report(report: dict) -> str:
+    def row(name, d, unit, scale=1.0):
+        values = "  ".join(f"{k} {v * scale:.1f}" if v is not None else f"{k} -" for k, v in d.items() if k in ("p50", "p90", "max"))
+        return f"{name:<26} {values} {unit}"
+
+    lines = [
+        f"{report['workers']} workers, {report['runs']} runs",
+        row("import app.main", report["import_seconds"], "ms", 1000),
+        row("schema migrated", report["migrated_seconds"], "ms", 1000),
+        row("first /health", report["first_response_seconds"], "ms", 1000),
+        row("all workers ready", report["all_workers_ready_seconds"], "ms", 1000),
+        row("worker RSS", report["worker_rss_mb"], "MB"),
+    ]
+    if report["supervisor_rss_mb"] is not None:
+        lines.append(f"{'supervisor RSS':<26} {report['supervisor_rss_mb']:.1f} MB")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("run", help="migrate, then serve with several workers")
+    serve.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--log-level", default="info")
+    serve.add_argument("--skip-migrate", action="store_true", help="when migrations run as a separate deploy step")
+    bench = commands.add_parser("startup-bench", help="measure cold start and per-worker memory")
+    bench.add_argument("--workers", type=int, default=2)
+    bench.add_argument("--runs", type=int, default=3)
+    bench.add_argument("--max-startup", type=float, default=None, help="seconds until all workers are ready")
+    bench.add_argument("--max-worker-rss", type=float, default=None, help="MB per worker")
+    bench.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    if args.workers < 1:
+        raise SystemExit("--workers must be positive")
+
+    if args.command == "run":
+        run(args)
+        return
+    report = startup_bench(args.workers, args.runs)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    over = []
+    if args.max_startup is not None and report["all_workers_ready_seconds"]["p90"] > args.max_startup:
+        over.append(f"startup {report['all_workers_ready_seconds']['p90']:.2f}s > {args.max_startup:g}s")
+    if args.max_worker_rss is not None and report["worker_rss_mb"]["max"] > args.max_worker_rss:
+        over.append(f"worker RSS {report['worker_rss_mb']['max']:.1f}MB > {args.max_worker_rss:g}MB")
+    if over:
+        raise SystemExit("Over budget: " + "; ".join(over))
+
+
+if __name__ == "__main__":
+    main()
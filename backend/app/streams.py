@@ -0,0 +1,282 @@
+"""
+Chat-completion stream decoding. The fast path sends the request on the provider's pooled
+httpx client and parses the SSE `data:` lines itself, picking out only the content and
+reasoning deltas and the usage block. The SDK path (Provider.stream_decoder = 'sdk') goes
+through openai's typed chunk objects, for providers whose streams the fast path can't read.
+
+Both yield ("content", text), ("reasoning", text) and ("usage", dict) events. With
+STREAM_RECORD_DIR set, fast-path streams are also recorded as replay fixtures (see replay.py).
+
+    python -m app.streams --chunks 20000    # per-chunk CPU cost of both decoders
+"""
+from typing import Optional
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from . import replay
+from .clients import ProviderClient
+
+STREAM_RECORD_DIR = os.getenv("STREAM_RECORD_DIR") or None
+
+# Providers differ on where they put reasoning deltas
+REASONING_FIELDS = ("reasoning_content", "reasoning")
+
+
+def usage_counts(usage: dict) -> dict:
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "input_tokens": usage.get("prompt_tokens"),
+        "output_tokens": usage.get("completion_tokens"),
+        "cached_input_tokens": details.get("cached_tokens"),
+    }
+
+
+class PhaseTrace:
+    """
+    httpcore trace hook recording when each connection and request phase completed.
+    DNS resolution happens inside connect_tcp, so it is part of the connect time.
+    """
+
+    def __init__(self):
+        self.at = {}
+
+    async def __call__(self, event_name: str, info: dict):
+        # e.g. 'connection.connect_tcp.started', 'http11.receive_response_headers.complete'
+        self.at[event_name.split(".", 1)[1]] = time.perf_counter()
+
+    def span(self, phase: str):
+        started, complete = self.at.get(f"{phase}.started"), self.at.get(f"{phase}.complete")
+        return complete - started if started is not None and complete is not None else None
+
+    def phases(self, start: float, first_byte_at) -> dict:
+        """Durations and offsets from `start` (perf_counter when the request was issued), seconds."""
+        def offset(at):
+            return at - start if at is not None else None
+        connect = self.span("connect_tcp")
+        return {
+            "connect_time": connect,
+            "tls_time": self.span("start_tls"),
+            "connection_reused": connect is None,
+            "time_to_request_sent": offset(self.at.get("send_request_body.complete") or self.at.get("send_request_headers.complete")),
+            "time_to_headers": offset(self.at.get("receive_response_headers.complete")),
+            "time_to_first_byte": offset(first_byte_at),
+        }
+
+
+class RawStream:
+    """SSE decoder over a streaming httpx response."""
+
+    def __init__(self, response: httpx.Response, trace: PhaseTrace = None, recording: Optional[replay.Recording] = None):
+        self.response = response
+        self.trace = trace
+        self.recording = recording
+        self.first_byte_at = None
+
+    def phases(self, start: float) -> dict:
+        return self.trace.phases(start, self.first_byte_at) if self.trace else {}
+
+    async def events(self):
+        data = [] # data lines of the event being read; an event ends at a blank line
+        done = False
+        async for line in self.response.aiter_lines():
+            if done:
+                # Read to the end of the body, so the connection goes back to the pool instead of being closed
+                continue
+            if self.first_byte_at is None:
+                self.first_byte_at = time.perf_counter()
+            if line.startswith("data:"):
+                data.append(line[6:] if line.startswith("data: ") else line[5:])
+                continue
+            if line or not data:
+                # Comments, event:/id: fields and keep-alive blank lines
+                continue
+            payload = data[0] if len(data) == 1 else "\n".join(data)
+            data = []
+            if self.recording is not None:
+                self.recording.line(payload)
+            if payload == "[DONE]":
+                done = True
+                continue
+            chunk = json.loads(payload)
+            choices = chunk.get("choices")
+            if choices:
+                delta = choices[0].get("delta")
+                if delta:
+                    content = delta.get("content")
+                    if content:
+                        yield "content", content
+                    for field in REASONING_FIELDS:
+                        reasoning = delta.get(field)
+                        if reasoning:
+                            yield "reasoning", reasoning
+                            break
+            usage = chunk.get("usage")
+            if usage:
+                yield "usage", usage_counts(usage)
+            elif chunk.get("error"):
+                # Some providers report failures mid-stream as a data event
+                error = chunk["error"]
+                message = error.get("message") if isinstance(error, dict) else str(error)
+                raise openai.APIError(message or "Upstream stream error", self.response.request, body=error)
+
+    async def close(self) -> Optional[str]:
+        """Closes the response; returns the fixture's path when the stream was recorded in full."""
+        await self.response.aclose()
+        if self.recording is not None:
+            return await asyncio.to_thread(self.recording.save)
+        return None
+
+
+class SDKStream:
+    """Decoder over the openai SDK's typed chunks, for providers the fast path doesn't handle."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def phases(self, start: float) -> dict:
+        # The SDK doesn't expose the transport, so only TTFT is known on this path
+        return {}
+
+    async def events(self):
+        async for chunk in self.stream:
+            if chunk.choices and len(chunk.choices) > 0:
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    yield "content", delta.content
+                extra = delta.model_extra or {}
+                for field in REASONING_FIELDS:
+                    if extra.get(field):
+                        yield "reasoning", extra[field]
+                        break
+
+            chunk_dict = chunk.model_dump() if hasattr(chunk, 'model_dump') else chunk.dict() if hasattr(chunk, 'dict') else getattr(chunk, '__dict__', {})
+            # Also check model_extra in case it's in extra fields
+            if hasattr(chunk, 'model_extra') and chunk.model_extra:
+                chunk_dict.update(chunk.model_extra)
+
+            usage = chunk_dict.get('usage')
+            if usage:
+                yield "usage", usage_counts(usage)
+
+    async def close(self):
+        await self.stream.close()
+
+
+async def open_raw(http: httpx.AsyncClient, base_url: str, payload: dict, record_dir: Optional[str] = None) -> RawStream:
+    trace = PhaseTrace()
+    request = http.build_request("POST", f"{base_url.rstrip('/')}/chat/completions", json=payload, extensions={"trace": trace})
+    recording = replay.Recording(record_dir, payload["model"], payload["messages"], time.perf_counter()) if record_dir else None
+    # Errors are raised as the SDK's exceptions so ratelimit.retry_delay treats both paths alike
+    try:
+        response = await http.send(request, stream=True)
+    except httpx.TimeoutException:
+        raise openai.APITimeoutError(request=request)
+    except httpx.TransportError as e:
+        raise openai.APIConnectionError(message=str(e) or "Connection error.", request=request)
+    if response.status_code >= 400:
+        await response.aread()
+        await response.aclose()
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        raise openai.APIStatusError(f"Error code: {response.status_code} - {body}", response=response, body=body)
+    if recording is not None:
+        recording.headers()
+    return RawStream(response, trace, recording)
+
+
+async def open_stream(client: ProviderClient, provider_info: dict, model_name: str, messages: list, params: dict,
+                      record_dir: Optional[str] = STREAM_RECORD_DIR):
+    """Sends the chat completion request and returns a RawStream or SDKStream to read it from."""
+    if provider_info.get("stream_decoder") == "sdk":
+        stream = await client.openai.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            stream=True,
+            **params,
+            extra_body={"stream_options": {"include_usage": True}}
+        )
+        return SDKStream(stream)
+    payload = {
+        "model": model_name,
+        "messages": messages,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+        **params,
+    }
+    return await open_raw(client.http, provider_info["base_url"], payload, record_dir)
+
+
+# --- Micro-benchmark ---
+
+def synthetic_stream(chunks: int) -> bytes:
+    lines = []
+    for i in range(chunks):
+        chunk = {
+            "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+            "choices": [{"index": 0, "delta": {"content": f"tok{i} "}, "finish_reason": None}],
+        }
+        lines.append(f"data: {json.dumps(chunk)}\n\n")
+    usage = {"prompt_tokens": 10, "completion_tokens": chunks, "total_tokens": chunks + 10}
+    lines.append(f"data: {json.dumps({'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'bench', 'choices': [], 'usage': usage})}\n\n")
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode()
+
+async def consume(stream, quadratic: bool) -> int:
+    # quadratic=True reproduces the previous hot loop: string concatenation per chunk
+    if quadratic:
+        content = ""
+        async for kind, value in stream.events():
+            if kind == "content":
+                content += value
+        return len(content)
+    parts = []
+    async for kind, value in stream.events():
+        if kind == "content":
+            parts.append(value)
+    return len("".join(parts))
+
+async def benchmark(chunks: int, rounds: int) -> dict:
+    body = synthetic_stream(chunks)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body))
+    http = httpx.AsyncClient(transport=transport)
+    client = ProviderClient(fingerprint=(), http=http, openai=AsyncOpenAI(api_key="bench", base_url="http://bench/v1", http_client=http, max_retries=0))
+    messages = [{"role": "user", "content": "hi"}]
+    results = {}
+    try:
+        for decoder in ("sdk", "fast"):
+            info = {"base_url": "http://bench/v1", "stream_decoder": decoder}
+            best = None
+            for _ in range(rounds):
+                start = time.process_time()
+                stream = await open_stream(client, info, "bench", messages, {})
+                await consume(stream, quadratic=decoder == "sdk")
+                await stream.close()
+                elapsed = time.process_time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[decoder] = best / chunks
+    finally:
+        await http.aclose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5, help="best of this many runs is reported")
+    args = parser.parse_args()
+    results = asyncio.run(benchmark(args.chunks, args.rounds))
+    for decoder, per_chunk in results.items():
+        label = "sdk (typed chunks, model_dump, str +=)" if decoder == "sdk" else "fast (raw SSE, list buffer)"
+        print(f"{label:<42} {per_chunk * 1e6:8.2f} us/chunk CPU")
+    print(f"{'speedup':<42} {results['sdk'] / results['fast']:8.2f}x")
+
+if __name__ == "__main__":
+    main()
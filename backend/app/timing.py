@@ -0,0 +1,57 @@
+import math
+from array import array
+from typing import List, Optional
+
+# Timelines are stored as float32 deltas in seconds: 4 bytes per chunk,
+# microsecond-level precision for gaps well beyond any realistic stall.
+TIMELINE_TYPECODE = "f"
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    # Linear interpolation between closest ranks, p in [0, 100]
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    if lo == hi:
+        return ordered[lo]
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def distribution(values: List[float]) -> dict:
+    return {
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values) if values else None,
+    }
+
+
+def pack_timeline(offsets: List[float]) -> bytes:
+    """Delta-encodes chunk arrival offsets (seconds since request start) into a float32 blob."""
+    deltas = array(TIMELINE_TYPECODE, (b - a for a, b in zip([0.0] + offsets, offsets)))
+    return deltas.tobytes()
+
+
+def unpack_timeline(blob: Optional[bytes]) -> List[float]:
+    """Inverse of pack_timeline: arrival offsets in seconds since request start."""
+    if not blob:
+        return []
+    deltas = array(TIMELINE_TYPECODE)
+    deltas.frombytes(blob)
+    offsets, total = [], 0.0
+    for d in deltas:
+        total += d
+        offsets.append(total)
+    return offsets
+
+
+def timeline_stats(offsets: List[float], total_latency: Optional[float] = None) -> dict:
+    gaps = [b - a for a, b in zip(offsets, offsets[1:])]
+    return {
+        "total_latency": total_latency if total_latency is not None else (offsets[-1] if offsets else None),
+        "itl_p50": percentile(gaps, 50),
+        "itl_p99": percentile(gaps, 99),
+        "max_stall": max(gaps) if gaps else None,
+    }
@@ -0,0 +1,104 @@
+"""
+Token counts and per-model context budgets.
+
+Counts come from tiktoken's TOKENIZER_ENCODING. The Docker image fetches its BPE file at build
+time into TIKTOKEN_CACHE_DIR, so nothing is downloaded at runtime; the encoding is loaded in
+the background at startup. Until it is loaded, or when it isn't available, counts come from
+a dependency-free approximation of the same pre-tokenization. Neither is every provider's own
+tokenizer, so budgets should leave some headroom.
+
+Counts are memoized per distinct text, so assembling a long conversation's context again on
+the next turn only tokenizes the turns that are new.
+
+A model's input budget is its max_input_tokens, capped by its context_window less
+CONTEXT_OUTPUT_RESERVE for the reply. fit_history keeps the system prompt and the new user
+message, and leaves out the oldest exchanges of the history until the rest fits.
+"""
+from typing import List, Optional, Tuple
+import asyncio
+import logging
+import math
+import os
+import re
+
+from .lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+TOKEN_CACHE_ENTRIES = int(os.getenv("TOKEN_CACHE_ENTRIES", "100000"))
+CONTEXT_OUTPUT_RESERVE = int(os.getenv("CONTEXT_OUTPUT_RESERVE", "4096")) # tokens kept free for the reply
+MESSAGE_OVERHEAD = 4 # role and separators of a chat message
+REPLY_OVERHEAD = 3 # start of the assistant's reply
+
+# Short words with their leading space, digit groups of three, single symbols and CJK characters,
+# whitespace runs: close to BPE counts on prose and code, and on the high side elsewhere
+APPROXIMATION = re.compile(r"\s?[A-Za-z]{1,6}|\d{1,3}|\s+|[^\sA-Za-z\d]")
+
+memo = LRUCache(TOKEN_CACHE_ENTRIES, TOKEN_CACHE_ENTRIES, math.inf)
+_encoding = None
+
+
+def load():
+    """Loads the tiktoken encoding; blocking, and slow when its BPE file isn't cached locally."""
+    global _encoding
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning("Tokenizer %s unavailable, counting tokens approximately: %s", TOKENIZER_ENCODING, e)
+        return
+    # Counts memoized so far came from the approximation
+    memo.clear()
+
+
+async def startup():
+    asyncio.get_running_loop().run_in_executor(None, load)
+
+
+def count(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    # str caches its hash, so a turn loaded from the content store's LRU isn't rehashed on every
+    # request; a 64-bit collision among the memo's entries is too unlikely to matter for budgets
+    key = hash(text)
+    tokens = memo.get(key)
+    if tokens is None:
+        if _encoding is not None:
+            tokens = len(_encoding.encode(text, disallowed_special=()))
+        else:
+            tokens = len(APPROXIMATION.findall(text))
+        memo.put(key, tokens, 1)
+    return tokens
+
+
+def count_messages(messages: List[dict]) -> int:
+    return sum(count(str(m.get("content") or "")) + MESSAGE_OVERHEAD for m in messages) + REPLY_OVERHEAD
+
+
+def input_budget(context_window: Optional[int], max_input_tokens: Optional[int]) -> Optional[int]:
+    """Tokens a model's request may use, None when the model has no limit set."""
+    limits = []
+    if max_input_tokens:
+        limits.append(max_input_tokens)
+    if context_window:
+        limits.append(context_window - min(CONTEXT_OUTPUT_RESERVE, context_window // 4))
+    return min(limits) if limits else None
+
+
+def fit_history(sys_prompt: str, history: List[dict], user_msg: str, budget: Optional[int]) -> Tuple[List[dict], int]:
+    """The most recent part of `history` that fits the budget, and how many messages were left out."""
+    if budget is None:
+        return history, 0
+    total = count_messages([{"content": sys_prompt}, {"content": user_msg}])
+    costs = [count(m["content"]) + MESSAGE_OVERHEAD for m in history]
+    total += sum(costs)
+    start = 0
+    while total > budget and start < len(history):
+        # Whole exchanges go, so what is kept still starts with a user turn
+        total -= costs[start]
+        start += 1
+        while start < len(history) and history[start]["role"] != "user":
+            total -= costs[start]
+            start += 1
+    return history[start:], start
@@ -0,0 +1,95 @@
+"""
+Fixtures for the backend tests. They run on SQLite, a fresh database per test, and talk to
+app.mock_server served in-process instead of a real provider:
+
+    cd backend && python -m pytest -q
+
+Async tests use anyio's pytest plugin (installed with FastAPI): mark them with
+@pytest.mark.anyio.
+"""
+import os
+import socket
+import tempfile
+import threading
+import time
+
+# Read by app.database and the background workers at import
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="llm-evaluator-tests-"), "default.db"))
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+# SQLite ignores SKIP LOCKED, so more than one job worker would run the same job
+os.environ.setdefault("JOB_WORKERS", "1")
+os.environ.setdefault("JOB_POLL_INTERVAL", "0.05")
+os.environ.setdefault("EVALUATION_POLL_INTERVAL", "0.05")
+
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+
+from app import database, mock_server
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def database_url(tmp_path, monkeypatch):
+    """Points app.database at an empty SQLite file for the test."""
+    url = f"sqlite+aiosqlite:///{tmp_path / 'test.db'}"
+    monkeypatch.setattr(database, "ASYNC_DATABASE_URL", url)
+    monkeypatch.setattr(database, "engine", None)
+    return url
+
+
+@pytest.fixture
+async def db(database_url):
+    await database.init_models()
+    try:
+        async with database.AsyncSessionLocal() as session:
+            yield session
+    finally:
+        await database.dispose_engine()
+
+
+@pytest.fixture
+def client(database_url):
+    """The app with its lifespan run: tables created, job and evaluation workers started."""
+    from app.main import app
+
+    with TestClient(app) as c:
+        yield c
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(config: mock_server.MockConfig):
+    """Runs the mock provider on a free port in a thread; yields its base URL."""
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(mock_server.create_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Mock provider didn't start")
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture(scope="session")
+def upstream():
+    """Base URL of a mock OpenAI-compatible provider that answers quickly and predictably."""
+    yield from serve(mock_server.MockConfig(ttft=0.01, tps=2000, output_tokens=5, jitter=0, error_rate=0, models="m1,m2"))
+
+
+@pytest.fixture(scope="session")
+def slow_upstream():
+    """A mock provider slow enough to miss deadlines or be cancelled mid-stream: 0.2s to the first of 40 tokens at 20/s."""
+    yield from serve(mock_server.MockConfig(ttft=0.2, tps=20, output_tokens=40, jitter=0, error_rate=0, models="slow"))
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app import analytics, models
+
+UTC = timezone.utc
+
+
+def test_hour_buckets_are_utc():
+    at = datetime(2024, 5, 1, 10, 30, tzinfo=timezone(timedelta(hours=2)))
+    assert analytics.hour_bucket(at) == datetime(2024, 5, 1, 8, tzinfo=UTC)
+    assert analytics.next_hour_bucket(at) == datetime(2024, 5, 1, 9, tzinfo=UTC)
+    on_the_hour = datetime(2024, 5, 1, 9, tzinfo=UTC)
+    assert analytics.next_hour_bucket(on_the_hour) == on_the_hour
+
+
+class RecordingSession:
+    """Stands in for a Postgres session: keeps the statements instead of running them."""
+
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, statement):
+        self.statements.append(statement.compile(dialect=postgresql.dialect()))
+        return SimpleNamespace(rowcount=0)
+
+    async def commit(self):
+        pass
+
+
+@pytest.mark.anyio
+async def test_rebuild_covers_whole_utc_hours():
+    db = RecordingSession()
+    start = datetime(2024, 5, 1, 8, 45, tzinfo=UTC)
+    end = datetime(2024, 5, 1, 10, 30, tzinfo=UTC)
+    await analytics.rebuild_rollups(db, start, end)
+    cleanup, rebuild = db.statements
+    bounds = [datetime(2024, 5, 1, 8, tzinfo=UTC), datetime(2024, 5, 1, 11, tzinfo=UTC)]
+    # The buckets deleted and the raw rows counted again span the same hours
+    assert sorted(v for v in cleanup.params.values() if isinstance(v, datetime)) == bounds
+    assert sorted(v for v in rebuild.params.values() if isinstance(v, datetime)) == bounds
+    assert "date_trunc" in str(rebuild) and "UTC" in rebuild.params.values()
+    # A bucket recreated by a concurrent upsert is overwritten rather than failing the rebuild
+    assert "ON CONFLICT (model_id, bucket_start) DO UPDATE SET generations = excluded.generations" in str(rebuild)
+
+
+@pytest.mark.anyio
+async def test_record_generations_merges_results_into_hourly_rows(db):
+    provider = models.Provider(name="p", base_url="http://upstream", api_key="k")
+    db.add(provider)
+    await db.flush()
+    model = models.Model(provider_id=provider.id, model_id="m", name="m")
+    db.add(model)
+    await db.flush()
+    at = datetime(2024, 5, 1, 10, 30, tzinfo=UTC)
+    ok = {"model_id": model.id, "success": True, "ttft": 0.2, "tps": 40.0, "input_tokens": 10, "output_tokens": 20}
+    failed = {"model_id": model.id, "success": False, "ttft": None, "tps": 0, "input_tokens": 10, "output_tokens": 0}
+    cached = {**ok, "cache_hit": True}
+    await analytics.record_generations(db, [ok, failed, cached], at)
+    await analytics.record_generations(db, [ok], at + timedelta(minutes=10))
+    await db.commit()
+
+    rollup = (await db.scalars(select(models.ModelPerfRollup))).one()
+    assert (rollup.generations, rollup.errors, rollup.ttft_count, rollup.tps_count) == (3, 1, 2, 2)
+    assert rollup.ttft_sum == pytest.approx(0.4)
+    assert (rollup.input_tokens, rollup.output_tokens) == (30, 40)
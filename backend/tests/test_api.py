@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from app import api, models
+
+
+@pytest.mark.anyio
+async def test_conversation_summaries_page_newest_first(db):
+    # Timestamps written by the ORM: SQLite's own CURRENT_TIMESTAMP text doesn't compare with bound datetimes
+    at = [datetime(2024, 1, d, tzinfo=timezone.utc) for d in (1, 2, 2, 2, 3)]
+    conversations = [models.Conversation(title=f"c{i}", created_at=created_at) for i, created_at in enumerate(at)]
+    db.add_all(conversations)
+    await db.flush()
+    db.add(models.Message(conversation_id=conversations[0].id, role="user", seq=1, legacy_content="hi"))
+    await db.commit()
+    ids = [conv.id for conv in conversations]
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = await api.read_conversation_summaries(cursor, 2, db)
+        seen += page.items
+        pages += 1
+        if not (cursor := page.next_cursor):
+            break
+    # Ties on created_at are broken by id, so nothing is skipped or repeated
+    assert [c.id for c in seen] == [ids[4], ids[3], ids[2], ids[1], ids[0]]
+    assert pages == 3
+    assert [c.message_count for c in seen] == [0, 0, 0, 0, 1]
+    with pytest.raises(HTTPException):
+        await api.read_conversation_summaries("not a cursor", 2, db)
+
+
+def test_messages_load_a_page_at_a_time(client):
+    conv = client.post("/api/conversations/", json={"title": "t", "system_prompt": "s"}).json()
+    for i in range(5):
+        client.post("/api/messages/", json={"conversation_id": conv["id"], "role": "user", "content": f"m{i}"})
+
+    latest = client.get(f"/api/conversations/{conv['id']}", params={"message_limit": 2}).json()
+    assert [m["content"] for m in latest["messages"]] == ["m3", "m4"] and latest["has_more_messages"]
+    older = client.get(f"/api/conversations/{conv['id']}/messages",
+                       params={"before_seq": latest["messages"][0]["seq"], "limit": 2}).json()
+    assert [m["content"] for m in older["items"]] == ["m1", "m2"] and older["has_more"]
+    newer = client.get(f"/api/conversations/{conv['id']}/messages", params={"after_seq": 3, "limit": 5}).json()
+    assert [m["content"] for m in newer["items"]] == ["m3", "m4"] and not newer["has_more"]
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app import branches, models
+
+Message = models.Message
+AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+async def conversation(db, *rows) -> models.Conversation:
+    """A conversation with (id, role, seconds after AT) messages, written without parents."""
+    provider = models.Provider(name="p", base_url="http://upstream", api_key="k")
+    db.add(provider)
+    await db.flush()
+    model = models.Model(provider_id=provider.id, model_id="m", name="m")
+    conv = models.Conversation(title="t")
+    db.add_all([model, conv])
+    await db.flush()
+    db.add_all([
+        Message(id=id, conversation_id=conv.id, role=role, model_id=model.id if role == "assistant" else None,
+                legacy_content=role, created_at=AT + timedelta(seconds=s))
+        for id, role, s in rows
+    ])
+    await db.commit()
+    return conv
+
+
+async def parents(db) -> list:
+    return [tuple(row) for row in (await db.execute(select(Message.id, Message.parent_id).order_by(Message.created_at))).all()]
+
+
+@pytest.mark.anyio
+async def test_legacy_conversation_is_linked_in_write_order(db):
+    # Rows from before seq existed: seq is NULL and ids don't follow write order
+    conv = await conversation(db, (1, "user", 0), (2, "assistant", 1), (4, "user", 2), (3, "assistant", 3))
+    assert await branches.ensure_linked(db, conv) == 4
+    await db.commit()
+    assert await parents(db) == [(1, None), (2, 1), (4, 1), (3, 4)]
+    # Linked once; the head is kept from then on
+    assert await branches.ensure_linked(db, conv) == 4
+
+
+@pytest.mark.anyio
+async def test_conversation_without_user_messages_is_left_alone(db):
+    conv = await conversation(db, (1, "assistant", 0), (2, "assistant", 1))
+    assert await branches.link_legacy(db, conv) is None
+    assert await parents(db) == [(1, None), (2, None)]
+
+
+@pytest.mark.anyio
+async def test_activating_an_older_branch_moves_the_head(db):
+    conv = await conversation(db, (1, "user", 0), (2, "assistant", 1), (3, "user", 2), (4, "assistant", 3))
+    await branches.ensure_linked(db, conv)
+    # An edit of the first question starts a second branch from the root
+    edit = Message(id=5, conversation_id=conv.id, role="user", seq=5, legacy_content="edited", created_at=AT + timedelta(seconds=4))
+    db.add(edit)
+    conv.head_id = edit.id
+    await db.flush()
+    for message in await db.scalars(select(Message).where(Message.id < 5)):
+        message.seq = message.id
+    await db.commit()
+
+    await branches.activate(db, conv, await db.get(Message, 2))
+    # Back on the first branch, at its latest question
+    assert conv.head_id == 3
+    visible = (await db.scalars(select(Message.id).where(branches.on_branch(conv.head_id)).order_by(Message.seq))).all()
+    assert visible == [1, 2, 3, 4]
+
+    annotated = await branches.annotate(db, conv.id, [await db.get(Message, 1)])
+    assert annotated[0].branch_ids == [1, 5]
+
+
+@pytest.mark.anyio
+async def test_activating_a_reply_deactivates_its_siblings(db):
+    conv = await conversation(db, (1, "user", 0), (2, "assistant", 1), (3, "assistant", 2))
+    await branches.ensure_linked(db, conv)
+    await db.commit()
+    # Regenerated: the older reply is the inactive one
+    (await db.get(Message, 2)).active = False
+    await db.commit()
+
+    await branches.activate(db, conv, await db.get(Message, 2))
+    await db.commit()
+    assert (await db.scalars(select(Message.id).where(Message.active.is_(True)).order_by(Message.id))).all() == [1, 2]
+    assert conv.head_id == 1
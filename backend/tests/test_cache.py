@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+from app import cache, models
+from app.lru import LRUCache
+
+from test_chat import setup_conversation
+
+
+def test_keys_ignore_ordering_and_trailing_slashes():
+    messages = [{"role": "user", "content": "hi"}]
+    key = cache.cache_key("http://upstream/v1/", "m", messages, {"temperature": 0, "seed": 1})
+    assert key == cache.cache_key("http://upstream/v1", "m", messages, {"seed": 1, "temperature": 0})
+    assert key != cache.cache_key("http://upstream/v1", "m", messages, {"seed": 2, "temperature": 0})
+    assert key != cache.cache_key("http://other/v1", "m", messages, {"seed": 1, "temperature": 0})
+
+
+def test_lru_is_bounded_by_entries_bytes_and_age(monkeypatch):
+    lru = LRUCache(max_entries=2, max_bytes=10, ttl=60)
+    lru.put("a", {"v": "a"}, 4)
+    lru.put("b", {"v": "b"}, 4)
+    lru.get("a")
+    lru.put("c", {"v": "c"}, 4)
+    # b was the least recently used
+    assert (lru.get("a"), lru.get("b"), lru.get("c")) == ({"v": "a"}, None, {"v": "c"})
+    lru.put("big", {"v": "big"}, 8)
+    assert lru.size == 8 and lru.get("a") is None
+    lru.put("too big", {}, 11)
+    assert lru.get("too big") is None
+    lru.put("short", {"v": "short"}, 1, ttl=-1)
+    assert lru.get("short") is None
+
+
+@pytest.mark.anyio
+async def test_entries_outlive_the_memory_cache(db, monkeypatch):
+    monkeypatch.setattr(cache, "memory", LRUCache(10, 1000, 60))
+    await cache.store("k", {"content": "cached", "input_tokens": 3, "output_tokens": 1, "ttft": 0.2})
+    cache.memory.clear()
+
+    assert await cache.lookup("k") == {"content": "cached", "input_tokens": 3, "output_tokens": 1, "cached_input_tokens": None}
+    assert cache.memory.get("k") is not None
+    assert await db.scalar(select(models.ResponseCacheEntry.hits)) == 1
+
+    cache.memory.clear()
+    await db.execute(update(models.ResponseCacheEntry).values(expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+    await db.commit()
+    assert await cache.lookup("k") is None
+
+
+@pytest.mark.anyio
+async def test_prune_drops_expired_then_least_recently_used(db, monkeypatch):
+    monkeypatch.setattr(cache, "RESPONSE_CACHE_DB_MAX_ENTRIES", 2)
+    now = datetime.now(timezone.utc)
+    db.add_all([
+        models.ResponseCacheEntry(key=key, content="", size_bytes=0, created_at=now, last_hit_at=now + timedelta(seconds=i),
+                                  expires_at=now + timedelta(seconds=-1 if key == "expired" else 60))
+        for i, key in enumerate(["expired", "oldest", "older", "newest", "newer"])
+    ])
+    await db.commit()
+    assert await cache.prune(db) == 3
+    assert sorted((await db.scalars(select(models.ResponseCacheEntry.key))).all()) == ["newer", "newest"]
+
+
+def test_identical_requests_are_answered_from_the_cache(client, upstream, monkeypatch):
+    monkeypatch.setattr(cache, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(cache, "memory", LRUCache(10, 10_000, 60))
+    _, model_ids = setup_conversation(client, upstream)
+    replies = []
+    for bypass in (False, False, True):
+        # A new conversation each time, so the requests are identical
+        conv = client.post("/api/conversations/", json={"title": "t", "system_prompt": "s"}).json()
+        replies.append(client.post("/api/chat/", json={
+            "conversation_id": conv["id"], "models_to_use": model_ids[:1], "system_prompt": "s", "message": "hi",
+            "bypass_cache": bypass,
+        }).json()[1])
+    assert [reply["generation_metadata"][0]["cache_hit"] for reply in replies] == [False, True, False]
+    assert replies[1]["content"] == replies[0]["content"]
+    assert client.delete("/api/cache/").json()["removed"] == 1
@@ -0,0 +1,17 @@
+def test_sync_fetches_conditionally(client, upstream):
+    provider = client.post("/api/providers/", json={"name": "mock", "base_url": upstream, "api_key": "k"}).json()
+    first = client.post(f"/api/providers/{provider['id']}/sync_models").json()
+    assert (first["catalog"], first["added"]) == ("synced", 2)
+    # The mock answers If-None-Match with 304
+    assert client.post(f"/api/providers/{provider['id']}/sync_models").json()["catalog"] == "not_modified"
+    forced = client.post(f"/api/providers/{provider['id']}/sync_models?force=true").json()
+    assert (forced["catalog"], forced["added"]) == ("synced", 0)
+    assert sorted(m["model_id"] for m in client.get("/api/models/").json()) == ["m1", "m2"]
+
+
+def test_sync_all_reports_unreachable_providers(client, upstream):
+    client.post("/api/providers/", json={"name": "mock", "base_url": upstream, "api_key": "k"})
+    client.post("/api/providers/", json={"name": "down", "base_url": "http://127.0.0.1:9/v1", "api_key": "k"})
+    result = client.post("/api/providers/sync_models").json()
+    assert result["added"] == 2
+    assert [p["status"] for p in result["providers"]] == ["synced", "error"]
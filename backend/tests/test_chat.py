@@ -0,0 +1,142 @@
+import asyncio
+import json
+
+import pytest
+
+from app import chat
+
+
+def sse_events(body: str) -> list:
+    events = []
+    for frame in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in frame.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def setup_conversation(client, upstream) -> tuple:
+    provider = client.post("/api/providers/", json={"name": "mock", "base_url": upstream, "api_key": "k"}).json()
+    client.post(f"/api/providers/{provider['id']}/sync_models")
+    model_ids = [m["id"] for m in client.get("/api/models/").json()]
+    conv = client.post("/api/conversations/", json={"title": "t", "system_prompt": "s"}).json()
+    return conv, model_ids
+
+
+def test_stream_sends_deltas_per_model_then_stored_replies(client, upstream):
+    conv, model_ids = setup_conversation(client, upstream)
+    body = client.post("/api/chat/stream/", json={
+        "conversation_id": conv["id"], "models_to_use": model_ids, "system_prompt": "s", "message": "hi",
+    }).text
+    events = sse_events(body)
+
+    assert events[0][0] == "user_message"
+    assert events[-1][0] == "end"
+    deltas = [data for kind, data in events if kind == "delta"]
+    results = {data["model_id"]: data["message"] for kind, data in events if kind == "result"}
+    assert set(results) == set(model_ids)
+    for model_id, message in results.items():
+        streamed = "".join(d["content"] for d in deltas if d["model_id"] == model_id)
+        assert message["content"] == streamed
+        assert message["generation_metadata"][0]["status"] == "completed"
+    # Each reply arrives once the model is done, after its own deltas
+    for model_id in model_ids:
+        last_delta = max(i for i, (kind, data) in enumerate(events) if kind == "delta" and data["model_id"] == model_id)
+        result_at = next(i for i, (kind, data) in enumerate(events) if kind == "result" and data["model_id"] == model_id)
+        assert last_delta < result_at
+
+    page = client.get(f"/api/conversations/{conv['id']}/messages").json()
+    assert [m["role"] for m in page["items"]] == ["user", "assistant", "assistant"]
+
+
+def test_non_streaming_chat_returns_the_turn(client, upstream):
+    conv, model_ids = setup_conversation(client, upstream)
+    messages = client.post("/api/chat/", json={
+        "conversation_id": conv["id"], "models_to_use": model_ids[:1], "system_prompt": "s", "message": "hi",
+    }).json()
+    assert [m["role"] for m in messages] == ["user", "assistant"]
+    assert messages[1]["content"].strip()
+
+
+class FakePolicy:
+    group_name = "group"
+
+    def __init__(self, delay: float):
+        self.hedge_delay = delay
+
+    def ranked(self) -> list:
+        return [
+            {"model_id": mid, "provider_info": {}, "model_name": f"m{mid}", "ttft_deadline": None, "total_deadline": None}
+            for mid in (1, 2)
+        ]
+
+    def delay(self, model_id: int) -> float:
+        return self.hedge_delay
+
+
+def fake_legs(monkeypatch, **behaviours):
+    """Replaces stream_llm_response; each leg (m1, m2) raises, streams, hangs until cancelled, or ends without a result."""
+
+    async def stream(model_id, sys_prompt, history, user_msg, provider_info, model_name, use_cache, generation):
+        behaviour = behaviours[model_name]
+        if behaviour == "raise":
+            raise RuntimeError(f"{model_name} unreachable")
+        if behaviour == "stream":
+            await asyncio.sleep(0.01)
+            yield "content", "hi"
+            yield "result", {**chat.error_result(model_id, ""), "success": True, "status": "completed", "content": "hi"}
+        while behaviour == "hang" and not generation.cancel_requested:
+            await asyncio.sleep(0.01)
+
+    monkeypatch.setattr(chat, "stream_llm_response", stream)
+
+
+async def hedged(delay: float = 0.01) -> list:
+    generation = chat.Generation(7, hedge=FakePolicy(delay))
+    return [item async for item in chat.stream_hedged(7, "s", [], "hi", False, generation)]
+
+
+@pytest.mark.anyio
+async def test_hedged_generation_reports_the_last_failure(monkeypatch):
+    fake_legs(monkeypatch, m1="raise", m2="raise")
+    # The primary failing fires the hedge straight away rather than after the delay
+    [(kind, res)] = await hedged(delay=10)
+    assert kind == "result"
+    assert (res["model_id"], res["served_model_id"], res["hedged"], res["success"]) == (7, 2, True, False)
+    assert res["content"] == "Error: m2 unreachable"
+
+
+@pytest.mark.anyio
+async def test_hedged_generation_streams_the_leg_that_answers(monkeypatch):
+    fake_legs(monkeypatch, m1="hang", m2="stream")
+    items = await hedged()
+    assert items[0] == ("content", "hi")
+    kind, res = items[-1]
+    assert (res["model_id"], res["served_model_id"], res["hedged"], res["success"]) == (7, 2, True, True)
+
+
+@pytest.mark.anyio
+async def test_hedged_generation_without_any_result_still_gets_one(monkeypatch):
+    fake_legs(monkeypatch, m1="silent", m2="silent")
+    [(kind, res)] = await hedged()
+    assert (res["model_id"], res["served_model_id"], res["success"]) == (7, 1, False)
+    assert res["content"] == "Error: no result from the hedging group"
+
+
+@pytest.mark.anyio
+async def test_a_result_that_fails_to_store_is_reported_and_logged(monkeypatch, caplog):
+    async def stream(model_id, *args):
+        yield "delta", "hi"
+        yield "result", {"model_id": model_id, "success": True}
+
+    async def on_result(result):
+        raise RuntimeError("database is gone")
+
+    monkeypatch.setattr(chat, "stream_llm_response", stream)
+    frames = [frame async for frame in chat.multiplex_streams(1, [(5, chat.Generation(5))], on_result)]
+    events = sse_events("".join(frames))
+    assert events == [
+        ("delta", {"model_id": 5, "content": "hi"}),
+        ("error", {"model_id": 5, "detail": "database is gone"}),
+        ("end", {}),
+    ]
+    assert "Streaming model 5 failed" in caplog.text
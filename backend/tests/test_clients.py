@@ -0,0 +1,40 @@
+import pytest
+
+from app import clients
+
+
+def info(**changes) -> dict:
+    return {"id": 1, "name": "p", "api_key": "k", "base_url": "http://upstream/v1", "read_timeout": 0.01, **changes}
+
+
+@pytest.mark.anyio
+async def test_providers_keep_one_client_until_their_settings_change():
+    registry = clients.ClientRegistry()
+    try:
+        first = registry.get(info())
+        assert registry.get(info()) is first
+        assert registry.get(info(id=2)) is not first
+        assert first.http.headers["Authorization"] == "Bearer k"
+        # Limits and decoding don't change the connections, so the warm pool stays
+        assert registry.get(info(tokens_per_minute=1000, max_in_flight=2, max_retries=0, stream_decoder="sdk")) is first
+
+        changed = registry.get(info(max_connections=4))
+        assert changed is not first
+        # The old pool is closed once in-flight streams had their read timeout to finish
+        await next(iter(registry._closing))
+        assert first.http.is_closed
+    finally:
+        await registry.close()
+    assert changed.http.is_closed
+
+
+@pytest.mark.anyio
+async def test_invalidated_clients_are_rebuilt():
+    registry = clients.ClientRegistry()
+    try:
+        first = registry.get(info())
+        registry.invalidate(1)
+        assert registry.get(info()) is not first
+    finally:
+        await registry.close()
+    assert first.http.is_closed
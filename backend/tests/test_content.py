@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select, update
+
+from app import content, models
+from app.lru import LRUCache
+
+Blob = models.ContentBlob
+
+
+@pytest.fixture
+def cold(monkeypatch):
+    """An empty LRU of decoded texts for the test."""
+    monkeypatch.setattr(content, "hot", LRUCache(100, 1_000_000, float("inf")))
+    return content.hot
+
+
+def test_large_texts_are_compressed_when_that_helps():
+    small = content.encode("short")
+    assert (small["codec"], small["data"], small["size"]) == ("none", b"short", 5)
+    repetitive = "abc " * 1000
+    packed = content.encode(repetitive)
+    assert packed["codec"] == "zlib" and len(packed["data"]) < packed["size"] == 4000
+    # Below the threshold compressing isn't worth it
+    assert content.encode("a" * (content.CONTENT_COMPRESS_MIN_BYTES - 1))["codec"] == "none"
+
+
+@pytest.mark.anyio
+async def test_each_distinct_text_is_stored_once(db, cold):
+    long_text = "the same long prompt " * 100
+    hashes = await content.put_many(db, [long_text, "a", long_text, "a"])
+    await content.put_many(db, ["a"])
+    await db.commit()
+    assert hashes[0] == hashes[2] and hashes[1] == hashes[3]
+    assert await db.scalar(select(func.count()).select_from(Blob)) == 2
+
+    cold.clear()
+    # Read back from the table and decompressed, then remembered
+    assert await content.texts(db, hashes) == {hashes[0]: long_text, hashes[1]: "a"}
+    assert cold.get(hashes[0]) == long_text
+
+
+@pytest.mark.anyio
+async def test_inline_texts_are_migrated_and_unused_blobs_collected(db, cold):
+    conv = models.Conversation(title="legacy", legacy_system_prompt="old prompt")
+    db.add(conv)
+    await db.flush()
+    db.add_all([models.Message(conversation_id=conv.id, role="user", seq=i, legacy_content=f"m{i % 2}") for i in range(3)])
+    await content.put(db, "orphan")
+    await db.commit()
+
+    assert await content.migrate(batch=2) == {"messages": 3, "conversations": 1}
+    db.expire_all()
+    messages = (await db.scalars(select(models.Message).order_by(models.Message.seq))).all()
+    assert [m.legacy_content for m in messages] == [None, None, None]
+    assert (await content.texts(db, [m.content_hash for m in messages])).keys() == {content.content_hash("m0"), content.content_hash("m1")}
+
+    # Too recent to collect: a writer may be about to reference it
+    assert await content.collect_garbage(db) == 0
+    await db.execute(update(Blob).values(created_at=datetime.now(timezone.utc) - content.GC_GRACE - timedelta(minutes=1)))
+    await db.commit()
+    assert await content.collect_garbage(db) == 1
+    assert await db.scalar(select(Blob.hash).where(Blob.hash == content.content_hash("orphan"))) is None
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from app import chat, clients, models
+
+
+@pytest.fixture
+async def slow_provider(db, slow_upstream, monkeypatch):
+    """Provider info for the slow mock, with a client registry of the test's own."""
+    monkeypatch.setattr(clients, "registry", None)
+    provider = models.Provider(name="slow", base_url=slow_upstream, api_key="k")
+    db.add(provider)
+    await db.commit()
+    await db.refresh(provider)
+    yield clients.provider_info(provider)
+    await clients.get_registry().close()
+
+
+async def generate(provider_info: dict, generation: chat.Generation, cancel_after_deltas: int = None) -> tuple:
+    deltas = []
+    async for kind, payload in chat.stream_llm_response(1, "s", [], "hi", provider_info, "slow", False, generation):
+        if kind == "result":
+            return deltas, payload
+        deltas.append(payload)
+        if len(deltas) == cancel_after_deltas:
+            assert generation.cancel()
+
+
+@pytest.mark.anyio
+async def test_missing_the_ttft_deadline_times_out(slow_provider):
+    deltas, result = await generate(slow_provider, chat.Generation(1, ttft_deadline=0.05))
+    assert (deltas, result["status"], result["success"], result["content"]) == ([], "timed_out", False, "")
+
+
+@pytest.mark.anyio
+async def test_total_deadline_keeps_the_partial_output(slow_provider):
+    # Met the TTFT deadline; the total one cuts the stream short
+    deltas, result = await generate(slow_provider, chat.Generation(1, ttft_deadline=1.0, total_deadline=0.5))
+    assert result["status"] == "timed_out"
+    assert 0 < len(deltas) < 40
+    assert result["content"] == "".join(deltas) and result["ttft"] is not None
+
+
+@pytest.mark.anyio
+async def test_cancelling_mid_stream_keeps_the_partial_output(slow_provider):
+    generation = chat.Generation(1)
+    deltas, result = await generate(slow_provider, generation, cancel_after_deltas=2)
+    assert (result["status"], result["content"]) == ("cancelled", "".join(deltas))
+    assert len(deltas) == 2
+    # A second cancel has nothing left to stop
+    assert not generation.cancel()
+
+
+@pytest.mark.anyio
+async def test_cancelled_before_it_starts_never_calls_upstream(slow_provider):
+    generation = chat.Generation(1)
+    generation.cancel()
+    started = asyncio.get_running_loop().time()
+    deltas, result = await generate(slow_provider, generation)
+    assert (deltas, result["status"], result["ttft"]) == ([], "cancelled", None)
+    assert asyncio.get_running_loop().time() - started < 0.2
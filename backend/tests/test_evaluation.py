@@ -0,0 +1,154 @@
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app import evaluation, jobs, models
+
+Run = models.EvaluationRun
+
+
+def test_dataset_lines_are_strings_or_objects():
+    dataset = '"plain"\n\n{"id": 3, "prompt": "field"}\n{"request_id": "r1", "title": "T", "body": "B"}\n'
+    assert evaluation.parse_dataset(dataset) == [
+        {"index": 1, "key": None, "prompt": "plain"},
+        {"index": 3, "key": "3", "prompt": "field"},
+        {"index": 4, "key": "r1", "prompt": "T\n\nB"},
+    ]
+    assert evaluation.parse_dataset('{"q": "x", "prompt": "y"}', prompt_field="q")[0]["prompt"] == "x"
+
+
+@pytest.mark.parametrize("dataset, error", [
+    ('"ok"\n{broken', "Line 2: invalid JSON"),
+    ("[1, 2]", "Line 1: expected a string or an object"),
+    ('{"answer": "no prompt"}', "Line 1: no prompt field found"),
+])
+def test_dataset_errors_name_the_line(dataset, error):
+    with pytest.raises(ValueError, match=error):
+        evaluation.parse_dataset(dataset)
+
+
+async def add_run(db, name: str, **fields) -> int:
+    conv = models.Conversation(title=name)
+    db.add(conv)
+    await db.flush()
+    run = Run(name=name, conversation_id=conv.id, **{"status": "pending", **fields})
+    db.add(run)
+    await db.flush()
+    run_id = run.id
+    await db.commit()
+    return run_id
+
+
+async def statuses(db) -> dict:
+    db.expire_all()
+    return {run.name: (run.status, run.worker_id) for run in (await db.scalars(select(Run))).all()}
+
+
+@pytest.mark.anyio
+async def test_runs_are_claimed_once(db):
+    now = datetime.now(timezone.utc)
+    await add_run(db, "cancelled before it started", cancel_requested=True)
+    await add_run(db, "alive elsewhere", status="running", worker_id="elsewhere", heartbeat_at=now)
+    await add_run(db, "pending")
+    await add_run(db, "abandoned", status="running", worker_id="gone", heartbeat_at=now - timedelta(seconds=evaluation.STALE_AFTER + 1))
+
+    claimed = [await evaluation.claim_run(db), await evaluation.claim_run(db)]
+    assert await evaluation.claim_run(db) is None
+    assert len(set(claimed)) == 2
+    assert await statuses(db) == {
+        "cancelled before it started": ("cancelled", None),
+        "alive elsewhere": ("running", "elsewhere"),
+        "pending": ("running", jobs.WORKER_ID),
+        "abandoned": ("running", jobs.WORKER_ID),
+    }
+
+
+@pytest.mark.anyio
+async def test_heartbeat_stops_runs_that_are_cancelled_or_taken_over(db, monkeypatch):
+    monkeypatch.setattr(evaluation, "HEARTBEAT_INTERVAL", 0.01)
+    mine = await add_run(db, "mine", status="running", worker_id=jobs.WORKER_ID, cancel_requested=True)
+    lost = await add_run(db, "lost", status="running", worker_id="elsewhere")
+    states = {mine: evaluation.ActiveRun(), lost: evaluation.ActiveRun()}
+    monkeypatch.setattr(evaluation, "active_runs", states)
+
+    beats = [asyncio.create_task(evaluation.heartbeat(run_id)) for run_id in states]
+    try:
+        while not all(state.stopping for state in states.values()):
+            await asyncio.sleep(0.01)
+    finally:
+        for beat in beats:
+            beat.cancel()
+        await asyncio.gather(*beats, return_exceptions=True)
+    assert (states[mine].stopping, states[lost].stopping) == ("cancelled", "lost")
+    db.expire_all()
+    assert (await db.get(Run, mine)).heartbeat_at is not None
+
+
+@pytest.mark.anyio
+async def test_a_saturated_provider_does_not_hold_global_slots(monkeypatch):
+    state = evaluation.ActiveRun()
+    answered = []
+
+    async def fetch(model_id, *args):
+        answered.append(model_id)
+        # Stopped once answered, so nothing is stored
+        state.stop("cancelled")
+        return {}
+
+    monkeypatch.setattr(evaluation, "fetch_llm_response", fetch)
+    run = Run(system_prompt="s", bypass_cache=False)
+    global_sem = asyncio.Semaphore(1)
+
+    def item(model_id: int, provider_sem: asyncio.Semaphore) -> asyncio.Task:
+        info = {"id": model_id, "ttft_deadline": None, "total_deadline": None, "provider": {}, "model_name": "m"}
+        return asyncio.create_task(evaluation.execute_item(run, state, model_id, "p", info, global_sem, provider_sem))
+
+    # Every slot of the first provider is taken
+    queued = item(1, asyncio.Semaphore(0))
+    await asyncio.sleep(0)
+    await asyncio.wait_for(item(2, asyncio.Semaphore(1)), 1)
+    assert answered == [2]
+    queued.cancel()
+    await asyncio.gather(queued, return_exceptions=True)
+
+
+def wait_for(client, run_id: int, *done) -> dict:
+    deadline = time.monotonic() + 10
+    while (run := client.get(f"/api/evaluations/{run_id}").json())["status"] not in done:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    return run
+
+
+def test_evaluation_runs_every_prompt_for_every_model(client, upstream):
+    provider = client.post("/api/providers/", json={"name": "mock", "base_url": upstream, "api_key": "k"}).json()
+    client.post(f"/api/providers/{provider['id']}/sync_models")
+    model_ids = [m["id"] for m in client.get("/api/models/").json()]
+    run = client.post("/api/evaluations/", json={
+        "name": "e", "models_to_use": model_ids, "dataset": '"one"\n{"prompt": "two"}\n',
+    }).json()
+    assert run["total_items"] == 4
+
+    run = wait_for(client, run["id"], "completed", "failed")
+    assert (run["status"], run["completed_items"], run["pending_items"]) == ("completed", 4, 0)
+    items = client.get(f"/api/evaluations/{run['id']}/items").json()
+    assert all(item["message"]["content"].strip() for item in items)
+
+
+def test_cancelling_a_run_owned_elsewhere_flags_it(client, database_url):
+    # Claimed by another process, heartbeating: this one leaves it alone
+    with sqlite3.connect(database_url.split("///", 1)[1]) as conn:
+        conn.execute("INSERT INTO conversations (title, next_seq) VALUES ('c', 0)")
+        conn.execute(
+            "INSERT INTO evaluation_runs (name, system_prompt, status, conversation_id, worker_id, heartbeat_at, cancel_requested,"
+            " max_concurrency, per_provider_concurrency, bypass_cache) VALUES ('e', 's', 'running', 1, 'elsewhere', ?, 0, 1, 1, 0)",
+            (datetime.now(timezone.utc).isoformat(" "),),
+        )
+    run = client.post("/api/evaluations/1/cancel").json()
+    assert (run["status"], run["cancel_requested"]) == ("running", True)
+    assert client.post("/api/evaluations/1/resume").status_code == 200
+    assert client.get("/api/evaluations/1").json()["status"] == "running"
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from sqlalchemy import select
+
+from app import export, models, persistence, timing
+
+Meta = models.GenerationMetadata
+
+
+async def exported_rows() -> list:
+    return [row async for rows in export.export_chunks(export.export_query()) for row in rows]
+
+
+def as_ndjson(rows: list) -> list:
+    return [export.parse_row(json.loads(json.dumps(row, default=export.json_default))) for row in rows]
+
+
+@pytest.mark.anyio
+async def test_round_trip_keeps_the_served_model(db):
+    primary = models.Provider(name="primary", base_url="http://primary", api_key="k")
+    backup = models.Provider(name="backup", base_url="http://backup", api_key="k")
+    db.add_all([primary, backup])
+    await db.flush()
+    requested = models.Model(provider_id=primary.id, model_id="llm", name="LLM")
+    served = models.Model(provider_id=backup.id, model_id="llm-backup", name="LLM backup")
+    db.add_all([requested, served])
+    await db.flush()
+    conv = models.Conversation(title="hedged")
+    db.add(conv)
+    await db.flush()
+    question = models.Message(conversation_id=conv.id, role="user", seq=await persistence.allocate_seq(db, conv.id), legacy_content="q")
+    db.add(question)
+    await db.flush()
+    await persistence.add_results(db, conv.id, [{
+        "model_id": requested.id, "served_model_id": served.id, "hedged": True, "content": "a",
+        "ttft": 0.2, "tps": 30.0, "output_tokens": 3, "timeline": timing.pack_timeline([0.2, 0.25, 0.3]),
+    }], question.id)
+    await db.commit()
+
+    rows = await exported_rows()
+    assert [row["role"] for row in rows] == ["user", "assistant"]
+    reply = rows[1]
+    assert (reply["model_id"], reply["provider_name"]) == ("llm", "primary")
+    assert (reply["served_model_id"], reply["served_provider_name"], reply["served_provider_base_url"]) == \
+        ("llm-backup", "backup", "http://backup")
+
+    # Into a database that knows neither provider
+    await db.execute(Meta.__table__.delete())
+    await db.execute(models.Message.__table__.delete())
+    await db.execute(models.Model.__table__.delete())
+    await db.execute(models.Provider.__table__.delete())
+    await db.commit()
+    counts = await export.import_chunks(db, [as_ndjson(rows)])
+    assert counts == {"conversations": 1, "messages": 2, "generations": 1}
+
+    meta = (await db.scalars(select(Meta))).one()
+    names = dict((await db.execute(select(models.Model.id, models.Model.model_id))).all())
+    assert (names[meta.model_id], names[meta.served_model_id], meta.hedged) == ("llm", "llm-backup", True)
+    assert timing.unpack_timeline(meta.token_timeline) == pytest.approx([0.2, 0.25, 0.3], abs=1e-5)
+    # Registered so the results have somewhere to belong, but not offered for chat
+    assert (await db.scalars(select(models.Model.enabled))).all() == [False, False]
+    reimported = await exported_rows()
+    assert reimported[1]["served_model_id"] == "llm-backup"
+    assert reimported[1]["parent_message_id"] == reimported[0]["message_id"]
+
+
+@pytest.mark.anyio
+async def test_import_fills_defaults_for_fields_an_older_file_lacks(db):
+    rows = [
+        {"conversation_id": 1, "seq": 1, "role": "user", "content": "q"},
+        {"conversation_id": 1, "seq": 2, "role": "assistant", "content": "a", "provider_name": "p", "model_id": "m",
+         "generation_id": 5, "cache_hit": None, "time_to_first_token": 0.1},
+    ]
+    assert await export.import_chunks(db, [rows]) == {"conversations": 1, "messages": 2, "generations": 1}
+
+    meta = (await db.scalars(select(Meta))).one()
+    assert (meta.cache_hit, meta.status, meta.retry_count, meta.served_model_id) == (False, "completed", 0, None)
+    assert meta.time_to_first_token == 0.1
+    assert await db.scalar(select(models.Conversation.next_seq)) == 2
+
+
+def test_import_endpoint_rejects_rows_without_required_columns(client):
+    response = client.post("/api/import/generations", content=b'{"conversation_id": 1, "role": "user"}\n')
+    assert response.status_code == 400
+    assert "Invalid ndjson export" in response.json()["detail"]
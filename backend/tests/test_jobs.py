@@ -0,0 +1,76 @@
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app import database, jobs
+
+
+@pytest.fixture
+def idle_client(monkeypatch, database_url):
+    """The app without job workers, so submitted jobs stay queued."""
+    from app.main import app
+
+    monkeypatch.setattr(jobs, "JOB_WORKERS", 0)
+    with TestClient(app) as c:
+        yield c
+
+
+def submit(client, upstream) -> int:
+    provider = client.post("/api/providers/", json={"name": "mock", "base_url": upstream, "api_key": "k"}).json()
+    client.post(f"/api/providers/{provider['id']}/sync_models")
+    model_id = client.get("/api/models/").json()[0]["id"]
+    conv = client.post("/api/conversations/", json={"title": "t", "system_prompt": "s"}).json()
+    submission = client.post("/api/jobs/chat/", json={
+        "conversation_id": conv["id"], "models_to_use": [model_id], "system_prompt": "s", "message": "hi",
+    }).json()
+    return submission["jobs"][0]["id"]
+
+
+def job_row(database_url: str, job_id: int) -> tuple:
+    with sqlite3.connect(database_url.split("///", 1)[1]) as conn:
+        return conn.execute("SELECT status, cancel_requested, finished_at FROM generation_jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def test_cancelling_a_queued_job_finishes_it(idle_client, upstream, database_url):
+    job_id = submit(idle_client, upstream)
+    job = idle_client.post(f"/api/jobs/{job_id}/cancel").json()
+    assert job["status"] == "cancelled" and job["finished_at"] is not None
+    # A second cancel finds nothing queued or running to stop
+    assert idle_client.post(f"/api/jobs/{job_id}/cancel").json()["status"] == "cancelled"
+    assert job_row(database_url, job_id)[:2] == ("cancelled", 0)
+
+
+def test_cancel_racing_a_worker_claim_flags_the_job(idle_client, upstream, database_url):
+    job_id = submit(idle_client, upstream)
+    claimed = []
+
+    def claim_after_read(conn, cursor, statement, parameters, context, executemany):
+        # A worker claims the job right after the cancel request has read it as queued
+        if not claimed and statement.startswith("SELECT") and "FROM generation_jobs" in statement:
+            claimed.append(True)
+            conn.connection.cursor().execute(
+                "UPDATE generation_jobs SET status = 'running', worker_id = 'elsewhere' WHERE id = ?", (job_id,)
+            )
+
+    engine = database.get_engine().sync_engine
+    event.listen(engine, "after_cursor_execute", claim_after_read)
+    try:
+        job = idle_client.post(f"/api/jobs/{job_id}/cancel").json()
+    finally:
+        event.remove(engine, "after_cursor_execute", claim_after_read)
+    assert claimed
+    assert job["status"] == "running"
+    assert job_row(database_url, job_id) == ("running", 1, None)
+
+
+def test_worker_runs_a_submitted_job(client, upstream):
+    job_id = submit(client, upstream)
+    deadline = time.monotonic() + 10
+    while (job := client.get(f"/api/jobs/{job_id}").json())["status"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert job["status"] == "completed"
+    assert job["message"]["content"].strip()
@@ -0,0 +1,28 @@
+import pytest
+
+from app import loadtest
+
+from test_chat import setup_conversation
+
+
+def test_summary_counts_only_successes_in_the_distributions():
+    ok = {"success": True, "ttft": 0.1, "tps": 50.0, "output_tokens": 10, "latency": 0.3, "itl": [0.01, 0.03]}
+    failed = {"success": False, "ttft": None, "tps": None, "output_tokens": 0, "latency": 5.0, "itl": []}
+    summary = loadtest.summarize(4, [ok, ok, failed, {**ok, "ttft": 0.3}], wall_time=2.0)
+    assert (summary["requests"], summary["errors"], summary["error_rate"]) == (4, 1, 0.25)
+    assert (summary["requests_per_second"], summary["aggregate_output_tps"]) == (1.5, 15.0)
+    assert summary["ttft"]["p50"] == 0.1 and summary["ttft"]["mean"] == pytest.approx(0.5 / 3)
+    assert summary["latency"]["p99"] == pytest.approx(0.3)
+    assert summary["inter_token_latency"]["p50"] == pytest.approx(0.02)
+
+
+def test_sweep_runs_each_level_against_the_model(client, upstream):
+    _, model_ids = setup_conversation(client, upstream)
+    report = client.post("/api/loadtest/", json={
+        "model_id": model_ids[0], "concurrency_levels": [1, 3], "requests_per_level": 6,
+    }).json()
+    assert report["model"] == "m1"
+    assert [(level["concurrency"], level["requests"], level["errors"]) for level in report["levels"]] == [(1, 6, 0), (3, 6, 0)]
+    assert all(level["ttft"]["p50"] > 0 and level["aggregate_output_tps"] > 0 for level in report["levels"])
+    assert client.post("/api/loadtest/", json={"model_id": model_ids[0], "concurrency_levels": [0]}).status_code == 400
+    assert client.post("/api/loadtest/", json={"model_id": 999}).status_code == 404
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+
+from app import database, metrics
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_requests_are_timed_per_route_template(client):
+    conv = client.post("/api/conversations/", json={"title": "t", "system_prompt": "s"}).json()
+    route = {"method": "GET", "route": "/api/conversations/{conversation_id}", "status": "200"}
+    before = sample("http_request_duration_seconds_count", **route)
+    client.get(f"/api/conversations/{conv['id']}")
+    assert sample("http_request_duration_seconds_count", **route) == before + 1
+    unmatched = {"method": "GET", "route": "unmatched", "status": "404"}
+    before = sample("http_request_duration_seconds_count", **unmatched)
+    client.get("/no/such/page")
+    assert sample("http_request_duration_seconds_count", **unmatched) == before + 1
+    assert "http_requests_in_progress" in client.get("/metrics").text
+
+
+def test_statement_kinds():
+    assert metrics.statement_kind("  select 1") == "SELECT"
+    assert metrics.statement_kind("WITH RECURSIVE path AS (...) SELECT") == "WITH"
+    assert metrics.statement_kind("PRAGMA foreign_keys") == "OTHER"
+    assert metrics.statement_kind("") == "OTHER"
+
+
+@pytest.mark.anyio
+async def test_database_statements_and_errors_are_counted(db):
+    metrics.instrument_engine(database.get_engine())
+    # Listening twice would count every statement twice
+    metrics.instrument_engine(database.get_engine())
+    selects, errors = sample("db_query_duration_seconds_count", statement="SELECT"), sample("db_errors_total")
+    await db.execute(text("SELECT 1"))
+    assert sample("db_query_duration_seconds_count", statement="SELECT") == selects + 1
+    with pytest.raises(Exception):
+        await db.execute(text("SELECT * FROM no_such_table"))
+    assert sample("db_errors_total") == errors + 1
+    # The failed statement's start time was dropped, so the next one is timed from its own
+    assert not (await db.connection()).sync_connection.info["query_start"]
+
+
+def test_generations_are_observed_by_outcome():
+    provider = {"name": "observed", "id": 1}
+    labels = {"provider": "observed", "model": "m"}
+    metrics.observe_generation(provider, "m", {
+        "status": "completed", "ttft": 0.5, "time_to_request_sent": 0.2, "connect_time": 0.05, "tls_time": 0.05,
+        "tps": 40.0, "total_latency": 2.0,
+    })
+    metrics.observe_generation(provider, "m", {"status": "completed", "cache_hit": True, "ttft": None})
+    assert sample("upstream_generations_total", status="completed", **labels) == 1
+    assert sample("upstream_generations_total", status="cache_hit", **labels) == 1
+    # The cache hit isn't a measurement of the provider
+    assert sample("upstream_ttft_seconds_count", **labels) == 1
+    assert sample("upstream_server_ttft_seconds_sum", **labels) == pytest.approx(0.3)
+    assert sample("upstream_connect_seconds_sum", provider="observed") == pytest.approx(0.1)
+    assert sample("upstream_tokens_per_second_sum", **labels) == 40.0
+    assert sample("upstream_generation_seconds_sum", **labels) == 2.0
+
+
+def test_profiler_is_disabled_by_default(client):
+    assert client.post("/debug/profiler/start").status_code == 404
+    assert client.get("/debug/profiler").status_code == 404
+
+
+def test_profiler_samples_the_event_loop(client, monkeypatch):
+    monkeypatch.setattr(metrics, "PROFILER_ENABLED", True)
+    assert client.post("/debug/profiler/start", params={"duration": 0}).status_code == 400
+    assert client.post("/debug/profiler/start", params={"interval": 0.001, "duration": 5}).json()["status"] == "running"
+    assert client.post("/debug/profiler/start").status_code == 409
+    for _ in range(5):
+        client.get("/api/models/")
+    stopped = client.post("/debug/profiler/stop").json()
+    assert stopped["status"] == "stopped" and stopped["samples"] > 0
+    profile = client.get("/debug/profiler")
+    assert profile.headers["X-Profile-Samples"] == str(stopped["samples"])
+    # Folded stacks: frames joined by semicolons, then the sample count
+    stack, count = profile.text.splitlines()[0].rsplit(" ", 1)
+    assert ";" in stack and int(count) > 0
+
+
+@pytest.mark.anyio
+async def test_shutdown_stops_the_profiler():
+    metrics.profiler.start(threading.get_ident(), 0.001, 30)
+    await metrics.shutdown()
+    assert not metrics.profiler.running
@@ -0,0 +1,93 @@
+import sqlite3
+
+import pytest
+from alembic.script import ScriptDirectory
+
+from app import database, migrate
+
+# The tables as create_all made them before migrations, trimmed to what the test uses
+LEGACY_SCHEMA = """
+CREATE TABLE conversations (id INTEGER PRIMARY KEY, title VARCHAR, system_prompt TEXT, created_at DATETIME);
+CREATE TABLE messages (id INTEGER PRIMARY KEY, conversation_id INTEGER REFERENCES conversations (id),
+                       role VARCHAR, content TEXT, created_at DATETIME);
+INSERT INTO conversations (id, title, system_prompt, created_at) VALUES (1, 'old', 's', '2024-01-01 00:00:00');
+INSERT INTO messages VALUES (7, 1, 'user', 'q', '2024-01-01 00:00:01');
+INSERT INTO messages VALUES (5, 1, 'assistant', 'a', '2024-01-01 00:00:02');
+"""
+
+# Rows written at the baseline, before seq and Message.model_id were filled in; ids out of time
+# order on purpose, and one reply stored after the upgrade, numbered from the counter
+UNSEQUENCED_ROWS = """
+INSERT INTO conversations (id, title, next_seq) VALUES (1, 'legacy', 1);
+INSERT INTO messages (id, conversation_id, role, content, created_at) VALUES (10, 1, 'user', 'q1', '2024-01-01 00:00:00');
+INSERT INTO messages (id, conversation_id, role, content, created_at) VALUES (12, 1, 'assistant', 'a1', '2024-01-01 00:00:01');
+INSERT INTO messages (id, conversation_id, role, content, created_at) VALUES (11, 1, 'user', 'q2', '2024-01-01 00:00:02');
+INSERT INTO messages (id, conversation_id, role, content, seq, model_id, created_at) VALUES (13, 1, 'assistant', 'r', 1, 3, '2024-01-01 00:00:03');
+INSERT INTO generation_metadata (message_id, model_id) VALUES (12, 3);
+"""
+
+
+def head() -> str:
+    return ScriptDirectory.from_config(migrate.alembic_config()).get_current_head()
+
+
+@pytest.mark.anyio
+async def test_legacy_database_is_adopted_and_stamped(database_url):
+    path = database_url.split("///", 1)[1]
+    with sqlite3.connect(path) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+    try:
+        result = await migrate.upgrade()
+        assert (result["from"], result["to"]) == (None, head())
+        assert "messages.seq" in result["adopted"] and "evaluation_runs" in result["adopted"]
+        # Already current: nothing to adopt or run the second time
+        assert await migrate.upgrade() == {"from": head(), "to": head(), "adopted": None}
+    finally:
+        await database.dispose_engine()
+
+    with sqlite3.connect(path) as conn:
+        # The sequence backfill ran: numbered in write order, counter caught up
+        assert conn.execute("SELECT id, seq FROM messages ORDER BY seq").fetchall() == [(7, 1), (5, 2)]
+        assert conn.execute("SELECT next_seq FROM conversations").fetchone() == (2,)
+        assert conn.execute("SELECT content FROM messages WHERE id = 7").fetchone() == ("q",)
+        # Revisions after the baseline ran too: 0003's columns and 0004's foreign keys
+        assert {"worker_id", "cancel_requested"} <= {r[1] for r in conn.execute("PRAGMA table_info(evaluation_runs)")}
+        assert [(r[2], r[6]) for r in conn.execute("PRAGMA foreign_key_list(evaluation_runs)")] == [("conversations", "SET NULL")]
+
+
+@pytest.mark.anyio
+async def test_database_created_at_startup_is_stamped_where_it_matches(database_url):
+    # create_all, as the development server runs it, makes the tables as the models are now
+    try:
+        await database.init_models()
+        result = await migrate.upgrade()
+    finally:
+        await database.dispose_engine()
+    # Nothing was missing, and 0003's columns weren't added a second time
+    assert (result["from"], result["to"], result["adopted"]) == (None, head(), [])
+
+
+@pytest.mark.anyio
+async def test_sequence_backfill_numbers_legacy_rows_in_write_order(database_url):
+    path = database_url.split("///", 1)[1]
+    try:
+        await migrate.upgrade(migrate.BASELINE_REVISION)
+        with sqlite3.connect(path) as conn:
+            conn.executescript(UNSEQUENCED_ROWS)
+        await migrate.upgrade()
+    finally:
+        await database.dispose_engine()
+
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT id, seq FROM messages ORDER BY seq").fetchall() == [(10, 1), (12, 2), (11, 3), (13, 4)]
+        assert conn.execute("SELECT model_id FROM messages WHERE id = 12").fetchone() == (3,)
+        assert conn.execute("SELECT next_seq FROM conversations").fetchone() == (4,)
+
+
+@pytest.mark.anyio
+async def test_empty_database_is_upgraded_through_every_revision(database_url):
+    try:
+        result = await migrate.upgrade()
+    finally:
+        await database.dispose_engine()
+    assert (result["from"], result["to"], result["adopted"]) == (None, head(), None)
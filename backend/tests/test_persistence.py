@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy import select, text, update
+
+from app import chat, models, persistence
+
+Message = models.Message
+
+
+async def add_model(db, name: str = "m") -> models.Model:
+    provider = await db.scalar(select(models.Provider).limit(1))
+    if provider is None:
+        provider = models.Provider(name="p", base_url="http://upstream", api_key="k")
+        db.add(provider)
+        await db.flush()
+    model = models.Model(provider_id=provider.id, model_id=name, name=name)
+    db.add(model)
+    await db.flush()
+    return model
+
+
+def result(model_id: int, content: str = "reply") -> dict:
+    return {"model_id": model_id, "success": True, "status": "completed", "content": content,
+            "ttft": 0.1, "tps": 10.0, "output_tokens": 1}
+
+
+@pytest.mark.anyio
+async def test_model_histories_keep_each_models_own_replies(db):
+    m1, m2 = await add_model(db, "m1"), await add_model(db, "m2")
+    conv = models.Conversation(title="t")
+    db.add(conv)
+    await db.flush()
+    question = Message(conversation_id=conv.id, role="user", seq=await persistence.allocate_seq(db, conv.id), legacy_content="q1")
+    db.add(question)
+    await db.flush()
+    await persistence.add_results(db, conv.id, [result(m1.id, "from m1"), result(m2.id, "from m2")], question.id)
+    follow_up = Message(conversation_id=conv.id, role="user", seq=await persistence.allocate_seq(db, conv.id),
+                        legacy_content="q2", parent_id=question.id)
+    db.add(follow_up)
+    await db.commit()
+
+    histories = await chat.load_model_histories(db, [m1.id, m2.id], follow_up.id)
+    assert histories[m1.id] == [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "from m1"}]
+    assert histories[m2.id] == [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "from m2"}]
+
+
+@pytest.mark.anyio
+async def test_deleting_a_conversation_keeps_its_evaluation_runs(db):
+    model = await add_model(db)
+    conv = models.Conversation(title="evaluation")
+    db.add(conv)
+    await db.flush()
+    message_ids = await persistence.add_results(db, conv.id, [result(model.id), result(model.id)])
+    pending = models.EvaluationRun(name="pending", status="pending", conversation_id=conv.id)
+    running = models.EvaluationRun(name="running", status="running", conversation_id=conv.id, worker_id="elsewhere")
+    db.add_all([pending, running])
+    await db.flush()
+    db.add_all([
+        models.EvaluationItem(run_id=running.id, prompt_index=i, prompt="p", model_id=model.id, status="completed", message_id=message_id)
+        for i, message_id in enumerate(message_ids)
+    ])
+    await db.commit()
+
+    # ON DELETE SET NULL is enforced like on Postgres; issued on the connection the delete
+    # runs on, before its transaction begins
+    await db.execute(text("PRAGMA foreign_keys = ON"))
+    assert (await db.execute(text("PRAGMA foreign_keys"))).scalar() == 1
+    await persistence.delete_conversation(db, conv.id)
+    await db.commit()
+    db.expunge_all()
+
+    assert await db.get(models.Conversation, conv.id) is None
+    assert (await db.scalars(select(Message.id))).all() == []
+    runs = {run.name: run for run in (await db.scalars(select(models.EvaluationRun))).all()}
+    assert runs["pending"].status == "cancelled" and runs["pending"].conversation_id is None
+    assert runs["running"].cancel_requested and runs["running"].conversation_id is None
+    items = (await db.scalars(select(models.EvaluationItem))).all()
+    assert [(item.status, item.message_id) for item in items] == [("completed", None), ("completed", None)]
+
+
+@pytest.mark.anyio
+async def test_catalog_delists_and_relists_without_touching_enabled(db):
+    provider = models.Provider(name="p", base_url="http://upstream", api_key="k")
+    db.add(provider)
+    await db.flush()
+
+    assert await persistence.apply_catalog(db, provider.id, ["a", "b", "c", "a", ""]) == {"added": 3, "delisted": 0, "relisted": 0}
+    await db.execute(update(models.Model).where(models.Model.model_id == "b").values(enabled=False))
+    assert await persistence.apply_catalog(db, provider.id, ["a"]) == {"added": 0, "delisted": 2, "relisted": 0}
+    # An empty listing is taken for a provider hiccup
+    assert await persistence.apply_catalog(db, provider.id, []) == {"added": 0, "delisted": 0, "relisted": 0}
+    assert await persistence.apply_catalog(db, provider.id, ["a", "b", "c"]) == {"added": 0, "delisted": 0, "relisted": 2}
+    await db.commit()
+
+    state = (await db.execute(select(models.Model.model_id, models.Model.enabled, models.Model.delisted).order_by(models.Model.model_id))).all()
+    # The user disabled b; being delisted and relisted doesn't change that
+    assert [tuple(row) for row in state] == [("a", True, False), ("b", False, False), ("c", True, False)]
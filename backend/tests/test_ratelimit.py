@@ -0,0 +1,84 @@
+import email.utils
+import time
+
+import httpx
+import openai
+import pytest
+
+from app import ratelimit
+
+
+def status_error(status: int, headers: dict = None) -> openai.APIStatusError:
+    request = httpx.Request("POST", "http://upstream/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return openai.APIStatusError(f"Error code: {status}", response=response, body=None)
+
+
+@pytest.mark.anyio
+async def test_bucket_admits_up_to_capacity_then_waits_for_refill():
+    bucket = ratelimit.TokenBucket(600) # 10 per second
+    start = time.monotonic()
+    await bucket.take(600)
+    assert time.monotonic() - start < 0.05
+    await bucket.take(2)
+    assert time.monotonic() - start >= 0.15
+
+
+@pytest.mark.anyio
+async def test_oversized_request_is_admitted_once_the_bucket_is_full():
+    bucket = ratelimit.TokenBucket(60)
+    await bucket.take(1000)
+    assert bucket.tokens <= 0.01
+
+
+def test_settling_above_the_estimate_puts_the_bucket_in_debt():
+    bucket = ratelimit.TokenBucket(6000)
+    bucket.tokens = 100
+    bucket.adjust(300)
+    assert bucket.tokens < 0
+    bucket.adjust(-1_000_000)
+    assert bucket.tokens == bucket.capacity
+
+
+def test_limiter_is_rebuilt_when_the_provider_limits_change():
+    info = {"id": 1, "requests_per_minute": 60, "tokens_per_minute": None, "max_in_flight": 2}
+    limiter = ratelimit.get_limiter(info)
+    assert ratelimit.get_limiter(dict(info)) is limiter
+    changed = ratelimit.get_limiter({**info, "max_in_flight": 4})
+    assert changed is not limiter
+    assert changed.tokens is None and changed.requests is not None
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"retry-after": "7"}, 7.0),
+    ({"retry-after": "-3"}, 0.0),
+    ({"retry-after": "soon"}, None),
+    ({}, None),
+])
+def test_parse_retry_after(headers, expected):
+    assert ratelimit.parse_retry_after(httpx.Headers(headers)) == expected
+
+
+def test_parse_retry_after_http_date():
+    later = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 <= ratelimit.parse_retry_after(httpx.Headers({"retry-after": later})) <= 30
+
+
+def test_retry_delay_honours_retry_after():
+    delay = ratelimit.retry_delay(status_error(429, {"retry-after": "2"}), 0, 3)
+    assert 2 <= delay <= 2 + ratelimit.BACKOFF_BASE
+
+
+def test_retry_delay_backs_off_with_jitter():
+    for attempt in range(3):
+        delay = ratelimit.retry_delay(status_error(503), attempt, 5)
+        assert 0 <= delay <= ratelimit.BACKOFF_BASE * 2 ** attempt
+
+
+def test_retry_delay_gives_up():
+    assert ratelimit.retry_delay(status_error(429), 3, 3) is None
+    assert ratelimit.retry_delay(status_error(400), 0, 3) is None
+    assert ratelimit.retry_delay(ValueError("not an upstream error"), 0, 3) is None
+    connection = openai.APIConnectionError(request=httpx.Request("POST", "http://upstream"))
+    assert ratelimit.retry_delay(connection, 0, 3) is not None
@@ -0,0 +1,67 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import replay, streams
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def fixture(model: str, messages: list = MESSAGES, text: str = "hello") -> dict:
+    chunk = json.dumps({"choices": [{"index": 0, "delta": {"content": text}}]})
+    return {
+        "version": replay.FIXTURE_VERSION, "model": model, "request_hash": replay.request_hash(model, messages),
+        "time_to_headers": 0.01, "lines": [[0.02, chunk], [0.03, "[DONE]"]],
+    }
+
+
+@pytest.mark.anyio
+async def test_streams_read_to_the_end_are_recorded(tmp_path):
+    body = b'data: {"choices": [{"index": 0, "delta": {"content": "hi"}}]}\n\ndata: [DONE]\n\n'
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+    async with httpx.AsyncClient(transport=transport) as http:
+        stream = await streams.open_raw(http, "http://upstream/v1", {"model": "org/m", "messages": MESSAGES}, str(tmp_path))
+        assert [event async for event in stream.events()] == [("content", "hi")]
+        path = await stream.close()
+    assert path.startswith(str(tmp_path / "org_m"))
+
+    [saved] = replay.load_fixtures(str(tmp_path))
+    assert (saved["model"], saved["request_hash"]) == ("org/m", replay.request_hash("org/m", MESSAGES))
+    assert [payload for _, payload in saved["lines"]][-1] == "[DONE]"
+    offsets = [offset for offset, _ in saved["lines"]]
+    assert saved["time_to_headers"] <= offsets[0] and offsets == sorted(offsets)
+
+
+def test_cut_off_streams_are_not_saved(tmp_path):
+    recording = replay.Recording(str(tmp_path), "m", MESSAGES, 0.0)
+    recording.line('{"choices": []}')
+    assert recording.save() is None
+    assert replay.load_fixtures(str(tmp_path)) == []
+
+
+def test_index_prefers_the_same_request_then_the_model_then_any():
+    same = fixture("a", text="same request")
+    other_a = fixture("a", messages=[{"role": "user", "content": "other"}], text="a")
+    b = fixture("b", text="b")
+    index = replay.FixtureIndex([same, other_a, b])
+    assert index.models == ["a", "b"]
+    assert index.pick("a", MESSAGES) is same
+    assert index.pick("a", MESSAGES) is same
+    assert index.pick("a", [{"role": "user", "content": "new"}]) is same
+    assert index.pick("a", [{"role": "user", "content": "new"}]) is other_a
+    assert [index.pick("unknown", MESSAGES) for _ in range(4)] == [same, other_a, b, same]
+    with pytest.raises(ValueError):
+        replay.FixtureIndex([])
+
+
+def test_server_replays_a_fixture():
+    app = replay.create_app(replay.FixtureIndex([fixture("a")]), speed=0)
+    with TestClient(app) as client:
+        assert client.get("/v1/models").json()["data"][0]["id"] == "a"
+        assert client.post("/v1/chat/completions", json={"model": "a", "messages": MESSAGES}).status_code == 400
+        response = client.post("/v1/chat/completions", json={"model": "a", "messages": MESSAGES, "stream": True})
+    frames = response.text.strip().split("\n\n")
+    assert frames[-1] == "data: [DONE]"
+    assert json.loads(frames[0].removeprefix("data: "))["choices"][0]["delta"]["content"] == "hello"
@@ -0,0 +1,112 @@
+import json
+import time
+
+import httpx
+import openai
+import pytest
+
+from app import streams
+
+
+def sse(*payloads) -> bytes:
+    return b"".join(f"data: {p if isinstance(p, str) else json.dumps(p)}\n\n".encode() for p in payloads)
+
+
+def delta(**fields) -> dict:
+    return {"choices": [{"index": 0, "delta": fields}]}
+
+
+async def collect(body: bytes) -> list:
+    stream = streams.RawStream(httpx.Response(200, content=body, request=httpx.Request("POST", "http://upstream")))
+    return [event async for event in stream.events()]
+
+
+@pytest.mark.anyio
+async def test_decodes_content_reasoning_and_usage():
+    body = sse(
+        delta(role="assistant"),
+        delta(reasoning_content="thinking"),
+        delta(content="Hel"),
+        delta(content="lo"),
+        {"choices": [], "usage": {"prompt_tokens": 7, "completion_tokens": 2, "prompt_tokens_details": {"cached_tokens": 3}}},
+        "[DONE]",
+        delta(content="after done"),
+    )
+    assert await collect(body) == [
+        ("reasoning", "thinking"),
+        ("content", "Hel"),
+        ("content", "lo"),
+        ("usage", {"input_tokens": 7, "output_tokens": 2, "cached_input_tokens": 3}),
+    ]
+
+
+@pytest.mark.anyio
+async def test_skips_comments_and_other_fields_and_joins_multiline_data():
+    body = (
+        b": keep-alive\n\n"
+        b"event: message\nid: 1\n"
+        + b'data: {"choices": [{"index": 0,\ndata: "delta": {"content": "x"}}]}\n\n'
+        + b"\n\n"
+        + b"data:[DONE]\n\n"
+    )
+    assert await collect(body) == [("content", "x")]
+
+
+@pytest.mark.anyio
+async def test_error_event_raises_like_the_sdk():
+    body = sse(delta(content="partial"), {"error": {"message": "overloaded"}})
+    with pytest.raises(openai.APIError, match="overloaded"):
+        await collect(body)
+
+
+@pytest.mark.anyio
+async def test_open_raw_raises_status_errors_for_retry_decisions():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(429, headers={"retry-after": "1"}, json={"error": {"message": "slow down"}})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+        with pytest.raises(openai.APIStatusError) as raised:
+            await streams.open_raw(http, "http://upstream/v1/", {"model": "m", "messages": [], "stream": True})
+    assert raised.value.status_code == 429
+    assert raised.value.response.headers["retry-after"] == "1"
+
+
+@pytest.mark.anyio
+async def test_open_raw_streams_from_the_chat_completions_url():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url == "http://upstream/v1/chat/completions"
+        return httpx.Response(200, content=sse(delta(content="hi"), "[DONE]"))
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+        stream = await streams.open_raw(http, "http://upstream/v1/", {"model": "m", "messages": [], "stream": True})
+        assert [event async for event in stream.events()] == [("content", "hi")]
+        assert await stream.close() is None
+
+
+@pytest.mark.anyio
+async def test_phases_of_a_new_and_a_reused_connection(upstream):
+    payload = {"model": "m1", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+    phases = []
+    async with httpx.AsyncClient() as http:
+        for _ in range(2):
+            start = time.perf_counter()
+            stream = await streams.open_raw(http, upstream, payload)
+            assert [kind async for kind, _ in stream.events()][0] == "content"
+            await stream.close()
+            phases.append(stream.phases(start))
+    new, reused = phases
+    assert new["connection_reused"] is False and new["connect_time"] > 0
+    # Plain HTTP: no TLS handshake
+    assert new["tls_time"] is None
+    assert reused["connection_reused"] is True and reused["connect_time"] is None
+    for phase in phases:
+        assert 0 < phase["time_to_request_sent"] <= phase["time_to_headers"] <= phase["time_to_first_byte"]
+
+
+def test_phases_without_trace_events():
+    trace = streams.PhaseTrace()
+    assert trace.phases(0.0, None) == {
+        "connect_time": None, "tls_time": None, "connection_reused": True,
+        "time_to_request_sent": None, "time_to_headers": None, "time_to_first_byte": None,
+    }
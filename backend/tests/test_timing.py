@@ -0,0 +1,56 @@
+import pytest
+
+from app import timing
+
+
+def test_timeline_round_trips_within_float32_precision():
+    offsets = [0.4213, 0.4501, 0.4502, 1.9, 12.25]
+    blob = timing.pack_timeline(offsets)
+    assert len(blob) == 4 * len(offsets)
+    assert timing.unpack_timeline(blob) == pytest.approx(offsets, abs=1e-5)
+
+
+def test_empty_timeline():
+    assert timing.pack_timeline([]) == b""
+    assert timing.unpack_timeline(b"") == []
+    assert timing.unpack_timeline(None) == []
+
+
+def test_long_timeline_keeps_microsecond_gaps():
+    # Deltas rather than absolute offsets, so precision doesn't degrade late in a long stream
+    offsets = [0.5 + i * 0.000_01 for i in range(50_000)]
+    unpacked = timing.unpack_timeline(timing.pack_timeline(offsets))
+    assert unpacked[-1] - unpacked[-2] == pytest.approx(0.000_01, abs=1e-6)
+
+
+def test_percentile_interpolates_between_ranks():
+    assert timing.percentile([], 50) is None
+    assert timing.percentile([3.0], 99) == 3.0
+    assert timing.percentile([4.0, 1.0, 3.0, 2.0], 50) == 2.5
+    assert timing.percentile([1.0, 2.0, 3.0, 4.0, 5.0], 100) == 5.0
+
+
+def test_timeline_stats():
+    stats = timing.timeline_stats([0.5, 0.6, 0.7, 2.7])
+    assert stats["total_latency"] == 2.7
+    assert stats["max_stall"] == pytest.approx(2.0)
+    assert stats["itl_p50"] == pytest.approx(0.1)
+    assert timing.timeline_stats([0.5], total_latency=3.0) == {
+        "total_latency": 3.0, "itl_p50": None, "itl_p99": None, "max_stall": None,
+    }
+
+
+def test_timeline_endpoint_unpacks_the_stored_generation(client, upstream):
+    provider = client.post("/api/providers/", json={"name": "mock", "base_url": upstream, "api_key": "k"}).json()
+    client.post(f"/api/providers/{provider['id']}/sync_models")
+    model_id = client.get("/api/models/").json()[0]["id"]
+    conv = client.post("/api/conversations/", json={"title": "t", "system_prompt": "s"}).json()
+    reply = client.post("/api/chat/", json={
+        "conversation_id": conv["id"], "models_to_use": [model_id], "system_prompt": "s", "message": "hi",
+    }).json()[1]
+    timeline = client.get(f"/api/generations/{reply['generation_metadata'][0]['id']}/timeline").json()
+    # One offset per content chunk the mock sent
+    assert len(timeline["offsets"]) == 5
+    assert timeline["offsets"] == sorted(timeline["offsets"])
+    assert len(timeline["inter_token_latencies"]) == 4
+    assert timeline["time_to_first_token"] == pytest.approx(timeline["offsets"][0], abs=1e-5)
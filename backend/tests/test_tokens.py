@@ -0,0 +1,66 @@
+import math
+from unittest.mock import Mock
+
+from app import tokens
+from app.lru import LRUCache
+
+
+def turn(role: str, content: str) -> dict:
+    return {"role": role, "content": content}
+
+
+HISTORY = [
+    turn("user", "first question"), turn("assistant", "first answer"), turn("assistant", "another model's answer"),
+    turn("user", "second question"), turn("assistant", "second answer"),
+]
+
+
+def cost(*messages) -> int:
+    return sum(tokens.count(m["content"]) + tokens.MESSAGE_OVERHEAD for m in messages)
+
+
+def fixed() -> int:
+    return tokens.count_messages([{"content": "system"}, {"content": "new question"}])
+
+
+def test_without_a_budget_everything_is_kept():
+    assert tokens.fit_history("system", HISTORY, "new question", None) == (HISTORY, 0)
+
+
+def test_history_that_fits_is_kept_whole():
+    budget = fixed() + cost(*HISTORY)
+    assert tokens.fit_history("system", HISTORY, "new question", budget) == (HISTORY, 0)
+
+
+def test_oldest_exchanges_are_left_out_whole():
+    # One token short of the full history: the whole first exchange goes, not just its question
+    budget = fixed() + cost(*HISTORY) - 1
+    assert tokens.fit_history("system", HISTORY, "new question", budget) == (HISTORY[3:], 3)
+    assert tokens.fit_history("system", HISTORY, "new question", fixed() + cost(*HISTORY[3:])) == (HISTORY[3:], 3)
+
+
+def test_everything_goes_when_nothing_fits():
+    assert tokens.fit_history("system", HISTORY, "new question", 1) == ([], 5)
+
+
+def test_counts_are_memoized_per_text(monkeypatch):
+    encoding = Mock()
+    encoding.encode.return_value = [1, 2, 3]
+    monkeypatch.setattr(tokens, "_encoding", encoding)
+    monkeypatch.setattr(tokens, "memo", LRUCache(10, 10, math.inf))
+    text = "a long turn of the history " * 100
+    # An equal text built again, as a turn reloaded on the next request would be
+    assert tokens.count(text) == tokens.count("".join(["a long turn of the history "] * 100)) == 3
+    encoding.encode.assert_called_once_with(text, disallowed_special=())
+    assert tokens.count("") == tokens.count(None) == 0
+    assert tokens.count_messages([]) == tokens.REPLY_OVERHEAD
+
+
+def test_input_budget_reserves_room_for_the_reply(monkeypatch):
+    monkeypatch.setattr(tokens, "CONTEXT_OUTPUT_RESERVE", 4096)
+    assert tokens.input_budget(None, None) is None
+    assert tokens.input_budget(None, 1000) == 1000
+    assert tokens.input_budget(128_000, None) == 128_000 - 4096
+    assert tokens.input_budget(128_000, 8000) == 8000
+    # Small windows keep at most a quarter for the reply
+    assert tokens.input_budget(8000, None) == 6000
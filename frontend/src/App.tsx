@@ -12,9 +12,9 @@ function Sidebar() {
   useEffect(() => {
     const fetchConvs = () => {
       const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
-      fetch(`${apiUrl}/api/conversations/`)
+      fetch(`${apiUrl}/api/conversations/summary?limit=100`)
         .then(res => res.json())
-        .then(data => setConversations(data))
+        .then(data => setConversations(data.items || []))
         .catch(console.error);
     };
 
@@ -1,6 +1,6 @@
 import { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router';
-import { Send, Settings2, Cpu, Clock, Zap, Copy, Edit2, RotateCw } from 'lucide-react';
+import { Send, Settings2, Cpu, Clock, Zap, Copy, Edit2, RotateCw, Square, ChevronLeft, ChevronRight } from 'lucide-react';
 
 export default function ChatView() {
     const { id } = useParams();
@@ -31,17 +31,27 @@ export default function ChatView() {
             .catch(err => console.error(err));
     }, []);
 
+    // Shows the active branch; `data` is a conversation page, e.g. the response of activating a branch
+    const loadConversation = async (data?: any) => {
+        const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+        data = data ?? await fetch(`${apiUrl}/api/conversations/${id}`).then(res => res.json());
+        setSystemPrompt(data.system_prompt || 'You are a helpful assistant.');
+        let loaded: any[] = data.messages || [];
+        setMessages(loaded);
+        // The conversation endpoint returns only the latest page; walk back for the rest
+        let hasMore = data.has_more_messages && loaded.length > 0;
+        while (hasMore) {
+            const page = await fetch(`${apiUrl}/api/conversations/${id}/messages?before_seq=${loaded[0].seq}&limit=500`).then(res => res.json());
+            loaded = [...(page.items || []), ...loaded];
+            setMessages(loaded);
+            hasMore = page.has_more && page.items.length > 0;
+        }
+    };
+
     // Fetch conversation if id exists
     useEffect(() => {
         if (id) {
-            const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
-            fetch(`${apiUrl}/api/conversations/${id}`)
-                .then(res => res.json())
-                .then(data => {
-                    setSystemPrompt(data.system_prompt || 'You are a helpful assistant.');
-                    setMessages(data.messages || []);
-                })
-                .catch(err => console.error(err));
+            loadConversation().catch(err => console.error(err));
         } else {
             setMessages([]);
             setSystemPrompt('You are a helpful assistant.');
@@ -74,8 +84,8 @@ export default function ChatView() {
                 })
             });
             if (res.ok) {
-                const data = await res.json();
-                setMessages(data);
+                // The new reply is stored next to the old one; reload for the updated branch switchers
+                await loadConversation();
             }
         } catch (err) {
             console.error(err);
@@ -87,7 +97,7 @@ export default function ChatView() {
     const submitEdit = async (messageId: number) => {
         if (!id || selectedModels.length === 0) return;
 
-        // Optimistically update UI: update the edited message text and remove all subsequent messages immediately
+        // Optimistically update UI: show the edited text and hide the old branch's later messages; they stay on the server
         setMessages(prev => {
             const msgIndex = prev.findIndex(m => m.id === messageId);
             if (msgIndex === -1) return prev;
@@ -112,8 +122,8 @@ export default function ChatView() {
                 })
             });
             if (res.ok) {
-                const data = await res.json();
-                setMessages(data);
+                // The edit starts a new branch; reload for its messages and the branch switchers
+                await loadConversation();
             }
         } catch (err) {
             console.error(err);
@@ -122,6 +132,46 @@ export default function ChatView() {
         }
     };
 
+    // Edits and regenerations keep the earlier versions; step through them with ‹ i/n ›
+    const switchBranch = async (msg: any, step: number) => {
+        const branchIds: number[] = msg.branch_ids || [];
+        const target = branchIds[branchIds.indexOf(msg.id) + step];
+        if (!id || target === undefined) return;
+        try {
+            const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+            const res = await fetch(`${apiUrl}/api/messages/${target}/activate`, { method: 'POST' });
+            if (res.ok) {
+                await loadConversation(await res.json());
+            }
+        } catch (err) {
+            console.error(err);
+        }
+    };
+
+    const branchSwitcher = (msg: any, tone: string) => {
+        const branchIds: number[] = msg.branch_ids || [];
+        if (branchIds.length < 2) return null;
+        const index = branchIds.indexOf(msg.id);
+        return (
+            <span className={`flex items-center gap-1 ${tone}`}>
+                <button onClick={() => switchBranch(msg, -1)} disabled={isLoading || index <= 0} className="hover:text-white disabled:opacity-40 cursor-pointer" title="Previous version"><ChevronLeft size={12} /></button>
+                {index + 1}/{branchIds.length}
+                <button onClick={() => switchBranch(msg, 1)} disabled={isLoading || index >= branchIds.length - 1} className="hover:text-white disabled:opacity-40 cursor-pointer" title="Next version"><ChevronRight size={12} /></button>
+            </span>
+        );
+    };
+
+    const handleStop = async () => {
+        if (!id) return;
+        // In-flight replies end early and come back with their partial output
+        const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+        await fetch(`${apiUrl}/api/chat/cancel/`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ conversation_id: parseInt(id) })
+        }).catch(console.error);
+    };
+
     const handleSend = async () => {
         if (!input.trim() || selectedModels.length === 0) return;
 
@@ -160,8 +210,9 @@ export default function ChatView() {
                     message: userMsg
                 })
             });
-            const chatData = await chatRes.json();
-            setMessages(chatData);
+            // Response holds only this turn: the saved user message and each model's reply
+            const chatData: any[] = await chatRes.json();
+            setMessages(prev => [...prev.slice(0, -1), ...chatData]);
 
         } catch (e) {
             console.error(e);
@@ -182,7 +233,7 @@ export default function ChatView() {
                 <div className="flex flex-col gap-3 max-h-48 overflow-y-auto">
                     {allModels.length === 0 && <span className="text-xs text-red-400">No models available. Add them in Settings.</span>}
                     {providers.map(p => {
-                        const pModels = allModels.filter(m => m.provider_id === p.id && m.enabled !== false);
+                        const pModels = allModels.filter(m => m.provider_id === p.id && m.enabled !== false && !m.delisted);
                         if (pModels.length === 0) return null;
                         return (
                             <div key={p.id} className="flex flex-col gap-1.5">
@@ -303,6 +354,7 @@ export default function ChatView() {
                                         {isUser ? (
                                             <>
                                                 <span className="text-blue-200 opacity-70">You</span>
+                                                {!editingMessageId && branchSwitcher(msg, 'text-blue-100 opacity-70')}
                                                 {!editingMessageId && (
                                                     <div className="flex gap-3 ml-auto opacity-70">
                                                         <button onClick={() => handleCopy(msg.content)} className="text-blue-100 hover:text-white transition-colors flex items-center gap-1 cursor-pointer" title="Copy"><Copy size={12} /> Copy</button>
@@ -323,8 +375,17 @@ export default function ChatView() {
                                                                     <span className="font-semibold text-blue-400">
                                                                         {provider ? `${provider.name} / ` : ''}{model?.name || 'Model'}
                                                                     </span>
-                                                                    <span className="flex items-center gap-1 text-gray-400"><Clock size={10} /> {(meta.time_to_first_token || 0).toFixed(2)}s TTFT</span>
-                                                                    <span className="flex items-center gap-1 text-gray-400"><Zap size={10} /> {(meta.tokens_per_second || 0).toFixed(1)} t/s</span>
+                                                                    {(meta.status === 'cancelled' || meta.status === 'timed_out') && (
+                                                                        <span className="text-red-400" title="Partial output">{meta.status === 'cancelled' ? 'stopped' : 'timed out'}</span>
+                                                                    )}
+                                                                    {meta.cache_hit ? (
+                                                                        <span className="text-amber-400" title="Served from the response cache">cached</span>
+                                                                    ) : (
+                                                                        <>
+                                                                            <span className="flex items-center gap-1 text-gray-400"><Clock size={10} /> {(meta.time_to_first_token || 0).toFixed(2)}s TTFT</span>
+                                                                            <span className="flex items-center gap-1 text-gray-400"><Zap size={10} /> {(meta.tokens_per_second || 0).toFixed(1)} t/s</span>
+                                                                        </>
+                                                                    )}
                                                                     <span className="text-gray-400" title="Output Tokens">{meta.output_tokens} out tokens</span>
                                                                     {(meta.input_tokens !== null && meta.input_tokens !== undefined) && (
                                                                         <span className="text-gray-400" title="Input Tokens">
@@ -339,6 +400,7 @@ export default function ChatView() {
                                                 )}
                                                 <div className="flex items-center gap-3 mt-1 pt-2 border-t border-[#2d3139]/50 text-xs w-full">
                                                     <button onClick={() => handleCopy(msg.content)} className="text-gray-400 hover:text-white transition-colors flex items-center gap-1 cursor-pointer" title="Copy"><Copy size={12} /> Copy</button>
+                                                    {branchSwitcher(msg, 'text-gray-400')}
                                                     <button onClick={() => handleRegenerate(msg.id)} disabled={isLoading} className="text-gray-400 hover:text-blue-400 disabled:opacity-50 transition-colors flex items-center gap-1 ml-auto cursor-pointer" title="Regenerate"><RotateCw size={12} /> Regenerate</button>
                                                 </div>
                                             </div>
@@ -355,6 +417,9 @@ export default function ChatView() {
                             <div className="w-1.5 h-1.5 bg-gray-400 rounded-full animate-bounce [animation-delay:-0.3s]"></div>
                             <div className="w-1.5 h-1.5 bg-gray-400 rounded-full animate-bounce [animation-delay:-0.15s]"></div>
                             <div className="w-1.5 h-1.5 bg-gray-400 rounded-full animate-bounce"></div>
+                            {id && (
+                                <button onClick={handleStop} className="ml-3 text-gray-400 hover:text-red-400 transition-colors flex items-center gap-1 text-xs cursor-pointer" title="Stop generating"><Square size={10} /> Stop</button>
+                            )}
                         </div>
                     </div>
                 )}
@@ -54,6 +54,19 @@ export default function SettingsView() {
         }
     };
 
+    const syncAllModels = async () => {
+        setIsLoading(true);
+        try {
+            const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+            await fetch(`${apiUrl}/api/providers/sync_models`, { method: 'POST' });
+            await fetchSettings();
+        } catch (e) {
+            console.error(e);
+        } finally {
+            setIsLoading(false);
+        }
+    };
+
     const deleteProvider = async (id: number) => {
         try {
             const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
@@ -77,9 +90,19 @@ export default function SettingsView() {
     return (
         <div className="h-full overflow-y-auto w-full p-8 bg-[#0f1115]">
             <div className="max-w-4xl mx-auto space-y-8">
-                <div>
-                    <h1 className="text-3xl font-bold bg-gradient-to-r from-white to-gray-400 bg-clip-text text-transparent mb-2">Providers & Models</h1>
-                    <p className="text-sm text-gray-400">Configure your OpenAI-compatible endpoints to start evaluating LLMs.</p>
+                <div className="flex items-end justify-between">
+                    <div>
+                        <h1 className="text-3xl font-bold bg-gradient-to-r from-white to-gray-400 bg-clip-text text-transparent mb-2">Providers & Models</h1>
+                        <p className="text-sm text-gray-400">Configure your OpenAI-compatible endpoints to start evaluating LLMs.</p>
+                    </div>
+                    {providers.length > 0 && (
+                        <button
+                            onClick={syncAllModels} disabled={isLoading}
+                            className="flex items-center gap-2 bg-[#2d3139] hover:bg-[#3b414d] text-gray-200 px-3 py-1.5 rounded-md text-xs font-medium transition-colors"
+                        >
+                            <RefreshCw size={14} className={isLoading ? "animate-spin" : ""} /> Sync All
+                        </button>
+                    )}
                 </div>
 
                 {/* Add Provider Form */}
@@ -163,6 +186,7 @@ export default function SettingsView() {
                                             </div>
                                             <div className="flex items-center justify-between mt-3">
                                                 <span className="text-[10px] text-gray-500 truncate">{m.model_id}</span>
+                                                {m.delisted && <span className="text-[10px] bg-amber-500/20 text-amber-400 px-1.5 py-0.5 rounded box-border font-medium" title="No longer listed by the provider">Delisted</span>}
                                                 {m.is_reasoning && <span className="text-[10px] bg-purple-500/20 text-purple-400 px-1.5 py-0.5 rounded box-border font-medium">Reasoning</span>}
                                             </div>
                                         </div>